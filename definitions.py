@@ -7,6 +7,9 @@ if not os.path.exists(DATA_PATH):
 
 CASE_BASE_FILE = os.path.join(DATA_PATH, "case_base.xml")
 CASE_LIBRARY_FILE = os.path.join(DATA_PATH, "case_library.xml")
+CASE_LIBRARY_SHARDS_PATH = os.path.join(DATA_PATH, "case_library_shards")
+SIM_WEIGHTS_FILE = os.path.join(DATA_PATH, "sim_weights.json")
+PERF_BASELINE_FILE = os.path.join(DATA_PATH, "perf_baseline.json")
 
 LOGS_PATH = os.path.join(ROOT_PATH, "logs")
 if not os.path.exists(LOGS_PATH):
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import os
 import sys
@@ -6,7 +7,17 @@ import webbrowser as wb
 from pathlib import Path
 
 from PySide6 import QtGui
-from PySide6.QtCore import QFile, Qt
+from PySide6.QtCore import (
+    QFile,
+    QObject,
+    QRunnable,
+    Qt,
+    QThreadPool,
+    QTimer,
+    Signal,
+    Slot,
+)
+from PySide6.QtGui import QKeySequence, QShortcut
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtWidgets import (
     QApplication,
@@ -19,9 +30,26 @@ from PySide6.QtWidgets import (
 
 sys.path.append(os.fspath(Path(__file__).resolve().parent.parent.parent))
 
+START_TIME = time.perf_counter()
+
 from definitions import LOG_FILE, USER_MANUAL_FILE
-from src.cbr.cbr import CBR
+from src.cbr.loader import CBRLoader
 from src.entity.query import Query
+from src.utils import metrics, profiling
+
+QUERIES = metrics.REGISTRY.counter("gui_queries_total", "Queries sent from the GUI.")
+QUERY_DURATION = metrics.REGISTRY.histogram(
+    "gui_query_duration_seconds", "Seconds from sending a query in the GUI to its adapted recipe."
+)
+LOAD_SECONDS = metrics.REGISTRY.gauge("gui_load_seconds", "Seconds taken to load the case library.")
+FIRST_INTERACTION_SECONDS = metrics.REGISTRY.gauge(
+    "gui_first_interaction_seconds", "Seconds from the start of the program until the window can be used."
+)
+# Status bar messages of the steps of CBR.run_query
+STEP_MESSAGES = {
+    "retrieve": "Searching the case library...",
+    "adapt": "Adapting the recipe...",
+}
 
 
 def _open_user_manual():
@@ -29,13 +57,77 @@ def _open_user_manual():
     wb.open_new(r"file://{}".format(USER_MANUAL_FILE))
 
 
+class WorkerSignals(QObject):
+    """
+    Signals of a :class:`Worker`. They are created in the GUI thread, so their slots run in the GUI thread.
+    """
+
+    progress = Signal(str)
+    result = Signal(object)
+    error = Signal(str)
+    finished = Signal()
+
+
+class Worker(QRunnable):
+    """
+    Runs a function in a thread of a QThreadPool and delivers its result back with signals.
+
+    The function is called with a ``progress`` keyword argument, a function that emits a progress message. A worker
+    cancelled before it starts does not run, and a worker cancelled while it runs does not deliver its result or error.
+    The ``finished`` signal is always emitted.
+
+    Parameters
+    ----------
+    fn : callable
+        The function to run.
+
+    *args, **kwargs
+        The arguments of the function.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancel the worker. It can not stop a function that is already running.
+        """
+        self.cancelled = True
+
+    @Slot()
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            result = self.fn(*self.args, progress=self.signals.progress.emit, **self.kwargs)
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        except Exception as e:
+            logging.getLogger("GUI").exception("Error in a background task")
+            if not self.cancelled:
+                self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+
 class MainWindow:
     def __init__(self):
-        self.cbr = CBR()
-        self.alc_types = self.cbr.case_library.alc_types.copy()
-        self.taste_types = self.cbr.case_library.taste_types.copy()
-        self.ingredients = self.cbr.case_library.ingredients.copy()
+        # The case library is parsed while the window is built, and set by the first task of the pool
+        self.loader = CBRLoader()
+        self.cbr = None
+        self.learner = None
+        self.completion = None
         self.window = None
+        # A single thread, so the queries and evaluations reach the CBR one at a time and in order
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.query_worker = None
+        self.state = None
         self.load_ui()
         self.init_ui()
         self.logger = logging.getLogger("GUI")
@@ -47,6 +139,36 @@ class MainWindow:
             filemode="w",
             level=logging.INFO,
         )
+        worker = Worker(self._wait_until_loaded)
+        worker.signals.result.connect(lambda _: self._cbr_loaded())
+        worker.signals.error.connect(
+            lambda message: self._show_warning("The case library could not be loaded", message)
+        )
+        self.pool.start(worker)
+        self.window.statusbar.showMessage("Loading the case library...")
+
+    def _wait_until_loaded(self, progress):
+        """
+        Wait in the pool for the CBR system to be loaded, so the queries sent before wait for it too.
+        """
+        self.cbr, self.learner = self.loader.result()
+
+    def _cbr_loaded(self):
+        # The completion index is updated when the cases are learned and can be searched from the GUI thread
+        self.completion = self.cbr.completion
+        self._init_scroll_areas(self.completion.values("drink_types"), self.completion.values("glass_types"))
+        self._init_completers()
+        self.window.statusbar.showMessage(f"Case library loaded in {self.loader.load_time:.2f} seconds.", 5000)
+        self.logger.info(f"The case library was loaded in {self.loader.load_time:.5f} seconds.")
+        LOAD_SECONDS.set(self.loader.load_time)
+
+    def report_first_interaction(self):
+        """
+        Log the time from the start of the program until the window can be used.
+        """
+        elapsed = time.perf_counter() - START_TIME
+        self.logger.info(f"Time to first interaction: {elapsed:.5f} seconds.")
+        FIRST_INTERACTION_SECONDS.set(elapsed)
 
     def load_ui(self):
         loader = QUiLoader()
@@ -61,11 +183,12 @@ class MainWindow:
 
     def init_ui(self):
         self._init_buttons()
-        self._init_scroll_areas()
+        self._init_scroll_areas([], [])
         self._init_line_edits()
         self._init_score()
         self._init_sliders()
         self.window.user_manual.triggered.connect(_open_user_manual)
+        QShortcut(QKeySequence(QKeySequence.Cancel), self.window, activated=self._cancel_query)
 
     def _init_sliders(self):
         self.window.score_slider.setValue(50)
@@ -77,114 +200,119 @@ class MainWindow:
         self.window.btn_evaluate.setEnabled(False)
         self.window.btn_add_alcohol.clicked.connect(
             lambda: self._include_to_list(
-                self.window.list_alc_includes, self.window.input_include_alc, self.alc_types, "alcohol"
+                self.window.list_alc_includes, self.window.input_include_alc, "alc_types", "alcohol"
             )
         )
         self.window.btn_add_taste.clicked.connect(
             lambda: self._include_to_list(
-                self.window.list_taste_includes, self.window.input_basic_taste, self.taste_types, "basic taste"
+                self.window.list_taste_includes, self.window.input_basic_taste, "taste_types", "basic taste"
             )
         )
         self.window.btn_add_ingr.clicked.connect(
             lambda: self._include_to_list(
-                self.window.list_ingredient_includes, self.window.input_ingredient, self.ingredients, "ingredient"
+                self.window.list_ingredient_includes, self.window.input_ingredient, "ingredients", "ingredient"
             )
             if self.window.input_ingredient.text().strip() != ""
             else None
         )
         self.window.btn_exclude_ingr.clicked.connect(
             lambda: self._include_to_list(
-                self.window.list_ingredient_excludes, self.window.input_ingredient, self.ingredients, "ingredient"
+                self.window.list_ingredient_excludes, self.window.input_ingredient, "ingredients", "ingredient"
             )
             if self.window.input_ingredient.text().strip() != ""
             else None
         )
 
-    def _init_scroll_areas(self):
-        drink_types = self.window.drink_type
-        drink_types.addItem("Any")
-        for drink in self.cbr.case_library.drink_types:
-            drink_types.addItem(drink)
+    def _init_scroll_areas(self, drink_types, glass_types):
+        self.window.drink_type.clear()
+        self.window.drink_type.addItem("Any")
+        for drink in drink_types:
+            self.window.drink_type.addItem(drink)
 
-        glass_types = self.window.glass_type
-        glass_types.addItem("Any")
-        for glass in self.cbr.case_library.glass_types:
-            glass_types.addItem(glass)
+        self.window.glass_type.clear()
+        self.window.glass_type.addItem("Any")
+        for glass in glass_types:
+            self.window.glass_type.addItem(glass)
 
     def _init_line_edits(self):
         self._init_completers()
 
         self.window.input_include_alc.returnPressed.connect(
             lambda: self._include_to_list(
-                self.window.list_alc_includes, self.window.input_include_alc, self.alc_types, "alcohol"
+                self.window.list_alc_includes, self.window.input_include_alc, "alc_types", "alcohol"
             )
         )
         self.window.list_alc_includes.itemDoubleClicked.connect(
-            lambda: self._remove_from(self.window.list_alc_includes, self.window.input_include_alc, self.alc_types)
+            lambda: self._remove_from(self.window.list_alc_includes, self.window.input_include_alc, "alc_types")
         )
 
         self.window.input_basic_taste.returnPressed.connect(
             lambda: self._include_to_list(
-                self.window.list_taste_includes, self.window.input_basic_taste, self.taste_types, "basic taste"
+                self.window.list_taste_includes, self.window.input_basic_taste, "taste_types", "basic taste"
             )
         )
         self.window.list_taste_includes.itemDoubleClicked.connect(
-            lambda: self._remove_from(self.window.list_taste_includes, self.window.input_basic_taste, self.taste_types)
+            lambda: self._remove_from(self.window.list_taste_includes, self.window.input_basic_taste, "taste_types")
         )
 
         self.window.list_ingredient_includes.itemDoubleClicked.connect(
-            lambda: self._remove_from(
-                self.window.list_ingredient_includes, self.window.input_ingredient, self.ingredients
-            )
+            lambda: self._remove_from(self.window.list_ingredient_includes, self.window.input_ingredient, "ingredients")
         )
         self.window.list_ingredient_excludes.itemDoubleClicked.connect(
-            lambda: self._remove_from(
-                self.window.list_ingredient_excludes, self.window.input_ingredient, self.ingredients
-            )
+            lambda: self._remove_from(self.window.list_ingredient_excludes, self.window.input_ingredient, "ingredients")
         )
 
     def _init_completers(self):
-        alc_completer = QCompleter(self.alc_types, self.window)
-        alc_completer.setCaseSensitivity(Qt.CaseInsensitive)
-        alc_completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
-        self.window.input_include_alc.setCompleter(alc_completer)
-
-        taste_completer = QCompleter(self.taste_types, self.window)
-        taste_completer.setCaseSensitivity(Qt.CaseInsensitive)
-        taste_completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
-        self.window.input_basic_taste.setCompleter(taste_completer)
-
-        ingredients_completer = QCompleter(self.ingredients, self.window)
-        ingredients_completer.setCaseSensitivity(Qt.CaseInsensitive)
-        ingredients_completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
-        self.window.input_ingredient.setCompleter(ingredients_completer)
-
-    def _include_to_list(self, widget_list: QListWidgetItem, line_edit: QLineEdit, types, filter_type):
+        if self.completion is None:
+            return
+        self._update_completer(self.window.input_include_alc, "alc_types")
+        self._update_completer(self.window.input_basic_taste, "taste_types")
+        self._update_completer(self.window.input_ingredient, "ingredients")
+
+    def _field_lists(self, field):
+        return {
+            "alc_types": [self.window.list_alc_includes],
+            "taste_types": [self.window.list_taste_includes],
+            "ingredients": [self.window.list_ingredient_includes, self.window.list_ingredient_excludes],
+        }[field]
+
+    def _update_completer(self, line_edit: QLineEdit, field):
+        # The values are sorted case insensitively by the index, so the completer can search them by bisection
+        chosen = {
+            list_widget.item(i).text() for list_widget in self._field_lists(field) for i in range(list_widget.count())
+        }
+        completer = QCompleter([value for value in self.completion.values(field) if value not in chosen], self.window)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+        line_edit.setCompleter(completer)
+
+    def _include_to_list(self, widget_list: QListWidgetItem, line_edit: QLineEdit, field, filter_type):
+        if self.completion is None:
+            self.window.statusbar.showMessage("The case library is still loading...", 3000)
+            return
         text = line_edit.text().strip()
         items = widget_list.findItems(text, Qt.MatchExactly)
-        if text not in types and not items:
+        if not items and not self.completion.contains(field, text):
+            message = f"There is no {filter_type} named {text}."
+            suggestions = self.completion.suggest(field, text)
+            if suggestions:
+                message += f" Did you mean {', '.join(suggestions)}?"
             QMessageBox.critical(
                 self.window,
                 "Error",
-                f"There is no {filter_type} named {text}.",
+                message,
                 buttons=QMessageBox.Close,
                 defaultButton=QMessageBox.Close,
             )
         else:
             if not items:
                 QListWidgetItem(text, widget_list)
-                types.remove(text)
-                completer = QCompleter(types, self.window)
-                completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
-                line_edit.setCompleter(completer)
+                self._update_completer(line_edit, field)
             line_edit.clear()
 
-    def _remove_from(self, list_widget: QListWidget, line_edit: QLineEdit, types):
+    def _remove_from(self, list_widget: QListWidget, line_edit: QLineEdit, field):
         item = list_widget.takeItem(list_widget.currentRow())
-        types.append(item.text())
-        completer = QCompleter(sorted(types), self.window)
-        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
-        line_edit.setCompleter(completer)
+        self._update_completer(line_edit, field)
         del item
 
     def _send_query(self):
@@ -205,39 +333,75 @@ class MainWindow:
                 self.window.list_ingredient_includes.item(i).text()
                 for i in range(self.window.list_ingredient_includes.count())
             ]
-            query.exc_ingredients = []
-            query.exc_alc_types = []
-            alcoholic_ingredients = self.cbr.case_library.ingredients_onto["alcoholic"]
-            for i in range(self.window.list_ingredient_excludes.count()):
-                ingredient = self.window.list_ingredient_excludes.item(i).text()
-                query.exc_ingredients.append(ingredient)
-                alcohol = alcoholic_ingredients.get(ingredient, None)
-                if alcohol is not None and alcohol not in query.alc_types:
-                    query.exc_alc_types.append(alcohol)
-
             query.exc_ingredients = [
                 self.window.list_ingredient_excludes.item(i).text()
                 for i in range(self.window.list_ingredient_excludes.count())
             ]
-            start_time = time.perf_counter()
-            retrieved_case, adapted_case = self.cbr.run_query(query, recipe_name)
-            self.logger.info(f"The system spent {time.perf_counter() - start_time:.5f} seconds to retrieve and adapt.")
-            self._reset()
-            self.window.retrieved_case.setPlainText(str(retrieved_case))
-            self.window.adapted_case.setPlainText(str(adapted_case))
-            self.window.btn_evaluate.setEnabled(True)
-            self.window.score_slider.setEnabled(True)
             self.window.btn_run.setEnabled(False)
+            worker = Worker(self._run_query, query, recipe_name)
+            worker.signals.progress.connect(self.window.statusbar.showMessage)
+            worker.signals.result.connect(self._show_query_result)
+            worker.signals.error.connect(lambda message: self._show_warning("Query failed", message))
+            worker.signals.finished.connect(lambda: self._query_finished(worker))
+            self.query_worker = worker
+            self.pool.start(worker)
+
+    def _run_query(self, query, recipe_name, progress):
+        """
+        Run a query in a worker thread. The GUI is only updated by the slots of the worker signals.
+        """
+        start_time = time.perf_counter()
+        query.exc_alc_types = []
+        alcoholic_ingredients = self.cbr.case_library.ingredients_onto["alcoholic"]
+        for ingredient in query.exc_ingredients:
+            alcohol = alcoholic_ingredients.get(ingredient, None)
+            if alcohol is not None and alcohol not in query.alc_types:
+                query.exc_alc_types.append(alcohol)
+        if not self.learner.lock.acquire(blocking=False):
+            progress("Waiting for the case library to be updated...")
+            self.learner.lock.acquire()
+        try:
+            retrieved_case, adapted_case = self.cbr.run_query(
+                query, recipe_name, progress=lambda step: progress(STEP_MESSAGES[step])
+            )
+            elapsed = time.perf_counter() - start_time
+            self.logger.info(f"The system spent {elapsed:.5f} seconds to retrieve and adapt.")
+            QUERIES.inc()
+            QUERY_DURATION.observe(elapsed)
+            return retrieved_case, adapted_case, self.cbr.get_state()
+        finally:
+            self.learner.lock.release()
+
+    def _show_query_result(self, result):
+        retrieved_case, adapted_case, self.state = result
+        self._reset()
+        self.window.retrieved_case.setPlainText(str(retrieved_case))
+        self.window.adapted_case.setPlainText(str(adapted_case))
+        self.window.btn_evaluate.setEnabled(True)
+        self.window.score_slider.setEnabled(True)
+        self.window.btn_run.setEnabled(False)
+
+    def _query_finished(self, worker):
+        if worker is not self.query_worker:
+            return
+        self.query_worker = None
+        self.window.statusbar.clearMessage()
+        if not self.window.btn_evaluate.isEnabled():
+            self.window.btn_run.setEnabled(True)
+
+    def _cancel_query(self):
+        if self.query_worker is not None:
+            self.query_worker.cancel()
+            self.query_worker = None
+            self.window.statusbar.showMessage("Query cancelled.", 3000)
+            self.window.btn_run.setEnabled(True)
 
     def _reset(self):
-        self.alc_types = self.cbr.case_library.alc_types.copy()
-        self.taste_types = self.cbr.case_library.taste_types.copy()
-        self.ingredients = self.cbr.case_library.ingredients.copy()
+        self._clear_item_lists()
         self._init_completers()
         self._clear_line_edits()
         self.window.drink_type.setCurrentIndex(0)
         self.window.glass_type.setCurrentIndex(0)
-        self._clear_item_lists()
         self.window.retrieved_case.clear()
         self.window.adapted_case.clear()
         self._reset_slider()
@@ -256,7 +420,10 @@ class MainWindow:
 
     def _send_evaluation(self):
         score = self.window.score_slider.value() / 100
-        self.cbr.evaluate(score)
+        # The state is read now, since the next query replaces it before the worker may run
+        state = self.state
+        # Syncing the journal to disk is done in the worker thread too
+        self.pool.start(Worker(lambda progress: self.learner.submit(score, state)))
         self._init_sliders()
         self.window.btn_evaluate.setEnabled(False)
         self.window.btn_run.setEnabled(True)
@@ -290,8 +457,29 @@ class MainWindow:
         self.window.score_label.setText(f"Score: 5.0")
         self.window.score_slider.setValue(50)
 
+    def close(self):
+        """
+        Cancel the pending query, wait for the running tasks and apply the remaining evaluations.
+        """
+        self._cancel_query()
+        self.pool.waitForDone()
+        if self.learner is not None:
+            self.learner.close()
+
 
 if __name__ == "__main__":
-    app = QApplication([])
+    parser = argparse.ArgumentParser(description="Graphical user interface of the CBR.")
+    profiling.add_arguments(parser)
+    metrics.add_arguments(parser)
+    # The other arguments are left to Qt
+    args, qt_args = parser.parse_known_args()
+    profiling.configure_from_args(args)
+    exporter = metrics.start_from_args(args)
+    app = QApplication(sys.argv[:1] + qt_args)
     widget = MainWindow()
-    sys.exit(app.exec())
+    QTimer.singleShot(0, widget.report_first_interaction)
+    exit_code = app.exec()
+    widget.close()
+    if exporter is not None:
+        exporter.close()
+    sys.exit(exit_code)
@@ -1,24 +1,38 @@
+import argparse
+import json
+import logging
 import os
 import random
 import re
 import sys
+import time
 from pathlib import Path
 
 sys.path.append(os.fspath(Path(__file__).resolve().parent.parent.parent))
 
+START_TIME = time.perf_counter()
+
+from src.cbr.batch import learn_batch, read_queries, run_batch
 from src.cbr.cbr import CBR
+from src.cbr.learning_queue import BackgroundLearner
+from src.cbr.loader import CBRLoader
 from src.entity.query import Query
+from src.utils import metrics, profiling
 
-query = Query()
-cbr = CBR()
+BATCH_QUERIES = metrics.REGISTRY.counter(
+    "cli_batch_queries_total", "Queries of the batches run from the CLI.", labels=("result",)
+)
 
 
-def all_inputs_exist(elements, possible_values):
+def all_inputs_exist(elements, completion, field):
     for element in elements:
-        if element in possible_values:
+        if completion.contains(field, element):
             continue
         else:
             print(f'-- Error. "{element}" is not in the library. Another value must be specified.')
+            suggestions = completion.suggest(field, element)
+            if suggestions:
+                print(f"-- Did you mean: {', '.join(suggestions)}?")
             return False
     return True
 
@@ -36,75 +50,200 @@ def score_is_valid(score):
         return False
 
 
-print("- Welcome to CBR Cocktails.")
-print('- Please, enter the name of the recipe and your preferences. Write "suggest" to see examples.\n')
-
-messages = [
-    "- Type of drink (e.g.: beer, ordinary drink): ",
-    "- Type of glass (e.g.: old-fashioned glass, pint glass): ",
-    "- Type of alcohol (e.g.: gin, triple sec): ",
-    "- Taste of the drink (e.g.: sour, salty): ",
-    "- Ingredients (e.g: cherry, rum): ",
-    "- Ingredients to exclude (e.g: banana, vodka): ",
-]
-
-actions = [
-    query.set_category,
-    query.set_glass,
-    query.set_alc_types,
-    query.set_basic_tastes,
-    query.set_ingredients,
-    query.set_exc_ingredients,
-]
-
-suggestion_pools = [
-    list(map(str, cbr.case_library.drink_types)),
-    list(map(str, cbr.case_library.glass_types)),
-    list(map(str, cbr.case_library.alc_types)),
-    list(map(str, cbr.case_library.taste_types)),
-    list(map(str, cbr.case_library.ingredients)),
-    list(map(str, cbr.case_library.ingredients)),
-]
-
-while True:
-    recipe_name = input("- Name of the recipe: ")
-    if recipe_name:
-        break
-    else:
-        print("-- Error. A name must be specified.")
-for message, action, suggestion_pool in zip(messages, actions, suggestion_pools):
-    print("")
+def interactive(**cbr_kwargs):
+    """
+    Run a query and its evaluation, asking the user for the values.
+    """
+    query = Query()
+    # The case library is parsed while the user enters the name of the recipe
+    loader = CBRLoader(**cbr_kwargs)
+
+    print("- Welcome to CBR Cocktails.")
+    print(
+        '- Please, enter the name of the recipe and your preferences. Write "suggest" to see examples, or "suggest" '
+        "followed by the start of a value to complete it.\n"
+    )
+
+    messages = [
+        "- Type of drink (e.g.: beer, ordinary drink): ",
+        "- Type of glass (e.g.: old-fashioned glass, pint glass): ",
+        "- Type of alcohol (e.g.: gin, triple sec): ",
+        "- Taste of the drink (e.g.: sour, salty): ",
+        "- Ingredients (e.g: cherry, rum): ",
+        "- Ingredients to exclude (e.g: banana, vodka): ",
+    ]
+
+    actions = [
+        query.set_category,
+        query.set_glass,
+        query.set_alc_types,
+        query.set_basic_tastes,
+        query.set_ingredients,
+        query.set_exc_ingredients,
+    ]
+
+    first_interaction = time.perf_counter() - START_TIME
     while True:
-        # Takes input and removes extra spaces, empty elements and repeated elements
-        x = list(set(filter(None, re.sub(" +", " ", input(message)).split(", "))))
-        if (action == query.set_category or action == query.set_glass) and len(x) != 1:
-            if len(x) < 1:
-                print("-- Error. A value must be specified.")
-            if len(x) > 1:
-                print("-- Error. This field accepts only one value.")
-        elif not x:
+        recipe_name = input("- Name of the recipe: ")
+        if recipe_name:
             break
-        elif x == ["suggest"]:
-            print(f"-- Suggestions: {', '.join(random.sample(suggestion_pool, min(5, len(suggestion_pool))))}")
-        elif action == query.set_exc_ingredients and any(map(lambda i: i in x, query.get_ingredients())):
-            print("-- Error. Ingredients to exclude can not be present in the ingredients to include list.")
         else:
-            if all_inputs_exist(x, suggestion_pool):
-                action(x)
+            print("-- Error. A name must be specified.")
+
+    if not loader.ready():
+        print("- Loading the case library...")
+    cbr, learner = loader.result()
+    logger = logging.getLogger("CLI")
+    logger.setLevel(logging.INFO)
+    logger.info(
+        f"Time to first interaction: {first_interaction:.5f} seconds. "
+        f"The case library was loaded in {loader.load_time:.5f} seconds."
+    )
+
+    fields = ["drink_types", "glass_types", "alc_types", "taste_types", "ingredients", "ingredients"]
+    for message, action, field in zip(messages, actions, fields):
+        print("")
+        while True:
+            # Takes input and removes extra spaces, empty elements and repeated elements
+            x = list(set(filter(None, re.sub(" +", " ", input(message)).split(", "))))
+            if (action == query.set_category or action == query.set_glass) and len(x) != 1:
+                if len(x) < 1:
+                    print("-- Error. A value must be specified.")
+                if len(x) > 1:
+                    print("-- Error. This field accepts only one value.")
+            elif not x:
                 break
+            elif x == ["suggest"]:
+                suggestion_pool = cbr.completion.values(field)
+                print(f"-- Suggestions: {', '.join(random.sample(suggestion_pool, min(5, len(suggestion_pool))))}")
+            elif len(x) == 1 and x[0].startswith("suggest "):
+                completions = cbr.completion.complete(field, x[0][len("suggest ") :], limit=10)
+                print(f"-- Suggestions: {', '.join(completions) if completions else 'none'}")
+            elif action == query.set_exc_ingredients and any(map(lambda i: i in x, query.get_ingredients())):
+                print("-- Error. Ingredients to exclude can not be present in the ingredients to include list.")
+            else:
+                if all_inputs_exist(x, cbr.completion, field):
+                    # The type of drink and glass are a single value
+                    action(x[0] if action in (query.set_category, query.set_glass) else x)
+                    break
+
+    retrieved_case, adapted_case = cbr.run_query(query, recipe_name)
+    print("\n- Here is the retrieved recipe:")
+    print(retrieved_case)
+    print("\n- Here is the adapted recipe:")
+    print(adapted_case)
 
-retrieved_case, adapted_case = cbr.run_query(query, recipe_name)
-print("\n- Here is the retrieved recipe:")
-print(retrieved_case)
-print("\n- Here is the adapted recipe:")
-print(adapted_case)
+    while True:
+        score = input("- Evaluate this recipe with a score from 1 to 10 (e.g.: 7.5): ")
+        if score_is_valid(score):
+            score = float(score)
+            learner.submit(score / 10)
+            break
+
+    print("\n- Evaluation sent.")
+    learner.close()
+    print("- Done.")
 
-while True:
-    score = input("- Evaluate this recipe with a score from 1 to 10 (e.g.: 7.5): ")
-    if score_is_valid(score):
-        score = float(score)
-        cbr.evaluate(score / 10)
-        break
 
-print("\n- Evaluation sent.")
-print("- Done.")
+def batch(args):
+    """
+    Run the queries of a JSONL or CSV file and write the adapted recipes as JSONL, then apply the evaluations.
+    """
+    cbr_kwargs = dict(weights_file=args.weights) if args.weights else dict()
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    evaluations = []
+    n_queries = n_errors = 0
+    start = time.perf_counter()
+    try:
+        for result, evaluation in run_batch(
+            read_queries(args.batch, args.format),
+            args.case_library,
+            n_workers=args.workers,
+            seed=args.seed,
+            chunk_size=args.chunk_size,
+            **cbr_kwargs,
+        ):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            n_queries += 1
+            n_errors += "error" in result
+            BATCH_QUERIES.labels("error" if "error" in result else "ok").inc()
+            if evaluation is not None:
+                evaluations.append(evaluation)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    wall_time = time.perf_counter() - start
+    print(
+        f"- {n_queries} queries ({n_errors} errors) in {wall_time:.2f} seconds, "
+        f"{n_queries / wall_time if wall_time else 0.0:.1f} queries/s.",
+        file=sys.stderr,
+    )
+    if args.learn and evaluations:
+        cbr = CBR(args.case_library, **cbr_kwargs)
+        # Evaluations left in the journal by the front-ends are applied first
+        BackgroundLearner(cbr).close()
+        n_applied = learn_batch(cbr, evaluations)
+        print(f"- {n_applied} evaluations applied in a single batch.", file=sys.stderr)
+    elif evaluations:
+        print(f"- {len(evaluations)} evaluations not applied, use --learn to apply them.", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command line interface of the CBR.")
+    parser.add_argument(
+        "--batch",
+        metavar="INPUT",
+        help="Run the queries of a JSONL or CSV file, or of the standard input with '-', without asking the user. "
+        "Each query has a category and optionally a name, glass, alc_types, exc_alc_types, basic_tastes, ingredients, "
+        "exc_ingredients and a score between 0 and 1. In CSV files the values of a list are separated by ';'.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "csv"],
+        help="Format of the batch input. By default it is guessed from the extension.",
+    )
+    parser.add_argument(
+        "--output", default="-", help="Path to the JSONL output of the batch, by default the standard output."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes of the batch. By default one per CPU, with 0 the queries run in the main "
+        "process.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=16, help="Number of queries sent to a worker at once.")
+    parser.add_argument(
+        "--seed", type=int, help="Seed of the random choices, so the results do not depend on the number of workers."
+    )
+    parser.add_argument(
+        "--learn", action="store_true", help="Apply the scores of the batch in a single learning step at the end."
+    )
+    parser.add_argument("--case-library", help="Path to the case library. By default the one of the data folder.")
+    parser.add_argument("--weights", help="Path to a JSON file with the similarity weights.")
+    parser.add_argument(
+        "--query-log", help="Path to a JSONL file where the queries and evaluations of the session are logged."
+    )
+    profiling.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure_from_args(args)
+    exporter = metrics.start_from_args(args)
+
+    try:
+        if args.batch:
+            batch(args)
+        else:
+            cbr_kwargs = dict(case_library_file=args.case_library)
+            if args.weights:
+                cbr_kwargs["weights_file"] = args.weights
+            if args.query_log:
+                cbr_kwargs["query_log"] = args.query_log
+            interactive(**cbr_kwargs)
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent.parent))
+
+from src.cbr.cbr import CBR
+from src.cbr.worker_pool import BrokenWorkerPool, WorkerPool
+from src.entity.cocktail import cocktail_to_dict
+from src.entity.query import Query
+from src.utils import metrics, profiling
+from src.utils.metrics import Histogram
+
+QUERY_FIELDS = {
+    "category": "drink_types",
+    "glass": "glass_types",
+    "ingredients": "ingredients",
+    "exc_ingredients": "ingredients",
+    "alc_types": "alc_types",
+    "exc_alc_types": "alc_types",
+    "basic_tastes": "taste_types",
+}
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+REQUESTS = metrics.REGISTRY.counter(
+    "service_requests_total", "Requests handled by the service by endpoint and status.", labels=("endpoint", "status")
+)
+REQUEST_DURATION = metrics.REGISTRY.histogram(
+    "service_request_duration_seconds", "Seconds taken by the requests of each endpoint.", labels=("endpoint",)
+)
+MAX_BODY = 64 * 1024
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_query(payload):
+    """
+    Build a query from the JSON payload of a request.
+
+    Raises
+    ------
+    HTTPError
+        If the payload is not a valid query.
+    """
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "The body must be a JSON object.")
+    name = payload.get("name")
+    if not isinstance(name, str) or not name:
+        raise HTTPError(400, "A name must be specified.")
+    unknown = set(payload) - set(QUERY_FIELDS) - {"name"}
+    if unknown:
+        raise HTTPError(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    if not isinstance(payload.get("category"), str) or not payload["category"]:
+        raise HTTPError(400, "A category must be specified.")
+    for field in QUERY_FIELDS:
+        value = payload.get(field, "" if field in ("category", "glass") else [])
+        if field in ("category", "glass"):
+            valid = isinstance(value, str)
+        else:
+            valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        if not valid:
+            raise HTTPError(400, f"{field} must be {'a str' if field in ('category', 'glass') else 'a list of str'}.")
+    if set(payload.get("ingredients", [])) & set(payload.get("exc_ingredients", [])):
+        raise HTTPError(400, "Ingredients to exclude can not be present in the ingredients to include list.")
+    fields = {field: payload[field] for field in QUERY_FIELDS if field in payload}
+    return Query(**fields).freeze().to_query(), name
+
+
+def _check_values(case_library, query):
+    """
+    Check that all the values of a query are in the case library.
+
+    Raises
+    ------
+    HTTPError
+        If a value is not in the case library.
+    """
+    for field, types in QUERY_FIELDS.items():
+        values = getattr(query, field)
+        for value in [values] if isinstance(values, str) else values:
+            if value and value not in getattr(case_library, types):
+                raise HTTPError(400, f'"{value}" is not in the library.')
+
+
+class CBRService:
+    """
+    Asyncio HTTP/JSON front-end of a CBR system.
+
+    Queries arriving within a small window are gathered in a batch, whose candidate cases are searched and scored at
+    once, see :meth:`CBR.retrieve_batch`. A single writer task applies all the queued evaluations at once, with a single
+    write of the case library, see :meth:`CBR.learn_evaluations`. Both run in the same single thread executor, so the
+    case library is never accessed concurrently. The queues are bounded: when one is full the request is rejected with
+    a 503 status.
+
+    Endpoints:
+
+    - ``POST /query`` with a JSON object with the ``name`` of the new recipe and the fields of
+      :class:`entity.query.Query`. It returns the ``id`` of the query, and the retrieved and adapted cases.
+    - ``POST /evaluate`` with the ``id`` of a query and a ``score`` between 0 and 1. The evaluation is queued.
+    - ``GET /metrics`` returns the latency histograms, queue sizes and counters of the service.
+
+    Parameters
+    ----------
+    cbr : :class:`cbr.cbr.CBR`
+        The CBR system.
+
+    batch_window : float, default 0.005
+        The seconds to wait for more queries after the first query of a batch.
+
+    max_batch : int, default 16
+        The maximum number of queries in a batch.
+
+    max_pending : int, default 64
+        The maximum number of queries waiting to be run.
+
+    max_writes : int, default 64
+        The maximum number of evaluations waiting to be applied.
+
+    max_sessions : int, default 1024
+        The maximum number of queries waiting for an evaluation. The oldest ones are dropped.
+
+    workers : int, default 0
+        The number of retrieval worker processes. If 0 the candidate cases of the queries are searched in the executor
+        thread, otherwise each batch is searched in parallel by a :class:`cbr.worker_pool.WorkerPool`. If a worker
+        dies, the pool is closed and the following batches are searched in the executor thread.
+    """
+
+    def __init__(
+        self, cbr, batch_window=0.005, max_batch=16, max_pending=64, max_writes=64, max_sessions=1024, workers=0
+    ):
+        self.cbr = cbr
+        # Fork the workers before the executor starts its thread
+        self.worker_pool = WorkerPool(cbr.case_library, workers) if workers else None
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_writes = max_writes
+        self.max_sessions = max_sessions
+        self._queries = None
+        self._writes = None
+        self._sessions = OrderedDict()
+        self._ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="cbr")
+        self._tasks = []
+        self._server = None
+        self.latency = {"query": Histogram(), "evaluate": Histogram(), "metrics": Histogram()}
+        self.batch_size = Histogram(BATCH_BUCKETS)
+        self.queue_wait = Histogram()
+        self.rejected = 0
+        self.errors = 0
+        self.evaluations = 0
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Start the batching and writer tasks and listen for connections.
+
+        Parameters
+        ----------
+        host : str, default '127.0.0.1'
+            The interface to listen on.
+
+        port : int, default 8080
+            The port to listen on. If 0 a free port is chosen.
+
+        Returns
+        -------
+        port : int
+            The port the service listens on.
+        """
+        self._queries = asyncio.Queue(self.max_pending)
+        self._writes = asyncio.Queue(self.max_writes)
+        self._tasks = [asyncio.create_task(self._batcher()), asyncio.create_task(self._writer())]
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stop listening, apply the queued evaluations and stop the tasks.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self._writes.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown()
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+
+    async def handle(self, method, path, body=b""):
+        """
+        Handle a request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method.
+
+        path : str
+            The path of the endpoint.
+
+        body : bytes
+            The JSON body of the request.
+
+        Returns
+        -------
+        status : int
+            The HTTP status of the response.
+
+        payload : dict
+            The JSON payload of the response.
+        """
+        start = time.perf_counter()
+        endpoint = path.split("?", 1)[0].strip("/")
+        try:
+            if endpoint not in self.latency:
+                raise HTTPError(404, f"Unknown endpoint /{endpoint}.")
+            if method != ("GET" if endpoint == "metrics" else "POST"):
+                raise HTTPError(405, f"Method {method} not allowed.")
+            if endpoint == "metrics":
+                status, payload = 200, self.metrics()
+            else:
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    raise HTTPError(400, "The body must be JSON.")
+                status, payload = await getattr(self, f"_{endpoint}")(request)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+            if e.status == 503:
+                self.rejected += 1
+        except Exception as e:
+            self.errors += 1
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        if endpoint in self.latency:
+            elapsed = time.perf_counter() - start
+            self.latency[endpoint].observe(elapsed)
+            REQUEST_DURATION.labels(endpoint).observe(elapsed)
+            REQUESTS.labels(endpoint, status).inc()
+        return status, payload
+
+    def metrics(self):
+        """
+        Get the metrics of the service.
+
+        Returns
+        -------
+        metrics : dict
+            The latency histograms of each endpoint, the histograms of the batch sizes and of the time waited by the
+            queries before being run, the queue sizes and the request counters.
+        """
+        cache = self.cbr.query_cache
+        return dict(
+            latency={endpoint: histogram.snapshot() for endpoint, histogram in self.latency.items()},
+            batch_size=self.batch_size.snapshot(),
+            queue_wait=self.queue_wait.snapshot(),
+            pending_queries=self._queries.qsize() if self._queries is not None else 0,
+            pending_writes=self._writes.qsize() if self._writes is not None else 0,
+            sessions=len(self._sessions),
+            rejected=self.rejected,
+            errors=self.errors,
+            evaluations=self.evaluations,
+            cache=cache.stats() if cache is not None else None,
+        )
+
+    async def _query(self, request):
+        query, name = _parse_query(request)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queries.put_nowait((query, name, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise HTTPError(503, "Too many pending queries.")
+        state, retrieved_case, adapted_case = await future
+        query_id = str(next(self._ids))
+        self._sessions[query_id] = state
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return 200, dict(
+            id=query_id, retrieved=cocktail_to_dict(retrieved_case), adapted=cocktail_to_dict(adapted_case)
+        )
+
+    async def _evaluate(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get("id"), str):
+            raise HTTPError(400, "The id of a query must be specified.")
+        score = request.get("score")
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 1:
+            raise HTTPError(400, "The score must be a number between 0 and 1.")
+        if request["id"] not in self._sessions:
+            raise HTTPError(404, f"Unknown query {request['id']}.")
+        if self._writes.full():
+            raise HTTPError(503, "Too many pending evaluations.")
+        self._writes.put_nowait((self._sessions.pop(request["id"]), float(score)))
+        return 202, dict(id=request["id"], status="queued")
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queries.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queries.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            now = time.perf_counter()
+            for _, _, _, queued in batch:
+                self.queue_wait.observe(now - queued)
+            self.batch_size.observe(len(batch))
+            results = await loop.run_in_executor(self._executor, self._run_batch, [item[:2] for item in batch])
+            for (_, _, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _run_batch(self, batch):
+        results = [None] * len(batch)
+        indices = []
+        for i, (query, _) in enumerate(batch):
+            try:
+                _check_values(self.cbr.case_library, query)
+                indices.append(i)
+            except HTTPError as e:
+                results[i] = e
+        # The candidates of the whole batch are searched at once, by the workers or over the case store of the CBR
+        candidates = dict.fromkeys(indices)
+        if indices:
+            queries = [batch[i][0] for i in indices]
+            try:
+                if self.worker_pool is not None:
+                    try:
+                        candidates.update(
+                            zip(indices, self.worker_pool.map(queries, self.cbr.sim_weights, self.cbr.query_cache))
+                        )
+                    except BrokenWorkerPool:
+                        # The service keeps answering, searching the case store of the CBR from now on
+                        self.worker_pool.close()
+                        self.worker_pool = None
+                if self.worker_pool is None:
+                    candidates.update(zip(indices, self.cbr.retrieve_batch(queries)))
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+                return results
+        for i in indices:
+            query, name = batch[i]
+            try:
+                retrieved_case, adapted_case = self.cbr.run_query(query, name, candidates[i])
+                results[i] = (self.cbr.get_state(), retrieved_case, adapted_case)
+            except Exception as e:
+                results[i] = e
+        return results
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # The evaluations queued while the previous batch was applied are applied together
+            evaluations = [await self._writes.get()]
+            while not self._writes.empty():
+                evaluations.append(self._writes.get_nowait())
+            try:
+                await loop.run_in_executor(
+                    self._executor, self.cbr.learn_evaluations, [(score, state) for state, score in evaluations]
+                )
+                self.evaluations += len(evaluations)
+            except Exception:
+                self.errors += len(evaluations)
+            finally:
+                for _ in evaluations:
+                    self._writes.task_done()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                header, _, value = line.decode("latin-1").partition(":")
+                headers[header.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                status, payload = 413, {"error": "The body is too large."}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.handle(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {"error": "Malformed request."}
+        content = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + content
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def request(port, method, path, payload=None, host="127.0.0.1"):
+    """
+    Send a request to a CBR service.
+
+    Parameters
+    ----------
+    port : int
+        The port of the service.
+
+    method : str
+        The HTTP method.
+
+    path : str
+        The path of the endpoint.
+
+    payload : dict or None
+        The JSON payload of the request.
+
+    host : str, default '127.0.0.1'
+        The host of the service.
+
+    Returns
+    -------
+    status : int
+        The HTTP status of the response.
+
+    payload : dict
+        The JSON payload of the response.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return status, json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+
+async def _serve(args):
+    service = CBRService(
+        CBR(args.case_library, seed=args.seed, weights_file=args.weights, query_log=args.query_log),
+        batch_window=args.batch_window / 1000,
+        max_batch=args.max_batch,
+        max_pending=args.max_pending,
+        workers=args.workers,
+    )
+    port = await service.start(args.host, args.port)
+    print(f"- CBR service listening on http://{args.host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CBR as a local HTTP/JSON service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--case-library", default=None, help="case library file or sharded case library directory")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--weights", default=None, help="JSON file with the similarity weights")
+    parser.add_argument("--batch-window", type=float, default=5.0, help="milliseconds to gather a batch of queries")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="number of retrieval worker processes")
+    parser.add_argument("--query-log", default=None, help="JSONL file where the queries and evaluations are logged")
+    profiling.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure_from_args(args)
+    exporter = metrics.start_from_args(args)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == "__main__":
+    main()
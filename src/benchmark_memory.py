@@ -0,0 +1,45 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.memory_benchmark import memory_growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory per case of the CBR as the case library grows.")
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file to grow")
+    parser.add_argument(
+        "--factors", default="1,2,4,8", help="comma separated numbers of copies of each case, by default 1,2,4,8"
+    )
+    parser.add_argument("--neighbours", type=int, default=8, help="neighbours of each case, 0 to skip the graph")
+    parser.add_argument("--output", default=None, help="path of the JSON report, by default the standard output")
+    args = parser.parse_args()
+
+    try:
+        factors = [int(factor) for factor in args.factors.split(",")]
+    except ValueError:
+        parser.error(f"Invalid factors {args.factors!r}")
+    results = memory_growth(args.case_library, factors, n_neighbours=args.neighbours)
+    for result in results:
+        marginal = result["marginal_bytes_per_case"]
+        print(
+            f"{result['n_cases']:>7} cases: {result['total'] / 2**20:8.1f} MiB, "
+            f"{result['bytes_per_case']:8.0f} bytes per case"
+            + (f", {marginal:8.0f} bytes per added case" if marginal is not None else ""),
+            file=sys.stderr,
+        )
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
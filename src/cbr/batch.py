@@ -0,0 +1,273 @@
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from src.cbr.cbr import CBR
+from src.cbr.learning_queue import evaluation_record, resolve_record
+from src.entity.cocktail import cocktail_to_dict
+from src.entity.query import Query
+
+# The fields of a query record and the vocabulary of the case library their values belong to
+QUERY_FIELDS = {
+    "category": "drink_types",
+    "glass": "glass_types",
+    "alc_types": "alc_types",
+    "exc_alc_types": "alc_types",
+    "basic_tastes": "taste_types",
+    "ingredients": "ingredients",
+    "exc_ingredients": "ingredients",
+}
+LIST_SEPARATOR = ";"
+
+
+def read_queries(path, fmt=None):
+    """
+    Read query records from a JSONL or CSV file.
+
+    In a CSV file the columns are the fields of the records, and the values of the list fields are separated by
+    :data:`LIST_SEPARATOR`, e.g. ``lime;mint``. Empty lines are skipped.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file, or "-" to read the standard input.
+
+    fmt : {"jsonl", "csv"} or None
+        The format of the file. If None it is guessed from the extension, and it is JSONL if there is none.
+
+    Yields
+    ------
+    line : int
+        The line of the record, starting at 1. For a CSV file it is the number of the row, without the header.
+
+    record : dict
+        The record, with the fields ``name``, ``score`` and the ones of :data:`QUERY_FIELDS`, all optional. If the
+        line is not a valid record it has only an ``error`` field.
+    """
+    if fmt is None:
+        fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            for line, row in enumerate(csv.DictReader(f), start=1):
+                record = dict()
+                for key, value in row.items():
+                    value = (value or "").strip()
+                    if key is None or not value:
+                        continue
+                    if key in QUERY_FIELDS and key not in ("category", "glass"):
+                        value = [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+                    record[key] = value
+                yield line, record
+        else:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError as e:
+                    record = dict(error=f"Invalid JSON: {e}")
+                yield line, record
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def query_from_record(record, completion=None):
+    """
+    Build a query from a record of :func:`read_queries`.
+
+    Parameters
+    ----------
+    record : dict
+        The record.
+
+    completion : :class:`cbr.completion.CompletionIndex` or None
+        If given, the values of the query must be in it.
+
+    Returns
+    -------
+    query : :class:`entity.query.Query`
+        The query.
+
+    score : float or None
+        The score of the adapted recipe, between 0 and 1, or None if the record has no score.
+
+    Raises
+    ------
+    ValueError
+        If the record is not a valid query.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("The record must be an object.")
+    if "error" in record:
+        raise ValueError(record["error"])
+    unknown = set(record) - set(QUERY_FIELDS) - {"name", "score"}
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+    query = Query()
+    for field, vocabulary in QUERY_FIELDS.items():
+        value = record.get(field, "" if field in ("category", "glass") else [])
+        if field in ("category", "glass"):
+            if not isinstance(value, str):
+                raise ValueError(f"{field} must be a str.")
+            values = [value] if value else []
+        else:
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f"{field} must be a list of str.")
+            values = value
+        if completion is not None:
+            for item in values:
+                if not completion.contains(vocabulary, item):
+                    raise ValueError(f'"{item}" is not in the library.')
+        setattr(query, field, value)
+    if not query.category:
+        raise ValueError("A category must be specified.")
+    if set(query.ingredients) & set(query.exc_ingredients):
+        raise ValueError("Ingredients to exclude can not be present in the ingredients to include list.")
+    score = record.get("score")
+    if score is not None:
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            raise ValueError("score must be a number.") from None
+        if not 0 <= score <= 1:
+            raise ValueError("score must be between 0 and 1.")
+    return query, score
+
+
+_cbr = None
+_seed = None
+
+
+def _init_worker(case_library_file, seed, cbr_kwargs):
+    global _cbr, _seed
+    _cbr = CBR(case_library_file, **cbr_kwargs)
+    _seed = seed
+
+
+def _run_queries(records):
+    """
+    Run the given query records with the CBR of the worker.
+    """
+    cbr = _cbr
+    results = []
+    for line, record in records:
+        name = record.get("name") if isinstance(record, dict) else None
+        if not isinstance(name, str) or not name:
+            name = f"Recipe {line}"
+        try:
+            query, score = query_from_record(record, cbr.completion)
+            if _seed is not None:
+                # Seed each query, so the ties are broken the same way whatever worker runs it
+                random.seed(f"{_seed}-{line}")
+            retrieved_case, adapted_case = cbr.run_query(query, name)
+        except Exception as e:
+            results.append((dict(line=line, name=name, error=str(e)), None))
+            continue
+        result = dict(
+            line=line, name=name, retrieved=cocktail_to_dict(retrieved_case), adapted=cocktail_to_dict(adapted_case)
+        )
+        evaluation = None
+        if score is not None:
+            result["score"] = score
+            evaluation = evaluation_record(score, cbr.get_state())
+        results.append((result, evaluation))
+    return results
+
+
+def run_batch(records, case_library_file=None, n_workers=None, seed=None, chunk_size=16, **cbr_kwargs):
+    """
+    Run query records across a pool of processes, each with its own copy of the case library.
+
+    The records are sent to the workers in chunks, and at most two chunks per worker are pending at once, so the
+    records are read and the results yielded as the queries run. The case library is not changed: the evaluations of
+    the records with a score are yielded to be applied at the end with :func:`learn_batch`.
+
+    Parameters
+    ----------
+    records : iterable of tuple
+        The line and record of each query, e.g. from :func:`read_queries`.
+
+    case_library_file : str or None
+        The path to the case library. If None it uses the default case library.
+
+    n_workers : int or None
+        The number of worker processes. If None it uses one per CPU. If 0 the queries run in this process.
+
+    seed : int or None
+        The seed of the random choices of the CBR. If given, the results do not depend on the number of workers.
+
+    chunk_size : int, default 16
+        The number of records sent to a worker at once.
+
+    **cbr_kwargs
+        Arguments of the :class:`cbr.cbr.CBR` of the workers.
+
+    Yields
+    ------
+    result : dict
+        The ``line`` and ``name`` of the record, and either the ``retrieved`` and ``adapted`` recipes, from
+        :func:`entity.cocktail.cocktail_to_dict`, or the ``error`` of the query. Results are in the order of the
+        records.
+
+    evaluation : dict or None
+        The evaluation record of the query, from :func:`cbr.learning_queue.evaluation_record`, if the record has a
+        score.
+    """
+    records = iter(records)
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+    if n_workers == 0:
+        _init_worker(case_library_file, seed, cbr_kwargs)
+        for chunk in chunks:
+            yield from _run_queries(chunk)
+        return
+    n_workers = n_workers or os.cpu_count()
+    with ProcessPoolExecutor(
+        n_workers, initializer=_init_worker, initargs=(case_library_file, seed, cbr_kwargs)
+    ) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_run_queries, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def learn_batch(cbr, evaluations, write=True):
+    """
+    Apply the evaluations of a batch in a single learning step, see :meth:`cbr.cbr.CBR.learn_evaluations`.
+
+    Parameters
+    ----------
+    cbr : :class:`cbr.cbr.CBR`
+        The CBR system to update.
+
+    evaluations : list of dict
+        The evaluation records yielded by :func:`run_batch`.
+
+    write : bool, default True
+        Whether to write the case library.
+
+    Returns
+    -------
+    n_applied : int
+        The number of evaluations applied. Evaluations whose retrieved case is no longer in the case library are
+        skipped.
+    """
+    batch = []
+    for record in evaluations:
+        state = resolve_record(cbr.case_library, record)
+        if state is None:
+            cbr.logger.warning(f"Learning: the case {record['retrieved']} of a batch evaluation is missing")
+            continue
+        batch.append((record["score"], state))
+    if batch:
+        cbr.learn_evaluations(batch, write)
+    return len(batch)
@@ -0,0 +1,234 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.load_generator import build_query
+from src.cbr.memory_benchmark import grow_case_library
+
+# The metrics of a benchmark, with their unit
+METRICS = dict(
+    startup="s",
+    findall="s",
+    retrieve="s",
+    adapt="s",
+    learn="s",
+    write="s",
+    memory="B/case",
+)
+# The relative increase of each metric over its baseline that is a regression, and the absolute increase under which a
+# change is never a regression, e.g. noise of timings of a few microseconds
+DEFAULT_TOLERANCES = dict(
+    startup=(0.5, 0.05),
+    findall=(0.5, 0.0005),
+    retrieve=(0.5, 0.0005),
+    adapt=(0.5, 0.0005),
+    learn=(0.5, 0.0005),
+    write=(0.5, 0.01),
+    memory=(0.1, 256),
+)
+
+
+def run_benchmarks(case_library_file, n_queries=50, repeat=3, seed=2022):
+    """
+    Measure the performance of the CBR on a case library.
+
+    The case library is copied to a temporary directory, so it is not changed. The timings of the queries are the
+    median over ``n_queries`` random queries, and those of the startup and the write the minimum over ``repeat`` runs,
+    which are less sensitive to the noise of the machine than the mean. The query cache is disabled, so every retrieval
+    is measured.
+
+    Parameters
+    ----------
+    case_library_file : str
+        The path to the case library.
+
+    n_queries : int, default 50
+        The number of random queries, see :func:`cbr.load_generator.build_query`.
+
+    repeat : int, default 3
+        The number of times the CBR is loaded and the case library written.
+
+    seed : int, default 2022
+        The seed of the queries and of the random choices of the CBR.
+
+    Returns
+    -------
+    results : dict
+        The value of each metric of :data:`METRICS`: the seconds to load the CBR, to find the cases of a query, to
+        retrieve, to adapt, to learn an evaluation and to write the case library, and the bytes per case used by the
+        case library, its indexes and caches.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(case_library_file))
+        shutil.copy(case_library_file, path)
+        startup = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cbr = CBR(path, seed=seed, cache_size=0)
+            startup.append(time.perf_counter() - start)
+
+        rng = random.Random(seed)
+        queries = [build_query(cbr.case_library, rng) for _ in range(n_queries)]
+        findall = []
+        for query in queries:
+            constraints = ConstraintsBuilder().from_query(query)
+            start = time.perf_counter()
+            cbr.case_library.findall(constraints)
+            findall.append(time.perf_counter() - start)
+
+        retrieve, adapt, evaluations = [], [], []
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            cbr.retrieve(query)
+            retrieve.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cbr.adapt(f"Benchmark {i}")
+            adapt.append(time.perf_counter() - start)
+            # Half of the adapted cases are learned
+            evaluations.append((0.9 if i % 2 else 0.1, cbr.get_state()))
+
+        start = time.perf_counter()
+        cbr.learn_evaluations(evaluations, write=False)
+        learn = (time.perf_counter() - start) / len(evaluations)
+
+        write = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cbr.case_library.save()
+            write.append(time.perf_counter() - start)
+
+        memory = cbr.memory_report()["per_case"]["total"]
+    return dict(
+        startup=min(startup),
+        findall=float(np.median(findall)),
+        retrieve=float(np.median(retrieve)),
+        adapt=float(np.median(adapt)),
+        learn=learn,
+        write=min(write),
+        memory=memory,
+    )
+
+
+def run_suite(case_library_file, scale=4, n_queries=50, repeat=3, seed=2022):
+    """
+    Run the benchmarks on a case library and on a synthetic library ``scale`` times larger.
+
+    Parameters
+    ----------
+    case_library_file : str
+        The path to the case library.
+
+    scale : int, default 4
+        The number of copies of each case of the synthetic library, see :func:`cbr.memory_benchmark.grow_case_library`.
+        If 1 only the case library is measured.
+
+    n_queries, repeat, seed
+        See :func:`run_benchmarks`.
+
+    Returns
+    -------
+    results : dict
+        The results of :func:`run_benchmarks` of each library, ``default`` and ``scaled_<scale>``.
+    """
+    results = dict(default=run_benchmarks(case_library_file, n_queries, repeat, seed))
+    if scale > 1:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"case_library_{scale}.xml")
+            grow_case_library(case_library_file, scale, path)
+            results[f"scaled_{scale}"] = run_benchmarks(path, n_queries, repeat, seed)
+    return results
+
+
+def compare(results, baseline, tolerances=None):
+    """
+    Compare the results of a suite with a baseline.
+
+    A metric regresses when it is greater than its baseline by more than the relative tolerance and by more than the
+    absolute tolerance. All the metrics are lower is better.
+
+    Parameters
+    ----------
+    results : dict
+        The results of :func:`run_suite`.
+
+    baseline : dict
+        The baseline results, with the same structure.
+
+    tolerances : dict or None
+        The relative and absolute tolerance of each metric. The metrics not given use :data:`DEFAULT_TOLERANCES`.
+
+    Returns
+    -------
+    rows : list of dict
+        The library, metric, unit, baseline and current values, relative change, limit and status of each metric, which
+        is ``ok``, ``improved`` when it is lower than the baseline by more than the tolerances, ``regression``, or
+        ``new`` and ``missing`` when it is only in the results or only in the baseline.
+    """
+    tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or dict()))
+    rows = []
+    for library in sorted(set(results) | set(baseline)):
+        current_metrics = results.get(library, dict())
+        baseline_metrics = baseline.get(library, dict())
+        for metric in METRICS:
+            if metric not in current_metrics and metric not in baseline_metrics:
+                continue
+            current = current_metrics.get(metric)
+            expected = baseline_metrics.get(metric)
+            row = dict(library=library, metric=metric, unit=METRICS[metric], baseline=expected, current=current)
+            if current is None:
+                rows.append(dict(row, change=None, limit=None, status="missing"))
+                continue
+            if expected is None:
+                rows.append(dict(row, change=None, limit=None, status="new"))
+                continue
+            relative, absolute = tolerances[metric]
+            limit = max(expected * (1 + relative), expected + absolute)
+            if current > limit:
+                status = "regression"
+            elif current < min(expected * (1 - relative), expected - absolute):
+                status = "improved"
+            else:
+                status = "ok"
+            change = (current - expected) / expected if expected else None
+            rows.append(dict(row, change=change, limit=limit, status=status))
+    return rows
+
+
+def _format(value, unit):
+    if value is None:
+        return "-"
+    if unit == "s":
+        return f"{value * 1000:.2f} ms"
+    return f"{value:.0f} {unit}"
+
+
+def format_table(rows):
+    """
+    Format the rows of :func:`compare` as a text table.
+    """
+    header = ("library", "metric", "baseline", "current", "change", "limit", "status")
+    lines = [
+        (
+            row["library"],
+            row["metric"],
+            _format(row["baseline"], row["unit"]),
+            _format(row["current"], row["unit"]),
+            f"{row['change'] * 100:+.1f}%" if row["change"] is not None else "-",
+            _format(row["limit"], row["unit"]),
+            row["status"],
+        )
+        for row in rows
+    ]
+    widths = [max(len(line[i]) for line in [header] + lines) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if i < 2 else cell.rjust(width) for i, (cell, width) in enumerate(zip(line, widths))
+        )
+        for line in [header] + lines
+    )
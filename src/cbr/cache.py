@@ -0,0 +1,142 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+ENTRY_OVERHEAD = 256
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of retrieval results.
+
+    Each entry keeps the rows in the case store of the candidate cases of a query and their similarity, tagged with the
+    epoch of the case library when they were computed. An entry from an older epoch is never returned, since the case
+    library changed after it was computed.
+
+    Parameters
+    ----------
+    max_entries : int, default 256
+        The maximum number of entries.
+
+    max_bytes : int, default 16 MiB
+        The maximum memory used by the entries.
+
+    Attributes
+    ----------
+    hits, misses : int
+        The number of lookups that found or did not find a valid entry.
+
+    evictions : int
+        The number of entries removed to keep the cache within its bounds.
+
+    invalidations : int
+        The number of entries removed because they were from an older epoch.
+
+    nbytes : int
+        The memory used by the entries.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, epoch):
+        """
+        Get the retrieval result for a query.
+
+        Parameters
+        ----------
+        key : hashable
+            The canonical key of the query, e.g. a :class:`entity.query.FrozenQuery`.
+
+        epoch : int
+            The current epoch of the case library.
+
+        Returns
+        -------
+        result : tuple of numpy.ndarray or None
+            The rows of the candidate cases and their similarity, or None if there is no valid entry.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != epoch:
+            self._pop(key)
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, key, epoch, rows, scores):
+        """
+        Store the retrieval result for a query, evicting the least recently used entries if needed.
+
+        Parameters
+        ----------
+        key : hashable
+            The canonical key of the query.
+
+        epoch : int
+            The epoch of the case library when the result was computed.
+
+        rows : array-like of int
+            The rows in the case store of the candidate cases.
+
+        scores : array-like of float
+            The similarity of each candidate case.
+        """
+        if key in self._entries:
+            self._pop(key)
+        rows = np.asarray(rows, dtype=np.uint32)
+        scores = np.asarray(scores, dtype=np.float64)
+        nbytes = rows.nbytes + scores.nbytes + sys.getsizeof(key) + ENTRY_OVERHEAD
+        if nbytes > self.max_bytes or self.max_entries <= 0:
+            return
+        self._entries[key] = (epoch, rows, scores, nbytes)
+        self.nbytes += nbytes
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """
+        Get the metrics of the cache.
+
+        Returns
+        -------
+        stats : dict
+            The hits, misses, evictions, invalidations, hit rate, entries and bytes of the cache.
+        """
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            entries=len(self._entries),
+            bytes=self.nbytes,
+        )
+
+    def _pop(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry[3]
@@ -1,8 +1,15 @@
+import bisect
+import heapq
+import os
+import re
 from typing import Dict, List, Union
 
-from lxml import objectify
+import numpy as np
+from lxml import etree, objectify
 
+from src.cbr.vocabulary import COUNTERS, VALUE_TYPES, CaseStore, Vocabulary
 from src.entity.query import Query
+from src.utils.memory import deep_sizeof, tree_nbytes
 
 
 def _include_to_list(include_list: List[str], elements: Union[str, List[str]], is_exclusion=False):
@@ -88,6 +95,22 @@ def _include_to_dict(include_dict: Dict, key: str, elements: Union[str, List[str
     return include_dict
 
 
+def _ingredient_predicate(text=None, basic_taste=None, alc_type=None):
+    if text:
+        return ".=$value", text
+    if basic_taste:
+        return "@basic_taste=$value", basic_taste
+    if alc_type:
+        return "@alc_type=$value", alc_type
+    return None, None
+
+
+class ReadOnlyCaseLibraryError(PermissionError):
+    """
+    Raised when a read-only case library, like :class:`StreamingCaseLibrary`, would be modified.
+    """
+
+
 class CaseLibrary:
     """
     Case library for the CBR.
@@ -132,17 +155,35 @@ class CaseLibrary:
     ingredients_onto: dict
         Ontology of ingredients
 
+    vocabulary : Vocabulary
+        Integer ids of the available values.
+
+    case_store : CaseStore
+        Compact integer encoding of the cases, filled as the cases are searched.
+
+    epoch : int
+        Mutation counter, increased every time a case is added, removed or its utility changes.
+
+    indexes : list
+        The indexes kept up to date with the cases, see :meth:`CaseLibrary.register_index`.
+
+    journal_seq : int
+        The sequence number of the last journaled evaluation applied to the case library, written with it, see
+        :class:`cbr.learning_queue.BackgroundLearner`.
+
     See Also
     --------
     CaseLibrary.findall : Find all the cases matching a constraint.
     CaseLibrary.remove_case: Remove a case from the case library.
     CaseLibrary.add_case: Add a case to the case library.
+    ShardedCaseLibrary : Case library split in one file per category and glass type.
+    StreamingCaseLibrary : Read-only case library searched by streaming the case library file.
     """
 
     def __init__(self, case_library_file):
         self.case_library_path = case_library_file
-        self.ET = objectify.parse(self.case_library_path)
-        self.case_library = self.ET.getroot()
+        self.ET = None
+        self.case_library = None
         self.drink_types = list()
         self.glass_types = list()
         self.alc_types = list()
@@ -151,8 +192,20 @@ class CaseLibrary:
         self.ingredients = list()
         self.value_counter = dict()
         self.ingredients_onto = {"alcoholic": dict(), "non-alcoholic": dict()}
+        self.vocabulary = Vocabulary()
+        self.case_store = CaseStore(self.vocabulary)
+        self._encoded = False
+        self.epoch = 0
+        self.indexes = []
+        self.journal_seq = 0
+        self._load()
         self.initialize_type_sets()
 
+    def _load(self):
+        self.ET = objectify.parse(self.case_library_path)
+        self.case_library = self.ET.getroot()
+        self.journal_seq = int(self.case_library.get("journal_seq", 0))
+
     def findall(self, constraints):
         """
         Find all the cases matching a constraint.
@@ -179,7 +232,34 @@ class CaseLibrary:
         else:
             raise TypeError("constraints must be string or ConstraintsBuilder.")
 
-    def add_case(self, case):
+    def find_ingredients(self, text=None, basic_taste=None, alc_type=None):
+        """
+        Find all the ingredients in the case library matching the given name, basic taste or alcohol type.
+
+        Only the first of the given filters is used, in the same order as the parameters.
+
+        Parameters
+        ----------
+        text : str or None, default None
+            Name of the ingredient.
+
+        basic_taste : str or None, default None
+            Basic taste of the ingredient.
+
+        alc_type : str or None, default None
+            Alcohol type of the ingredient.
+
+        Returns
+        -------
+        ingredients : list of :class:`lxml.objectify.ObjectifiedElement`
+            A list of ingredients that match the given filter. Empty if no filter is given.
+        """
+        predicate, value = _ingredient_predicate(text, basic_taste, alc_type)
+        if predicate is None:
+            return []
+        return self.case_library.xpath(f".//ingredient[{predicate}]", value=value)
+
+    def add_case(self, case, write=True):
         """
         Add a case from the case library. The new case will obtain a unique ID before being added to the case library.
 
@@ -189,13 +269,22 @@ class CaseLibrary:
         ----------
         case : :class:`lxml.objectify.ObjectifiedElement`
             The case to add to the case library.
+
+        write : bool, default True
+            Whether to update the XML file. If False the change is only written by the next :meth:`CaseLibrary.save`.
         """
         drink_type = case.category
         glass_type = case.glass
-        parent = self.case_library.find(f"./category[@type='{drink_type}']/glass[@type='{glass_type}']")
+        parent = self._find_parent(drink_type.text, glass_type.text)
         case.derivation = "adapted"
         parent.append(case)
-        self.ET.write(self.case_library_path, pretty_print=True, encoding="utf-8")
+        self.case_store.add(case)
+        for index in self.indexes:
+            index.add(case)
+        self.epoch += 1
+        self._mark_dirty(drink_type.text, glass_type.text)
+        if write:
+            self.save()
 
         self._increase_counter(glass_type, "glass_types")
         self._increase_counter(drink_type, "drink_types")
@@ -212,7 +301,7 @@ class CaseLibrary:
             if garnish_type:
                 self._increase_counter(garnish_type, "garnish_types")
 
-    def remove_case(self, case):
+    def remove_case(self, case, write=True):
         """
         Remove a case from the case library.
 
@@ -222,6 +311,9 @@ class CaseLibrary:
         ----------
         case : :class:`lxml.objectify.ObjectifiedElement`
             The case to remove from the case library
+
+        write : bool, default True
+            Whether to update the XML file. If False the change is only written by the next :meth:`CaseLibrary.save`.
         """
         category = case.category
         self._decrease_counter(category, self.drink_types, "drink_types")
@@ -243,7 +335,258 @@ class CaseLibrary:
 
         parent = case.getparent()
         parent.remove(case)
-        self.ET.write(self.case_library_path, pretty_print=True, encoding="utf-8")
+        self.case_store.remove(case)
+        for index in self.indexes:
+            index.remove(case)
+        self.epoch += 1
+        self._mark_dirty(category.text, glass.text)
+        if write:
+            self.save()
+
+    def register_index(self, index, build=True):
+        """
+        Build an index of the cases and keep it up to date when cases are added or removed.
+
+        Parameters
+        ----------
+        index : object
+            The index. It must have a ``build(cases)`` method, called now with all the cases of the case library, and
+            ``add(case)`` and ``remove(case)`` methods, called after a case is added to or removed from the case
+            library.
+
+        build : bool, default True
+            Whether to build the index. If False the index was built otherwise, e.g. from the type sets, and it is
+            only kept up to date.
+        """
+        if build:
+            index.build(self.findall(ConstraintsBuilder()))
+        self.indexes.append(index)
+
+    def unregister_index(self, index):
+        """
+        Stop keeping an index up to date, e.g. to release its memory.
+        """
+        self.indexes.remove(index)
+
+    def memory_report(self, caches=None):
+        """
+        Report the memory used by the case library.
+
+        The memory of the XML trees is estimated from their nodes, see :func:`utils.memory.tree_nbytes`, and the memory
+        of the other structures is measured with :func:`utils.memory.deep_sizeof`. The components are measured in order
+        and an object shared by several of them, e.g. the vocabulary of the case store, is only counted in the first.
+
+        Parameters
+        ----------
+        caches : dict or None
+            Other caches to report, by name, e.g. the query cache of the CBR.
+
+        Returns
+        -------
+        report : dict
+            The number of cases, the bytes of each component, i.e. ``tree``, ``value_counter``, ``ingredients_onto``,
+            ``type_lists``, ``vocabulary``, ``case_store``, each index by its class name and each cache by its name,
+            their total and the average bytes per case of each component and of the total.
+        """
+        seen = set()
+        components = dict(tree=sum(tree_nbytes(root) for root in self._trees()))
+        components["value_counter"] = deep_sizeof(self.value_counter, seen)
+        components["ingredients_onto"] = deep_sizeof(self.ingredients_onto, seen)
+        components["type_lists"] = sum(deep_sizeof(getattr(self, value_type), seen) for value_type in VALUE_TYPES)
+        components["vocabulary"] = deep_sizeof(self.vocabulary, seen)
+        components["case_store"] = deep_sizeof(self.case_store, seen)
+        for index in self.indexes:
+            name = type(index).__name__
+            components[name] = components.get(name, 0) + deep_sizeof(index, seen)
+        for name, cache in (caches or dict()).items():
+            components[name] = deep_sizeof(cache, seen) if cache is not None else 0
+        n_cases = sum(self.value_counter["drink_types"].values())
+        total = sum(components.values())
+        per_case = {name: nbytes / n_cases if n_cases else 0.0 for name, nbytes in components.items()}
+        per_case["total"] = total / n_cases if n_cases else 0.0
+        return dict(n_cases=n_cases, components=components, total=total, per_case=per_case)
+
+    def compact(self):
+        """
+        Make the XML trees more compact, removing the type annotations and the unused namespaces that objectify adds to
+        the assigned elements. The saved case library does not change otherwise.
+        """
+        for root in self._trees():
+            objectify.deannotate(root, cleanup_namespaces=True)
+
+    def _trees(self):
+        """
+        The roots of the XML trees held in memory.
+        """
+        return [self.case_library] if self.case_library is not None else []
+
+    def set_utility(self, case, utility):
+        """
+        Update the utility of a case.
+
+        Parameters
+        ----------
+        case : :class:`lxml.objectify.ObjectifiedElement`
+            The case to update.
+
+        utility : float
+            The new utility of the case.
+        """
+        row = self.case_store.add(case)
+        self.case_store.utility[row] = utility
+        self.case_store.dirty[row] = 1
+        self.epoch += 1
+
+    def record_feedback(self, retrieved, similar, success):
+        """
+        Update the evaluation counters and the utility of the cases for a batch of evaluations.
+
+        The counters are updated in the case store, with a single vectorized recomputation of the utility. The elements
+        of the cases are updated lazily, by :meth:`CaseLibrary.sync_counters`. The cases removed since they were
+        retrieved are skipped.
+
+        Parameters
+        ----------
+        retrieved : list of :class:`lxml.objectify.ObjectifiedElement`
+            The retrieved case of each evaluation.
+
+        similar : list of list of :class:`lxml.objectify.ObjectifiedElement`
+            The similar cases of each evaluation.
+
+        success : list of bool
+            Whether each evaluation was a success.
+        """
+        self.case_store.record_feedback(
+            self._feedback_rows(retrieved),
+            [self._feedback_rows(cases) for cases in similar],
+            np.array(success, dtype=bool),
+        )
+        self.epoch += 1
+
+    def _feedback_rows(self, cases):
+        """
+        The rows of the cases in the case store, encoding the ones that are not in it yet, or -1 for the removed ones.
+        """
+        return np.fromiter(
+            (-1 if self._is_removed(case) else self.case_store.add(case) for case in cases),
+            dtype=np.intp,
+            count=len(cases),
+        )
+
+    def _is_removed(self, case):
+        # A removed case is detached from the case library
+        return case.getparent() is None
+
+    def sync_counters(self, cases=None):
+        """
+        Write the evaluation counters and the utility of the case store to the elements of the cases.
+
+        Parameters
+        ----------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement` or None
+            The cases to update. If None all the cases with changes are updated.
+        """
+        case_store = self.case_store
+        if cases is None:
+            rows = np.flatnonzero(np.frombuffer(case_store.dirty, dtype=np.uint8)).tolist()
+        else:
+            rows = [row for row in map(case_store.row, cases) if row is not None and case_store.dirty[row]]
+        for row in rows:
+            case = case_store.cases[row]
+            case_store.dirty[row] = 0
+            if case is None:
+                continue
+            case.utility = case_store.utility[row]
+            for name in COUNTERS:
+                value = getattr(case_store, name)[row]
+                # Only assign the changed counters, objectify annotates the type of assigned elements
+                if int(case.findtext(name)) != value:
+                    setattr(case, name, value)
+            self._mark_dirty(case.findtext("category"), case.findtext("glass"))
+
+    def low_utility_cases(self, threshold):
+        """
+        Find the cases with a utility lower than a threshold.
+
+        The utility is compared for all the cases at once in the case store. The first call encodes all the cases of
+        the case library in the case store.
+
+        Parameters
+        ----------
+        threshold : float
+            The utility threshold.
+
+        Returns
+        -------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement`
+            The cases with a lower utility, in document order.
+        """
+        case_store = self.case_store
+        if not self._encoded:
+            case_store.rows(self.findall(ConstraintsBuilder()))
+            self._encoded = True
+        alive = np.frombuffer(case_store.alive, dtype=np.uint8) == 1
+        rows = np.flatnonzero(alive & (np.frombuffer(case_store.utility, dtype=np.float64) < threshold))
+        cases = [case_store.cases[row] for row in rows]
+        self.sync_counters(cases)
+        return sorted(cases, key=self._document_key)
+
+    def _document_key(self, case):
+        key = []
+        node = case
+        parent = node.getparent()
+        while parent is not None:
+            key.append(parent.index(node))
+            node, parent = parent, parent.getparent()
+        return tuple(reversed(key))
+
+    def _find_parent(self, drink_type, glass_type):
+        return self.case_library.find(f"./category[@type='{drink_type}']/glass[@type='{glass_type}']")
+
+    def find_case(self, name):
+        """
+        Find a case by its name.
+
+        Parameters
+        ----------
+        name : str
+            The name of the case.
+
+        Returns
+        -------
+        case : :class:`lxml.objectify.ObjectifiedElement` or None
+            The first case with the given name, or None if there is no such case.
+        """
+        cases = self.case_library.xpath(".//cocktail[name=$name]", name=name)
+        return cases[0] if cases else None
+
+    def find_cases(self, name):
+        """
+        Find all the cases with a name, since the names are not unique.
+
+        Parameters
+        ----------
+        name : str
+            The name of the cases.
+
+        Returns
+        -------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement`
+            The cases with the given name, in the order of the case library.
+        """
+        return self.case_library.xpath(".//cocktail[name=$name]", name=name)
+
+    def save(self):
+        """
+        Write the case library to disk.
+        """
+        self.sync_counters()
+        if self.journal_seq:
+            self.case_library.set("journal_seq", str(self.journal_seq))
+        _write_tree(self.ET, self.case_library_path)
+
+    def _mark_dirty(self, drink_type, glass_type):
+        pass
 
     def _decrease_counter(self, key, value_list, types):
         self.value_counter[types][key] -= 1
@@ -252,78 +595,557 @@ class CaseLibrary:
             self.value_counter[types].pop(key)
 
     def _increase_counter(self, key, types):
+        key = str(key)
+        if key not in self.value_counter[types]:
+            # The value is new, or all the cases with it were removed
+            self.value_counter[types][key] = 0
+            bisect.insort(getattr(self, types), key)
+            self.vocabulary.add(types, key)
         self.value_counter[types][key] += 1
 
+    def _iter_type_records(self):
+        """
+        Yield a record for each case with its category, glass, the number of cases it stands for and its ingredients as
+        ``(name, alc_type, basic_taste, garnish_type, count)`` tuples.
+        """
+        for cocktail in self.case_library.xpath(".//cocktail"):
+            ingredients = (
+                (
+                    ingredient.text,
+                    ingredient.attrib["alc_type"],
+                    ingredient.attrib["basic_taste"],
+                    ingredient.attrib["garnish_type"],
+                    1,
+                )
+                for ingredient in cocktail.ingredients.iterchildren()
+            )
+            yield cocktail.category.text, cocktail.glass.text, 1, ingredients
+
     def initialize_type_sets(self):
-        drink_types = set()
-        glass_types = set()
-        ingredients = set()
-        alc_types = set()
-        taste_types = set()
-        garnish_types = set()
         value_counter = dict(
             drink_types={}, glass_types={}, ingredients={}, alc_types={}, taste_types={}, garnish_types={}
         )
-        for cocktail in self.case_library.xpath(".//cocktail"):
-            drink = cocktail.category.text
-            glass = cocktail.glass.text
-            if drink in value_counter["drink_types"].keys():
-                value_counter["drink_types"][drink] += 1
-            else:
-                value_counter["drink_types"][drink] = 1
-                drink_types.add(drink)
-
-            if glass in value_counter["glass_types"].keys():
-                value_counter["glass_types"][glass] += 1
-            else:
-                value_counter["glass_types"][glass] = 1
-                glass_types.add(glass)
-
-            for ingredient in cocktail.ingredients.iterchildren():
-                name = ingredient.text
-                if name in value_counter["ingredients"].keys():
-                    value_counter["ingredients"][name] += 1
-                else:
-                    value_counter["ingredients"][name] = 1
-                    ingredients.add(name)
+        for drink, glass, n_cases, ingredients in self._iter_type_records():
+            value_counter["drink_types"][drink] = value_counter["drink_types"].get(drink, 0) + n_cases
+            value_counter["glass_types"][glass] = value_counter["glass_types"].get(glass, 0) + n_cases
 
-                alc_type = ingredient.attrib["alc_type"]
-                basic_taste = ingredient.attrib["basic_taste"]
-                garnish_type = ingredient.attrib["garnish_type"]
+            for name, alc_type, basic_taste, garnish_type, count in ingredients:
+                value_counter["ingredients"][name] = value_counter["ingredients"].get(name, 0) + count
                 if alc_type:
-                    if alc_type in value_counter["alc_types"].keys():
-                        value_counter["alc_types"][alc_type] += 1
-                    else:
-                        value_counter["alc_types"][alc_type] = 1
-                        alc_types.add(alc_type)
-                    if alc_type in self.ingredients_onto["alcoholic"].keys():
-                        self.ingredients_onto["alcoholic"][name] = alc_type
-                    else:
-                        self.ingredients_onto["alcoholic"][name] = alc_type
+                    value_counter["alc_types"][alc_type] = value_counter["alc_types"].get(alc_type, 0) + count
+                    self.ingredients_onto["alcoholic"][name] = alc_type
                 elif basic_taste:
-                    if basic_taste in value_counter["taste_types"].keys():
-                        value_counter["taste_types"][basic_taste] += 1
-                    else:
-                        value_counter["taste_types"][basic_taste] = 1
-                        taste_types.add(basic_taste)
-                    if basic_taste in self.ingredients_onto["non-alcoholic"].keys():
-                        self.ingredients_onto["non-alcoholic"][name] = basic_taste
-                    else:
-                        self.ingredients_onto["non-alcoholic"][name] = basic_taste
+                    value_counter["taste_types"][basic_taste] = value_counter["taste_types"].get(basic_taste, 0) + count
+                    self.ingredients_onto["non-alcoholic"][name] = basic_taste
                 if garnish_type:
-                    if garnish_type in value_counter["garnish_types"].keys():
-                        value_counter["garnish_types"][garnish_type] += 1
-                    else:
-                        value_counter["garnish_types"][garnish_type] = 1
-                        garnish_types.add(garnish_type)
-
-        self.drink_types = sorted(drink_types)
-        self.glass_types = sorted(glass_types)
-        self.alc_types = sorted(alc_types)
-        self.taste_types = sorted(taste_types)
-        self.garnish_types = sorted(garnish_types)
-        self.ingredients = sorted(ingredients)
+                    value_counter["garnish_types"][garnish_type] = (
+                        value_counter["garnish_types"].get(garnish_type, 0) + count
+                    )
+
+        self.drink_types = sorted(value_counter["drink_types"])
+        self.glass_types = sorted(value_counter["glass_types"])
+        self.alc_types = sorted(value_counter["alc_types"])
+        self.taste_types = sorted(value_counter["taste_types"])
+        self.garnish_types = sorted(value_counter["garnish_types"])
+        self.ingredients = sorted(value_counter["ingredients"])
         self.value_counter = value_counter
+        for value_type in VALUE_TYPES:
+            for value in getattr(self, value_type):
+                self.vocabulary.add(value_type, value)
+
+
+class ShardedCaseLibrary(CaseLibrary):
+    """
+    Case library stored as one XML file (shard) per category and glass type.
+
+    The shards are described by a manifest file that keeps, for each shard, its file, the number of cases and a summary
+    of its ingredients. The type sets are initialized from the manifest, so a shard is only parsed the first time a
+    search needs it, and only the shards modified by :meth:`CaseLibrary.add_case` and
+    :meth:`CaseLibrary.remove_case` are written back to disk.
+
+    Parameters
+    ----------
+    case_library_dir: str
+        Path to the directory with the manifest and the shards.
+
+    Attributes
+    ----------
+    manifest : lxml Element
+        Root of the manifest. It has the same ``category[@type]/glass[@type]`` structure as the case library, with the
+        ingredients summary in place of the cocktails.
+
+    shards : dict
+        The parsed shards, as lxml ElementTree, by (category, glass) type.
+
+    See Also
+    --------
+    ShardedCaseLibrary.from_case_library : Split a case library file in shards.
+    """
+
+    MANIFEST_FILE = "manifest.xml"
+
+    def __init__(self, case_library_dir):
+        self.manifest = None
+        self.shards = dict()
+        self._dirty = set()
+        self._shard_indexes = []
+        super(ShardedCaseLibrary, self).__init__(case_library_dir)
+
+    def _load(self):
+        self.manifest = etree.parse(os.path.join(self.case_library_path, self.MANIFEST_FILE)).getroot()
+        self.journal_seq = int(self.manifest.get("journal_seq", 0))
+
+    @classmethod
+    def from_case_library(cls, case_library_file, case_library_dir):
+        """
+        Split a case library file in one shard per category and glass type.
+
+        Parameters
+        ----------
+        case_library_file : str
+            Path to the case library file.
+
+        case_library_dir : str
+            Path to the directory where the manifest and the shards are written.
+
+        Returns
+        -------
+        case_library : ShardedCaseLibrary
+            The sharded case library.
+        """
+        root = objectify.parse(case_library_file).getroot()
+        manifest = etree.Element("manifest")
+        for category in root.iterchildren("category"):
+            manifest_category = etree.SubElement(manifest, "category", type=category.attrib["type"])
+            for glass in category.iterchildren("glass"):
+                glass_node = etree.SubElement(manifest_category, "glass", type=glass.attrib["type"])
+                shard = _new_shard(category.attrib["type"], glass.attrib["type"])
+                shard.find("category/glass").extend(glass.iterchildren())
+                _write_shard(case_library_dir, manifest, glass_node, shard)
+        _write_tree(etree.ElementTree(manifest), os.path.join(case_library_dir, cls.MANIFEST_FILE))
+        return cls(case_library_dir)
+
+    def findall(self, constraints):
+        """
+        Find all the cases matching a constraint.
+
+        Only the shards selected by the category and glass constraints of a :class:`ConstraintsBuilder` are parsed. A
+        string pattern is searched in all the shards.
+
+        Parameters
+        ----------
+        constraints: str or ConstraintsBuilder
+            The constraints to search for cases. It can be a string with a complex search pattern for XPath search or a
+            ConstraintsBuilder object.
+
+        Returns
+        -------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement`
+            A list of cases that match the given constraint.
+        """
+        if isinstance(constraints, str):
+            glass_nodes = self.manifest.xpath("./category/glass")
+        elif isinstance(constraints, ConstraintsBuilder):
+            glass_nodes = self.manifest.xpath(constraints.build_glass_path())
+            constraints = constraints.build()
+        else:
+            raise TypeError("constraints must be string or ConstraintsBuilder.")
+
+        cases = []
+        for glass_node in glass_nodes:
+            cases += self._shard(glass_node).xpath(constraints)
+        return cases
+
+    def find_ingredients(self, text=None, basic_taste=None, alc_type=None):
+        predicate, value = _ingredient_predicate(text, basic_taste, alc_type)
+        if predicate is None:
+            return []
+        ingredients = []
+        for glass_node in self.manifest.xpath(f"./category/glass[ingredient[{predicate}]]", value=value):
+            ingredients += self._shard(glass_node).xpath(f".//ingredient[{predicate}]", value=value)
+        return ingredients
+
+    def find_case(self, name):
+        for glass_node in self.manifest.xpath("./category/glass"):
+            cases = self._shard(glass_node).xpath(".//cocktail[name=$name]", name=name)
+            if cases:
+                return cases[0]
+        return None
+
+    def find_cases(self, name):
+        cases = []
+        for glass_node in self.manifest.xpath("./category/glass"):
+            cases += self._shard(glass_node).xpath(".//cocktail[name=$name]", name=name)
+        return cases
+
+    def save(self):
+        """
+        Write the modified shards and the manifest to disk.
+        """
+        self.sync_counters()
+        journal_seq = int(self.manifest.get("journal_seq", 0))
+        if not self._dirty and journal_seq == self.journal_seq:
+            return
+        if self.journal_seq != journal_seq:
+            self.manifest.set("journal_seq", str(self.journal_seq))
+        for drink_type, glass_type in self._dirty:
+            glass_node = self._glass_node(drink_type, glass_type)
+            shard = self.shards[(drink_type, glass_type)].getroot()
+            _write_shard(self.case_library_path, self.manifest, glass_node, shard)
+        _write_tree(etree.ElementTree(self.manifest), os.path.join(self.case_library_path, self.MANIFEST_FILE))
+        self._dirty.clear()
+
+    def _trees(self):
+        return [self.manifest] + [shard.getroot() for shard in self.shards.values()]
+
+    def _document_key(self, case):
+        glass_nodes = self.manifest.xpath("./category/glass")
+        glass_node = self._glass_node(case.findtext("category"), case.findtext("glass"))
+        return (glass_nodes.index(glass_node),) + super()._document_key(case)
+
+    def _glass_node(self, drink_type, glass_type):
+        nodes = self.manifest.xpath("./category[@type=$drink]/glass[@type=$glass]", drink=drink_type, glass=glass_type)
+        return nodes[0] if nodes else None
+
+    def _shard(self, glass_node):
+        key = (glass_node.getparent().attrib["type"], glass_node.attrib["type"])
+        if key not in self.shards:
+            self.shards[key] = objectify.parse(os.path.join(self.case_library_path, glass_node.attrib["file"]))
+            for cocktail in self.shards[key].getroot().iter("cocktail"):
+                for index in self._shard_indexes:
+                    index.add(cocktail)
+        return self.shards[key].getroot()
+
+    def register_index(self, index, build=True):
+        """
+        Build an index of the cases of the loaded shards, and add the cases of the other shards as they are loaded, so
+        no shard is loaded to build it. The index only covers the shards loaded so far.
+
+        Parameters
+        ----------
+        index, build
+            See :meth:`CaseLibrary.register_index`.
+        """
+        if build:
+            index.build([cocktail for shard in self.shards.values() for cocktail in shard.getroot().iter("cocktail")])
+            self._shard_indexes.append(index)
+        self.indexes.append(index)
+
+    def unregister_index(self, index):
+        super().unregister_index(index)
+        if index in self._shard_indexes:
+            self._shard_indexes.remove(index)
+
+    def _find_parent(self, drink_type, glass_type):
+        glass_node = self._glass_node(drink_type, glass_type)
+        if glass_node is None:
+            categories = self.manifest.xpath("./category[@type=$drink]", drink=drink_type)
+            if categories:
+                category = categories[0]
+            else:
+                category = etree.SubElement(self.manifest, "category", type=drink_type)
+            glass_node = etree.SubElement(category, "glass", type=glass_type)
+            self.shards[(drink_type, glass_type)] = objectify.ElementTree(
+                objectify.fromstring(etree.tostring(_new_shard(drink_type, glass_type)))
+            )
+        return self._shard(glass_node).find("category/glass")
+
+    def _mark_dirty(self, drink_type, glass_type):
+        self._dirty.add((drink_type, glass_type))
+
+    def _iter_type_records(self):
+        for glass_node in self.manifest.xpath("./category/glass"):
+            ingredients = (
+                (
+                    ingredient.text,
+                    ingredient.attrib["alc_type"],
+                    ingredient.attrib["basic_taste"],
+                    ingredient.attrib["garnish_type"],
+                    int(ingredient.attrib["count"]),
+                )
+                for ingredient in glass_node.iterchildren("ingredient")
+            )
+            yield glass_node.getparent().attrib["type"], glass_node.attrib["type"], int(
+                glass_node.attrib["cases"]
+            ), ingredients
+
+
+def _new_shard(drink_type, glass_type):
+    shard = etree.Element("case_library")
+    category = etree.SubElement(shard, "category", type=drink_type)
+    etree.SubElement(category, "glass", type=glass_type)
+    return shard
+
+
+def _shard_file(manifest, drink_type, glass_type):
+    slug = re.sub(r"[^a-z0-9]+", "-", f"{drink_type}/{glass_type}".lower()).strip("-")
+    used_files = set(manifest.xpath("./category/glass/@file"))
+    shard_file = f"{slug}.xml"
+    suffix = 1
+    while shard_file in used_files:
+        suffix += 1
+        shard_file = f"{slug}-{suffix}.xml"
+    return shard_file
+
+
+def _write_tree(tree, path):
+    """
+    Write an element tree to disk atomically.
+
+    The tree is written to a temporary file that is synced to disk before replacing the file, so the file is never left
+    half written.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        tree.write(f, pretty_print=True, encoding="utf-8")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _write_shard(case_library_dir, manifest, glass_node, shard):
+    """
+    Write a shard to disk and update its summary in the manifest.
+    """
+    if "file" not in glass_node.attrib:
+        glass_node.attrib["file"] = _shard_file(
+            manifest, glass_node.getparent().attrib["type"], glass_node.attrib["type"]
+        )
+    os.makedirs(case_library_dir, exist_ok=True)
+    _write_tree(etree.ElementTree(shard), os.path.join(case_library_dir, glass_node.attrib["file"]))
+
+    summary = dict()
+    cocktails = shard.xpath(".//cocktail")
+    for cocktail in cocktails:
+        for ingredient in cocktail.find("ingredients").iterchildren():
+            key = (
+                ingredient.text,
+                ingredient.attrib["alc_type"],
+                ingredient.attrib["basic_taste"],
+                ingredient.attrib["garnish_type"],
+            )
+            summary[key] = summary.get(key, 0) + 1
+    for ingredient in glass_node.findall("ingredient"):
+        glass_node.remove(ingredient)
+    glass_node.attrib["cases"] = str(len(cocktails))
+    for (name, alc_type, basic_taste, garnish_type), count in sorted(summary.items()):
+        ingredient = etree.SubElement(
+            glass_node,
+            "ingredient",
+            alc_type=alc_type,
+            basic_taste=basic_taste,
+            garnish_type=garnish_type,
+            count=str(count),
+        )
+        ingredient.text = name
+
+
+class StreamingCaseLibrary(CaseLibrary):
+    """
+    Read-only case library that is never held in memory as a whole.
+
+    Every search streams the case library file with :func:`lxml.etree.iterparse`, tests each cocktail as it arrives
+    and clears it afterwards, so the memory used does not depend on the size of the case library. The returned cases
+    are detached copies of the matching cocktails.
+
+    Parameters
+    ----------
+    case_library_file: str
+        Path to the case library file.
+
+    Raises
+    ------
+    ReadOnlyCaseLibraryError
+        From :meth:`CaseLibrary.add_case`, :meth:`CaseLibrary.remove_case` and :meth:`CaseLibrary.save`, since the case
+        library file is only read.
+
+    See Also
+    --------
+    StreamingCaseLibrary.top_cases : Stream the case library keeping only the best scored cases.
+    """
+
+    def _load(self):
+        pass
+
+    def _iterparse(self):
+        for _, cocktail in etree.iterparse(self.case_library_path, events=("end",), tag="cocktail"):
+            yield cocktail
+            cocktail.clear(keep_tail=True)
+            while cocktail.getprevious() is not None:
+                del cocktail.getparent()[0]
+
+    def findall(self, constraints):
+        """
+        Find all the cases matching a constraint.
+
+        Parameters
+        ----------
+        constraints: ConstraintsBuilder
+            The constraints to search for cases. XPath strings are not supported because they can not be evaluated on
+            a single cocktail.
+
+        Returns
+        -------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement`
+            A list with a copy of the cases that match the given constraint.
+        """
+        if not isinstance(constraints, ConstraintsBuilder):
+            raise TypeError("constraints must be ConstraintsBuilder.")
+        test = etree.XPath(constraints.build_case_test())
+        return [_objectify_copy(cocktail) for cocktail in self._iterparse() if test(cocktail)]
+
+    def register_index(self, index, build=True):
+        """
+        Build an index of the cases while streaming the case library.
+
+        The cases are given to ``index.build`` one at a time as the case library file is read, and each copy is
+        released once the next one is read, unless the index keeps it. Since the case library is read-only the index
+        is never updated.
+
+        Parameters
+        ----------
+        index : object
+            The index, see :meth:`CaseLibrary.register_index`. It must not keep the cases, which would hold all of
+            them in memory.
+
+        build : bool, default True
+            Whether to build the index, see :meth:`CaseLibrary.register_index`.
+        """
+        if build:
+            index.build(_objectify_copy(cocktail) for cocktail in self._iterparse())
+        self.indexes.append(index)
+
+    def find_ingredients(self, text=None, basic_taste=None, alc_type=None):
+        predicate, value = _ingredient_predicate(text, basic_taste, alc_type)
+        if predicate is None:
+            return []
+        find = etree.XPath(f"ingredients/ingredient[{predicate}]")
+        ingredients = []
+        for cocktail in self._iterparse():
+            ingredients += [_objectify_copy(ingredient) for ingredient in find(cocktail, value=value)]
+        return ingredients
+
+    def top_cases(self, constraints, score, k=5, min_cases=5):
+        """
+        Stream the case library and keep the `k` best scored cases for the first relaxation of the constraints with
+        enough matching cases.
+
+        Each cocktail is tested against the constraints from the strictest to the most relaxed one and scored once.
+        Only a heap with the best `k` cases for each relaxation level is kept in memory.
+
+        Parameters
+        ----------
+        constraints : list of ConstraintsBuilder
+            The constraints ordered from the strictest to the most relaxed.
+
+        score : callable
+            A function that takes a cocktail element and returns its score.
+
+        k : int, default 5
+            The number of cases to keep.
+
+        min_cases : int, default 5
+            The number of matching cases needed to stop relaxing the constraints. The cases matching a relaxation level
+            are counted once for every level from that one on, as it happens when the results of the relaxation levels
+            are concatenated.
+
+        Returns
+        -------
+        cases : list of :class:`lxml.objectify.ObjectifiedElement`
+            A copy of the best scored cases, in the order they appear in the case library.
+
+        scores : list of float
+            The score of each case.
+        """
+        tests = [etree.XPath(builder.build_case_test()) for builder in constraints]
+        counts = [0] * len(tests)
+        heaps = [[] for _ in tests]
+        for position, cocktail in enumerate(self._iterparse()):
+            level = next((i for i, test in enumerate(tests) if test(cocktail)), None)
+            if level is None:
+                continue
+            counts[level] += 1
+            entry = (score(cocktail), -position)
+            heap = heaps[level]
+            if len(heap) < k:
+                heapq.heappush(heap, entry + (_objectify_copy(cocktail),))
+            elif entry > heap[0][:2]:
+                heapq.heapreplace(heap, entry + (_objectify_copy(cocktail),))
+
+        n_cases = 0
+        for level in range(len(tests)):
+            n_cases += sum(counts[: level + 1])
+            if n_cases >= min_cases:
+                break
+        best = heapq.nlargest(k, (entry for heap in heaps[: level + 1] for entry in heap), key=lambda e: e[:2])
+        best.sort(key=lambda e: -e[1])
+        return [cocktail for _, _, cocktail in best], [sim for sim, _, _ in best]
+
+    def find_case(self, name):
+        for cocktail in self._iterparse():
+            if cocktail.findtext("name") == name:
+                return _objectify_copy(cocktail)
+        return None
+
+    def find_cases(self, name):
+        return [_objectify_copy(cocktail) for cocktail in self._iterparse() if cocktail.findtext("name") == name]
+
+    def _is_removed(self, case):
+        # The cases are detached copies, and none is ever removed
+        return False
+
+    def add_case(self, case, write=True):
+        raise ReadOnlyCaseLibraryError(f"The streaming case library {self.case_library_path} is read-only.")
+
+    def remove_case(self, case, write=True):
+        raise ReadOnlyCaseLibraryError(f"The streaming case library {self.case_library_path} is read-only.")
+
+    def save(self):
+        raise ReadOnlyCaseLibraryError(f"The streaming case library {self.case_library_path} is read-only.")
+
+    def _iter_type_records(self):
+        for cocktail in self._iterparse():
+            ingredients = [
+                (
+                    ingredient.text,
+                    ingredient.attrib["alc_type"],
+                    ingredient.attrib["basic_taste"],
+                    ingredient.attrib["garnish_type"],
+                    1,
+                )
+                for ingredient in cocktail.find("ingredients").iterchildren()
+            ]
+            yield cocktail.findtext("category"), cocktail.findtext("glass"), 1, ingredients
+
+
+def _objectify_copy(element):
+    return objectify.fromstring(etree.tostring(element, with_tail=False))
+
+
+def load_case_library(case_library_path, streaming=False):
+    """
+    Load a case library from a single file or from a directory of shards.
+
+    Parameters
+    ----------
+    case_library_path : str
+        Path to the case library file or to the directory of a :class:`ShardedCaseLibrary`.
+
+    streaming : bool, default False
+        Whether to load the case library file as a read-only :class:`StreamingCaseLibrary`.
+
+    Returns
+    -------
+    case_library : CaseLibrary
+        The loaded case library.
+    """
+    if os.path.isdir(case_library_path):
+        if streaming:
+            raise ValueError("A sharded case library can not be streamed.")
+        return ShardedCaseLibrary(case_library_path)
+    if streaming:
+        return StreamingCaseLibrary(case_library_path)
+    return CaseLibrary(case_library_path)
 
 
 class ConstraintsBuilder:
@@ -611,37 +1433,76 @@ class ConstraintsBuilder:
         constraints: str
             An XPath pattern with the constraints.
         """
-        constraints = "./category"
+        return self.build_glass_path() + "//cocktail" + self._ingredient_predicates()
+
+    def build_glass_path(self):
+        """
+        Build the part of the `ConstraintsBuilder` that selects the glass nodes of the case library, that is, only the
+        category and glass constraints.
+
+        Returns
+        -------
+        constraints: str
+            An XPath pattern with the category and glass constraints.
+        """
+        return f"./category{self._category_predicates()}/glass{self._glass_predicates()}"
+
+    def build_case_test(self):
+        """
+        Build the constraints as a test on a single cocktail element that is still attached to its category and glass
+        ancestors.
+
+        Returns
+        -------
+        constraints: str
+            An XPath pattern that selects the cocktail itself if it matches the constraints.
+        """
+        constraints = "self::cocktail"
+        category_predicates = self._category_predicates()
+        if category_predicates:
+            constraints += f"[ancestor::category{category_predicates}]"
+        glass_predicates = self._glass_predicates()
+        if glass_predicates:
+            constraints += f"[ancestor::glass{glass_predicates}]"
+        return constraints + self._ingredient_predicates()
+
+    def _category_predicates(self):
+        predicates = ""
         if self.include_categories:
             cat_constraints = str.join(" ", self.include_categories)
-            constraints += f"[{cat_constraints}]"
+            predicates += f"[{cat_constraints}]"
         if self.exclude_categories:
             cat_constraints = str.join(" ", self.exclude_categories)
-            constraints += f"[{cat_constraints}]"
-        constraints += "/glass"
+            predicates += f"[{cat_constraints}]"
+        return predicates
+
+    def _glass_predicates(self):
+        predicates = ""
         if self.include_glasses:
             glass_constraint = str.join(" ", self.include_glasses)
-            constraints += f"[{glass_constraint}]"
+            predicates += f"[{glass_constraint}]"
         if self.exclude_glasses:
             glass_constraint = str.join(" ", self.exclude_glasses)
-            constraints += f"[{glass_constraint}]"
-        constraints += "//cocktail"
+            predicates += f"[{glass_constraint}]"
+        return predicates
+
+    def _ingredient_predicates(self):
+        predicates = ""
         if self.ingredient_constraints:
             for attr, values in self.ingredient_constraints.items():
                 if attr != "ingredient":
                     if "include" in values.keys():
-                        constraints += f"[descendant::ingredient[{' '.join(values['include'])}]]"
+                        predicates += f"[descendant::ingredient[{' '.join(values['include'])}]]"
                     if "exclude" in values.keys():
-                        constraints += f"[descendant::ingredient[{' '.join(values['exclude'])}]]"
+                        predicates += f"[descendant::ingredient[{' '.join(values['exclude'])}]]"
                 else:
                     if "include" in values.keys():
                         for value in values["include"]:
-                            constraints += f"[descendant::ingredient[{value}]]"
+                            predicates += f"[descendant::ingredient[{value}]]"
                     if "exclude" in values.keys():
                         for value in values["exclude"]:
-                            constraints += f"[descendant::ingredient[{value}]]"
-
-        return constraints
+                            predicates += f"[descendant::ingredient[{value}]]"
+        return predicates
 
     def from_query(self, query: Query):
         """
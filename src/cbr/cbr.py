@@ -1,43 +1,131 @@
 import copy
+import json
 import logging
 import random
 import re
+import time
 from typing import Tuple
 
 import numpy as np
+from lxml import etree
 from lxml.objectify import SubElement
 
 from definitions import CASE_LIBRARY_FILE as CASE_LIBRARY_PATH
 from definitions import LOG_FILE
-from src.cbr.case_library import CaseLibrary, ConstraintsBuilder
-from src.entity.cocktail import Cocktail
+from src.cbr.cache import QueryCache
+from src.cbr.case_library import (
+    ConstraintsBuilder,
+    ShardedCaseLibrary,
+    StreamingCaseLibrary,
+    load_case_library,
+)
+from src.cbr.completion import CompletionIndex
+from src.cbr.cooccurrence import CooccurrenceIndex
+from src.cbr.measures import MeasureIndex
+from src.cbr.neighbours import NeighbourIndex
+from src.cbr.query_log import QueryLog, query_fields
+from src.entity.cocktail import Cocktail, CompactCocktail
 from src.entity.query import Query
 from src.utils.helper import count_ingr_ids, replace_ingredient
-
-
-def _compute_utility(case):
-    return ((case.UaS / (case.success_count + 1e-5)) - (case.UaF / (case.failure_count + 1e-5)) + 1) / 2
+from src.utils.metrics import REGISTRY, weak_function
+from src.utils.profiling import get_profiler
+
+CANDIDATE_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERIES = REGISTRY.counter("cbr_queries_total", "Queries run by the CBR.")
+STEP_DURATION = REGISTRY.histogram(
+    "cbr_step_duration_seconds", "Seconds taken by the retrieve, adapt and learn steps.", labels=("step",)
+)
+CANDIDATES = REGISTRY.histogram(
+    "cbr_candidates", "Candidate cases scored by each retrieval.", buckets=CANDIDATE_BUCKETS
+)
+RELAXATION_LEVEL = REGISTRY.histogram(
+    "cbr_relaxation_level",
+    "Relaxation steps of the query needed to find 5 candidate cases, of the retrievals not found in the query cache.",
+    buckets=(0, 1, 2, 3, 4, 5, 6),
+)
+EVALUATIONS = REGISTRY.counter("cbr_evaluations_total", "Evaluations of adapted cases.", labels=("evaluation",))
+LEARNED_CASES = REGISTRY.counter("cbr_learned_cases_total", "Cases added to the case library by the learning.")
+FORGOTTEN_CASES = REGISTRY.counter("cbr_forgotten_cases_total", "Cases removed from the case library by forget_cases.")
+CASES = REGISTRY.gauge("cbr_cases", "Cases in the case library.")
+CACHE_HITS = REGISTRY.counter("cbr_query_cache_hits_total", "Retrievals found in the query cache.")
+CACHE_MISSES = REGISTRY.counter("cbr_query_cache_misses_total", "Retrievals not found in the query cache.")
+CACHE_ENTRIES = REGISTRY.gauge("cbr_query_cache_entries", "Entries of the query cache.")
+
+
+def _relax_query(query, counter):
+    """
+    Remove the constraints of the query for the given relaxation step.
+    """
+    if counter == 0:
+        query.ingredients = []
+    elif counter == 1:
+        query.basic_tastes = []
+    elif counter == 2:
+        query.alc_types = []
+    elif counter == 3:
+        query.exc_ingredients = []
+    elif counter == 4:
+        query.glass = ""
+    else:
+        query.category = ""
 
 
 class CBR:
-    def __init__(self, case_library_file=None, seed=None):
+    def __init__(
+        self,
+        case_library_file=None,
+        seed=None,
+        streaming=False,
+        cache_size=256,
+        weights_file=None,
+        n_neighbours=8,
+        query_log=None,
+        memory_budget=None,
+    ):
         """
         Case-Based Reasoning system.
 
         Parameters
         ----------
         case_library_file : str or None
-            The path to the case library file. If None it will use the default case library.
+            The path to the case library file, or to the directory of a sharded case library. If None it will use the
+            default case library.
 
         seed : int or None
             The seed for the internal pseudo-random number generator.
+
+        streaming : bool, default False
+            Whether to retrieve by streaming the case library file instead of loading it. The case library is then
+            read-only, so the system can not learn.
+
+        cache_size : int, default 256
+            The maximum number of retrieval results kept in the query cache. If 0 the results are not cached. Results
+            are never cached in streaming mode.
+
+        weights_file : str or None
+            The path to a JSON file with similarity weights, e.g. written by ``src/tune_weights.py``. If None it uses
+            the default weights.
+
+        n_neighbours : int, default 8
+            The number of neighbours of each case in the graph of similar cases used by the adaptation and forgetting,
+            see :class:`cbr.neighbours.NeighbourIndex`. If 0, or in streaming mode, the graph is not built.
+
+        query_log : str or None
+            The path to a file where the queries and evaluations are logged, see :class:`cbr.query_log.QueryLog`. Each
+            query then runs with its own seed, drawn from a generator seeded with ``seed``, so the log can be replayed.
+            If None they are not logged.
+
+        memory_budget : int or None
+            The maximum bytes of memory used by the case library, its indexes and caches, see
+            :meth:`CBR.enforce_memory_budget`. It is checked again after learning, when an estimate of the memory
+            exceeds it. If None there is no limit.
         """
         self.UTILITY_THRESHOLD = 0.8
         self.EVALUATION_THRESHOLD = 0.6
         if case_library_file is not None:
-            self.case_library = CaseLibrary(case_library_file)
+            self.case_library = load_case_library(case_library_file, streaming)
         else:
-            self.case_library = CaseLibrary(CASE_LIBRARY_PATH)
+            self.case_library = load_case_library(CASE_LIBRARY_PATH, streaming)
         self.alc_types = set()
         self.basic_tastes = set()
         self.ingredients = set()
@@ -58,6 +146,34 @@ class CBR:
             "exc_alc_type": -1.0,
             "exc_basic_taste": -1.0,
         }
+        self.neighbours = None
+        self._document_rank = None
+        if weights_file is not None:
+            self.load_weights(weights_file)
+        self.query_cache = QueryCache(cache_size) if cache_size and not streaming else None
+        if streaming:
+            # Building the co-occurrences would hold every case in memory, so only the popularity is ranked
+            self.cooccurrence = CooccurrenceIndex.from_ontology(
+                self.case_library.ingredients_onto, self.case_library.value_counter["ingredients"]
+            )
+        else:
+            self.cooccurrence = CooccurrenceIndex()
+            self.case_library.register_index(self.cooccurrence)
+        self.measures = MeasureIndex()
+        self.case_library.register_index(self.measures)
+        # A sharded case library only loads the shards searched, so the cases it indexes grow as they are searched
+        lazy = streaming or isinstance(self.case_library, ShardedCaseLibrary)
+        if lazy:
+            # The values of the type sets are enough to complete, without reading the cases
+            self.completion = CompletionIndex.from_value_counter(self.case_library.value_counter)
+            if not streaming:
+                self.case_library.register_index(self.completion, build=False)
+        else:
+            self.completion = CompletionIndex()
+            self.case_library.register_index(self.completion)
+        if n_neighbours and not lazy:
+            self.neighbours = NeighbourIndex(self.case_library.case_store, self.sim_weights, k=n_neighbours)
+            self.case_library.register_index(self.neighbours)
         self.logger = logging.getLogger("CBR")
         self.logger.setLevel(logging.INFO)
 
@@ -70,8 +186,35 @@ class CBR:
 
         if seed is not None:
             random.seed(seed)
+        self._seeds = random.Random(seed)
+        self.query_log = QueryLog(query_log, self) if query_log is not None else None
+        self.memory_budget = memory_budget
+        # Running estimate of the memory used, measured by the last check of the budget and grown by the learned cases
+        self.MEMORY_CHECK_INTERVAL = 100
+        self._memory_estimate = 0
+        self._memory_per_case = None
+        self._learned_since_check = 0
+        self.enforce_memory_budget()
+        profiler = get_profiler()
+        if profiler is not None:
+            profiler.instrument(self)
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """
+        Report the size of the case library and the query cache of this CBR in the metrics, see
+        :data:`utils.metrics.REGISTRY`. The last CBR created is the one reported.
+        """
+
+        def cache(function):
+            return weak_function(self, lambda cbr: function(cbr.query_cache) if cbr.query_cache is not None else None)
 
-    def run_query(self, query, new_name) -> Tuple[Cocktail, Cocktail]:
+        CASES.set_function(weak_function(self, lambda cbr: sum(cbr.case_library.value_counter["drink_types"].values())))
+        CACHE_HITS.set_function(cache(lambda query_cache: query_cache.hits))
+        CACHE_MISSES.set_function(cache(lambda query_cache: query_cache.misses))
+        CACHE_ENTRIES.set_function(cache(len))
+
+    def run_query(self, query, new_name, candidates=None, progress=None) -> Tuple[Cocktail, Cocktail]:
         """
         Run the CBR and obtain a new case based on the given query.
 
@@ -81,32 +224,181 @@ class CBR:
             User query with recipe requirements.
         new_name : str
             The name for the adapted recipe.
+        candidates : tuple or None
+            The candidate cases of the query and their similarity, if they were already computed.
+        progress : callable or None
+            Called with the name of each step, "retrieve" and "adapt", before it starts.
 
         Returns
         -------
-        retrieved_case: `Cocktail`
-            The retrieved case being adapted.
+        retrieved_case: `Cocktail` or `CompactCocktail`
+            The retrieved case being adapted. It is built directly from the case store when the case is in it.
         adapted_case: `Cocktail`
             The adapted case.
         """
-        self.retrieve(query)
+        if self.query_log is not None:
+            query_seed = self._seeds.getrandbits(32)
+            random.seed(query_seed)
+            fields = query_fields(query)
+            start = time.perf_counter()
+        QUERIES.inc()
+        if progress is not None:
+            progress("retrieve")
+        step_start = time.perf_counter()
+        self.retrieve(query, candidates)
+        STEP_DURATION.labels("retrieve").observe(time.perf_counter() - step_start)
+        if progress is not None:
+            progress("adapt")
+        step_start = time.perf_counter()
         self.adapt(new_name)
+        STEP_DURATION.labels("adapt").observe(time.perf_counter() - step_start)
         self.logger.info(f"Similarity of the adapted case: {self._similarity_cocktail(self.adapted_recipe)}")
-        retrieved_case = Cocktail().from_element(self.retrieved_recipe)
+        row = self.case_library.case_store.row(self.retrieved_recipe)
+        if row is not None:
+            retrieved_case = CompactCocktail.from_store(self.case_library.case_store, row)
+        else:
+            retrieved_case = Cocktail().from_element(self.retrieved_recipe)
         adapted_case = Cocktail().from_element(self.adapted_recipe)
+        if self.query_log is not None:
+            self.query_log.log_query(fields, new_name, query_seed, self.get_state(), time.perf_counter() - start)
         return retrieved_case, adapted_case
 
+    def load_weights(self, weights_file):
+        """
+        Load the similarity weights from a JSON file.
+
+        Parameters
+        ----------
+        weights_file : str
+            The path to a JSON file with the weights in a ``sim_weights`` object. Weights missing from the file keep
+            their value.
+        """
+        with open(weights_file, encoding="utf-8") as f:
+            self.set_weights(json.load(f)["sim_weights"])
+
+    def set_weights(self, weights):
+        """
+        Set the similarity weights.
+
+        Parameters
+        ----------
+        weights : dict
+            The new value of each weight. Weights missing from it keep their value.
+        """
+        unknown = set(weights) - set(self.sim_weights)
+        if unknown:
+            raise ValueError(f"Unknown similarity weights: {', '.join(sorted(unknown))}")
+        self.sim_weights.update({name: float(weight) for name, weight in weights.items()})
+        if self.neighbours is not None:
+            self.neighbours.build(self.case_library.findall(ConstraintsBuilder()))
+
+    def memory_report(self):
+        """
+        Report the memory used by the case library, its indexes and the query cache, see
+        :meth:`CaseLibrary.memory_report`.
+        """
+        return self.case_library.memory_report(dict(query_cache=self.query_cache))
+
+    def enforce_memory_budget(self):
+        """
+        Release memory until the case library, its indexes and caches fit in the memory budget.
+
+        The steps are taken in order, from the cheapest to undo, until the memory fits:
+
+        1. Clear the query cache and the cache of most common measures.
+        2. Compact the XML trees, see :meth:`CaseLibrary.compact`.
+        3. Disable the query cache, so retrieval scores every candidate.
+        4. Drop the graph of neighbours, so the adaptation only uses the similar recipes and the forgetting searches
+           the case library.
+
+        Returns
+        -------
+        actions : list of str
+            The steps taken, empty if there is no budget or the memory already fits.
+        """
+        if self.memory_budget is None:
+            return []
+        actions = []
+        steps = [
+            ("clear caches", self._clear_caches),
+            ("compact trees", self.case_library.compact),
+            ("disable query cache", self._disable_query_cache),
+            ("drop neighbours", self._drop_neighbours),
+        ]
+        report = self.memory_report()
+        for action, step in steps:
+            if report["total"] <= self.memory_budget:
+                break
+            step()
+            actions.append(action)
+            report = self.memory_report()
+            self.logger.info(f"Memory: {action}, {report['total']} bytes used of a budget of {self.memory_budget}")
+        if report["total"] > self.memory_budget:
+            self.logger.warning(f"Memory: {report['total']} bytes used exceed the budget of {self.memory_budget}")
+        self._memory_estimate = report["total"]
+        self._memory_per_case = report["per_case"]["total"]
+        self._learned_since_check = 0
+        return actions
+
+    def _check_memory_budget(self, n_learned):
+        """
+        Grow the estimate of the memory used by the learned cases, at the average bytes per case of the last check, and
+        enforce the memory budget only when the estimate exceeds it or every ``MEMORY_CHECK_INTERVAL`` learned cases,
+        instead of measuring the memory after each learning.
+        """
+        if self.memory_budget is None or not n_learned:
+            return
+        if self._memory_per_case is None:
+            self.enforce_memory_budget()
+            return
+        self._memory_estimate += n_learned * self._memory_per_case
+        self._learned_since_check += n_learned
+        if self._memory_estimate > self.memory_budget or self._learned_since_check >= self.MEMORY_CHECK_INTERVAL:
+            self.enforce_memory_budget()
+
+    def _clear_caches(self):
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        self.measures.clear_cache()
+        self._document_rank = None
+
+    def _disable_query_cache(self):
+        self.query_cache = None
+
+    def _drop_neighbours(self):
+        if self.neighbours is not None:
+            self.case_library.unregister_index(self.neighbours)
+            self.neighbours = None
+
+    def get_state(self):
+        """
+        Get the state of the last query, needed to evaluate it later.
+
+        Returns
+        -------
+        state : tuple
+            The query, the retrieved case, the similar cases and the adapted case.
+        """
+        return self.query, self.retrieved_recipe, self.sim_recipes, self.adapted_recipe
+
+    def set_state(self, state):
+        """
+        Restore the state of a query obtained with :meth:`CBR.get_state`, so it can be evaluated.
+
+        Parameters
+        ----------
+        state : tuple
+            The state of the query.
+        """
+        self.query, self.retrieved_recipe, self.sim_recipes, self.adapted_recipe = state
+
     def _search_ingredient(self, ingr_text=None, basic_taste=None, alc_type=None):
         if ingr_text:
-            return copy.deepcopy(random.choice(self.case_library.findall(".//ingredient[.='{}']".format(ingr_text))))
+            return copy.deepcopy(random.choice(self.case_library.find_ingredients(text=ingr_text)))
         if basic_taste:
-            return copy.deepcopy(
-                random.choice(self.case_library.findall(".//ingredient[@basic_taste='{}']".format(basic_taste)))
-            )
+            return copy.deepcopy(random.choice(self.case_library.find_ingredients(basic_taste=basic_taste)))
         if alc_type:
-            return copy.deepcopy(
-                random.choice(self.case_library.findall(".//ingredient[@alc_type='{}']".format(alc_type)))
-            )
+            return copy.deepcopy(random.choice(self.case_library.find_ingredients(alc_type=alc_type)))
         else:
             return
 
@@ -127,18 +419,28 @@ class CBR:
                 else:
                     self.adapted_recipe.preparation.remove(step)
 
+    def _neighbour_recipes(self):
+        """
+        The similar recipes of the query, followed by the neighbours of the retrieved recipe that are not among them.
+        """
+        recipes = list(self.sim_recipes)
+        if self.neighbours is not None:
+            for neighbour in self.neighbours.neighbours_of(self.retrieved_recipe):
+                if not any(neighbour is recipe for recipe in self.sim_recipes):
+                    recipes.append(neighbour)
+        return recipes
+
     def search_ingr_measure(self, ingr_text):
-        for recipe in self.sim_recipes:
-            for ingr in recipe.ingredients.iterchildren():
-                if ingr.text == ingr_text:
-                    return ingr.attrib["measure"]
-        return None
+        measure = self.measures.most_common(ingr_text)
+        return measure[0] if measure is not None else None
 
     def exclude_ingredient(self, exc_ingr):
         """
         When the ingredient is not alcohol, replaces it in the recipe by an
         ingredient with the same basic_taste in the list of ingredients
-        to include or in the list of similar recipes.
+        to include or in the similar recipes and the neighbours of the
+        retrieved recipe, or else by the one
+        of the case library most often found with the other ingredients.
         If such an ingredient is not found or the ingredient to exclude is
         an alcohol, deletes it from the recipe ingredients and preparation.
 
@@ -151,24 +453,25 @@ class CBR:
             for ingr in self.query.get_ingredients():
                 if replace_ingredient(exc_ingr, ingr):
                     return
-            for recipe in self.sim_recipes:
+            for recipe in self._neighbour_recipes():
                 for ingr in recipe.ingredients.iterchildren():
                     if replace_ingredient(exc_ingr, ingr):
                         return
-            for _ in range(20):
-                ingr = self._search_ingredient(
-                    basic_taste=exc_ingr.attrib["basic_taste"], alc_type=exc_ingr.attrib["alc_type"]
+            if exc_ingr.attrib["basic_taste"]:
+                substitutes = self.cooccurrence.substitutes(
+                    exc_ingr.text,
+                    exc_ingr.attrib["alc_type"],
+                    exc_ingr.attrib["basic_taste"],
+                    context=self.ingredients - {exc_ingr.text},
+                    exclude=self.ingredients | set(self.query.get_exc_ingredients()),
                 )
-                if ingr is None:
-                    self.delete_ingredient(exc_ingr)
-                    return
-                if exc_ingr.text != ingr.text:
-                    exc_ingr._setText(ingr.text)
+                if substitutes:
+                    exc_ingr._setText(substitutes[0])
                     return
         self.delete_ingredient(exc_ingr)
         return
 
-    def include_ingredient(self, ingr, measure="some"):
+    def include_ingredient(self, ingr, measure=None):
         """
         Includes an ingredient in the recipe.
 
@@ -176,25 +479,22 @@ class CBR:
         ----------
         ingr : :class:`lxml.objectify.ObjectifiedElement`
             Ingredient to include in the recipe.
-        measure : str
-            Quantity of the ingredient to include.
+        measure : str or None
+            Quantity of the ingredient to include. If None, it uses the most
+            common measure of the ingredient in the case library, with its
+            quantity and unit, or "some" if the ingredient has no measure.
         """
+        if measure is None:
+            measure = "some"
+            observed = self.measures.most_common(ingr.text)
+            if observed is not None:
+                measure, quantity, unit = observed
+                ingr.attrib["quantity"] = str(quantity)
+                ingr.attrib["unit"] = unit
         ingr.attrib["id"] = f"ingr{len(self.adapted_recipe.ingredients.ingredient[:])}"
         measure = re.sub(r"\sof\b", "", measure)
         ingr.attrib["measure"] = measure
-        self.logger.debug(
-            "before appending {}: {}".format(
-                ingr,
-                len(self.case_library.ET.getroot().find(".//cocktail[name='Apple Grande']").ingredients.ingredient[:]),
-            )
-        )
         self.adapted_recipe.ingredients.append(ingr)
-        self.logger.debug(
-            "after appending {}: {}".format(
-                ingr,
-                len(self.case_library.ET.getroot().find(".//cocktail[name='Apple Grande']").ingredients.ingredient[:]),
-            )
-        )
         step = SubElement(self.adapted_recipe.preparation, "step")
         if measure == "some":
             step._setText(f"add {ingr.attrib['id']} to taste")
@@ -205,7 +505,9 @@ class CBR:
     def adapt_alcohols_and_tastes(self, alc_type="", basic_taste=""):
         """
         Finds an ingredient with a certain alcohol type or basic taste
-        in the list of similar recipes or de case library and includes it
+        in the similar recipes and the neighbours of the retrieved recipe, or
+        else the one of the case library
+        most often found with the ingredients of the recipe, and includes it
         in the recipe.
 
         Parameters
@@ -215,23 +517,21 @@ class CBR:
         basic_taste
             Type of basic taste to include.
         """
-        for recipe in self.sim_recipes:
+        for recipe in self._neighbour_recipes():
             ingrs = recipe.ingredients.findall(
                 "ingredient[@basic_taste='{}'][@alc_type='{}']".format(basic_taste, alc_type)
             )
             for ingr in ingrs:
                 if ingr.text not in self.query.get_exc_ingredients():
-                    self.include_ingredient(ingr, ingr.attrib["measure"])
+                    self.include_ingredient(copy.deepcopy(ingr), ingr.attrib["measure"])
                     return
-        counter = 0
-        while True:
-            ingr = self._search_ingredient(basic_taste=basic_taste, alc_type=alc_type)
-            if counter > 10 or ingr.text not in self.query.get_exc_ingredients():
-                self.include_ingredient(ingr)
-                return
-            counter += 1
+        candidates = self.cooccurrence.candidates(
+            alc_type, basic_taste, context=self.ingredients, exclude=self.query.get_exc_ingredients()
+        )
+        if candidates:
+            self.include_ingredient(self._search_ingredient(candidates[0]))
 
-    def retrieve(self, query: Query):
+    def retrieve(self, query: Query, candidates=None):
         """
         Retrieves the 5 most similar cases for the given query.
 
@@ -239,39 +539,23 @@ class CBR:
         ----------
         query : :class:`entity.query.Query`
             User query with recipe requirements.
+
+        candidates : tuple or None
+            The candidate cocktail elements of the query and the list of their similarity, if they were already
+            computed, e.g. by a :class:`cbr.worker_pool.WorkerPool`.
         """
         self.query = query
         self.ingredients = set()
         self.basic_tastes = set()
         self.alc_types = set()
 
-        # Filter elements that correspond to the category constraint
-        list_recipes = self.case_library.findall(ConstraintsBuilder().from_query(self.query))
-
-        # If we have less than 5 recipes matching the user constraints,
-        # we relax them progressively until having at least 5 recipes.
-        counter = 0
-        soft_query = copy.deepcopy(self.query)
-        while len(list_recipes) < 5:
-            if counter == 0:
-                soft_query.ingredients = []
-            elif counter == 1:
-                soft_query.basic_tastes = []
-            elif counter == 2:
-                soft_query.alc_types = []
-            elif counter == 3:
-                soft_query.exc_ingredients = []
-            elif counter == 4:
-                soft_query.glass = ""
-            else:
-                soft_query.category = ""
-
-            aux_recipes = self.case_library.findall(ConstraintsBuilder().from_query(soft_query))
-            list_recipes += aux_recipes
-            counter += 1
-
-        # Compute similarity with each of the cocktails of the searching list
-        sim_list = [self._similarity_cocktail(c) for c in list_recipes]
+        if candidates is not None:
+            list_recipes, sim_list = list(candidates[0]), list(candidates[1])
+        elif isinstance(self.case_library, StreamingCaseLibrary):
+            list_recipes, sim_list = self._stream_retrieve()
+        else:
+            list_recipes, sim_list = self._cached_retrieve()
+        CANDIDATES.observe(len(list_recipes))
 
         # Max index
         max_indices = np.argwhere(np.array(sim_list) == np.amax(np.array(sim_list))).flatten().tolist()
@@ -292,10 +576,176 @@ class CBR:
         self.logger.info(
             f"Retrieve: Similarity of the next 4 most similar cases is {np.round(sim_list, 4)[sorted_sim[:4]]}"
         )
+        self.case_library.sync_counters([self.retrieved_recipe])
         self.adapted_recipe = copy.deepcopy(self.retrieved_recipe)
         self.update_ingr_list()
         self.query.set_ingredients([self._search_ingredient(ingr) for ingr in self.query.get_ingredients()])
 
+    def retrieve_batch(self, queries):
+        """
+        Search the candidate cases of several queries and compute their similarity at once.
+
+        The queries are matched and scored over the case store of the case library, with a single pass over the
+        ingredients of the cases for the whole batch, see :meth:`cbr.vocabulary.CaseArrays.batch`. The candidates are
+        the same, in the same order, as those searched by :meth:`CBR.retrieve`, and they are looked up and stored in the
+        query cache the same way.
+
+        Parameters
+        ----------
+        queries : list of :class:`entity.query.Query`
+            User queries with recipe requirements.
+
+        Returns
+        -------
+        candidates : list of tuple or None
+            For each query the list of candidate cocktail elements and the list of their similarity, as expected by
+            :meth:`CBR.retrieve`. A sharded or streaming case library is not held in the case store as a whole, so
+            the candidates are None and each query is searched by :meth:`CBR.retrieve`.
+        """
+        case_library = self.case_library
+        if isinstance(case_library, (ShardedCaseLibrary, StreamingCaseLibrary)):
+            return [None] * len(queries)
+        case_store = case_library.case_store
+        candidates = [None] * len(queries)
+        keys = list(range(len(queries)))
+        if self.query_cache is not None:
+            keys = [(query.freeze(), tuple(self.sim_weights.items())) for query in queries]
+
+        def cached(i):
+            if self.query_cache is not None:
+                found = self.query_cache.get(keys[i], case_library.epoch)
+                if found is not None:
+                    rows, scores = found
+                    candidates[i] = ([case_store.cases[row] for row in rows], scores.tolist())
+            return candidates[i] is not None
+
+        # Identical queries of the batch are only searched once, then found in the query cache
+        first = dict()
+        for i in range(len(queries)):
+            if keys[i] not in first and not cached(i):
+                first[keys[i]] = i
+        indices = list(first.values())
+        if not indices:
+            return candidates
+
+        # The candidates of each relaxation level are sorted in document order, like the ones of findall
+        if self._document_rank is None or self._document_rank[0] != case_library.epoch:
+            rows = case_store.rows(case_library.findall(ConstraintsBuilder()))
+            rank = np.zeros(len(case_store.alive), dtype=np.intp)
+            rank[rows] = np.arange(len(rows))
+            self._document_rank = (case_library.epoch, rank)
+        rank = self._document_rank[1]
+
+        encode = case_library.vocabulary.encode_query
+        encoded = {i: encode(queries[i], case_library.ingredients_onto) for i in indices}
+        arrays = case_store.batch(list(encoded.values()))
+        for i in indices:
+            levels = [np.flatnonzero(arrays.matches(encoded[i]))]
+            counter = 0
+            soft_query = copy.deepcopy(queries[i])
+            while sum(map(len, levels)) < 5:
+                _relax_query(soft_query, counter)
+                levels.append(np.flatnonzero(arrays.matches(encode(soft_query, case_library.ingredients_onto))))
+                counter += 1
+            RELAXATION_LEVEL.observe(counter)
+            rows = np.concatenate([level[np.argsort(rank[level], kind="stable")] for level in levels])
+            sim_list = arrays.similarity(encoded[i], self.sim_weights, rows).tolist()
+            if self.query_cache is not None:
+                self.query_cache.put(keys[i], case_library.epoch, rows, sim_list)
+            candidates[i] = ([case_store.cases[row] for row in rows], sim_list)
+        for i in range(len(queries)):
+            if candidates[i] is None and not cached(i):
+                # The result was too large for the query cache
+                candidates[i] = candidates[first[keys[i]]]
+        return candidates
+
+    def _cached_retrieve(self):
+        """
+        Search the candidate cases for the current query and compute their similarity.
+
+        The result is looked up first in the query cache, keyed by the frozen query and the similarity weights, and
+        stored there after being computed.
+
+        Returns
+        -------
+        list_recipes : list of :class:`lxml.objectify.ObjectifiedElement`
+            The cases matching the query, relaxed until having at least 5 cases.
+
+        sim_list : list of float
+            The similarity of each case.
+        """
+        case_store = self.case_library.case_store
+        key = None
+        if self.query_cache is not None:
+            key = (self.query.freeze(), tuple(self.sim_weights.items()))
+            cached = self.query_cache.get(key, self.case_library.epoch)
+            if cached is not None:
+                rows, scores = cached
+                return [case_store.cases[row] for row in rows], scores.tolist()
+
+        # Filter elements that correspond to the category constraint
+        list_recipes = self.case_library.findall(ConstraintsBuilder().from_query(self.query))
+
+        # If we have less than 5 recipes matching the user constraints,
+        # we relax them progressively until having at least 5 recipes.
+        counter = 0
+        soft_query = copy.deepcopy(self.query)
+        while len(list_recipes) < 5:
+            _relax_query(soft_query, counter)
+            aux_recipes = self.case_library.findall(ConstraintsBuilder().from_query(soft_query))
+            list_recipes += aux_recipes
+            counter += 1
+        RELAXATION_LEVEL.observe(counter)
+
+        # Compute similarity with each of the cocktails of the searching list
+        sim_list = self._similarity_cocktails(list_recipes)
+        if key is not None:
+            self.query_cache.put(key, self.case_library.epoch, case_store.rows(list_recipes), sim_list)
+        return list_recipes, sim_list
+
+    def _stream_retrieve(self):
+        """
+        Retrieve the 5 most similar cases for the current query by streaming the case library.
+
+        The cases are scored as they are read for every relaxation level of the query at once, so the case library is
+        only read once.
+
+        Returns
+        -------
+        list_recipes : list of :class:`lxml.objectify.ObjectifiedElement`
+            The most similar cases for the first relaxation level with at least 5 cases.
+
+        sim_list : list of float
+            The similarity of each case.
+        """
+        soft_query = copy.deepcopy(self.query)
+        constraints = [ConstraintsBuilder().from_query(soft_query)]
+        for counter in range(6):
+            _relax_query(soft_query, counter)
+            constraints.append(ConstraintsBuilder().from_query(soft_query))
+        return self.case_library.top_cases(constraints, self._similarity_cocktail, k=5, min_cases=5)
+
+    def _similarity_cocktails(self, cocktails):
+        """
+        Similarity between the query and a list of cocktails.
+
+        It is equivalent to :meth:`CBR._similarity_cocktail`, but the query is translated into ids once and the
+        similarity is computed for all the cocktails at once over the case store of the case library.
+
+        Parameters
+        ----------
+        cocktails : list of lxml.objectify.ObjectifiedElement
+            cocktail Elements of the case library
+
+        Returns
+        -------
+        list of float:
+            normalized similarity of each cocktail
+        """
+        case_store = self.case_library.case_store
+        query = self.case_library.vocabulary.encode_query(self.query, self.case_library.ingredients_onto)
+        return case_store.similarity(query, self.sim_weights, case_store.rows(cocktails)).tolist()
+
     def _similarity_cocktail(self, cocktail):
         """Similarity between a set of constraints and a particular cocktail.
 
@@ -304,7 +754,7 @@ class CBR:
 
         Parameters
         ----------
-        cocktail : lxml.objectify.ObjectifiedElement
+        cocktail : lxml.objectify.ObjectifiedElement or lxml.etree.Element
             cocktail Element
 
         Returns
@@ -322,7 +772,7 @@ class CBR:
         c_ingredients = set()
         c_ingredients_alc_type = set()
         c_ingredients_basic_type = set()
-        for ingredient in cocktail.ingredients.iterchildren():
+        for ingredient in cocktail.find("ingredients").iterchildren():
             c_ingredients.add(ingredient.text)
             c_ingredients_alc_type.add(ingredient.attrib["alc_type"])
             c_ingredients_basic_type.add(ingredient.attrib["basic_taste"])
@@ -369,7 +819,7 @@ class CBR:
                 cumulative_norm_score += self.sim_weights["basic_taste_match"]
 
         # Increase similarity if glass type is a match. Glass type is not very relevant for the case
-        if cocktail.glass.text == self.query.glass:
+        if cocktail.findtext("glass") == self.query.glass:
             sim += self.sim_weights["glass_type_match"]
             cumulative_norm_score += self.sim_weights["glass_type_match"]
         # In case the constraint is not fulfilled we add the weight to the normalization score
@@ -412,7 +862,7 @@ class CBR:
         else:
             normalized_sim = sim / cumulative_norm_score
 
-        return normalized_sim * float(cocktail.find("utility").text)
+        return normalized_sim * float(cocktail.findtext("utility"))
 
     def adapt(self, new_name):
         """
@@ -435,11 +885,7 @@ class CBR:
 
         for ingr in self.query.get_ingredients():
             if ingr.text not in self.ingredients:
-                measure = self.search_ingr_measure(ingr.text)
-                if measure:
-                    self.include_ingredient(ingr, measure)
-                else:
-                    self.include_ingredient(ingr)
+                self.include_ingredient(ingr)
 
         self.update_ingr_list()
 
@@ -452,51 +898,112 @@ class CBR:
                 self.adapt_alcohols_and_tastes(basic_taste=basic_taste)
 
     def evaluate(self, user_score):
-        if user_score > self.EVALUATION_THRESHOLD:
-            self.adapted_recipe.evaluation = "success"
-            self.logger.info("Evaluation: success")
-            self.retrieved_recipe.UaS += 1
-            self.retrieved_recipe.success_count += 1
-            self.retrieved_recipe.utility = _compute_utility(self.retrieved_recipe)
-            for recipe in self.sim_recipes:
-                recipe.success_count += 1
-                recipe.utility = _compute_utility(recipe)
-        else:
-            self.adapted_recipe.evaluation = "failure"
-            self.logger.info("Evaluation: failure")
-            self.retrieved_recipe.UaF += 1
-            self.retrieved_recipe.failure_count += 1
-            self.retrieved_recipe.utility = _compute_utility(self.retrieved_recipe)
-            for recipe in self.sim_recipes:
-                recipe.failure_count += 1
-                recipe.utility = _compute_utility(recipe)
+        self.record_evaluation(user_score)
         self.learn()
 
+    def record_evaluation(self, user_score):
+        """
+        Update the evaluation of the adapted case and the counters and utility of the retrieved and similar cases,
+        without learning the adapted case.
+
+        Parameters
+        ----------
+        user_score : float
+            The score given by the user, between 0 and 1.
+        """
+        self.record_evaluations([(user_score, self.get_state())])
+
+    def record_evaluations(self, evaluations):
+        """
+        Record a batch of evaluations, like :meth:`CBR.record_evaluation`, with a single update of the counters.
+
+        Parameters
+        ----------
+        evaluations : list of tuple
+            The score given by the user and the state of the evaluated query, from :meth:`CBR.get_state`, of each
+            evaluation.
+        """
+        success = []
+        for user_score, (_, _, _, adapted_recipe) in evaluations:
+            success.append(user_score > self.EVALUATION_THRESHOLD)
+            adapted_recipe.evaluation = "success" if success[-1] else "failure"
+            EVALUATIONS.labels(adapted_recipe.evaluation).inc()
+            self.logger.info(f"Evaluation: {adapted_recipe.evaluation}")
+        self.case_library.record_feedback(
+            [retrieved_recipe for _, (_, retrieved_recipe, _, _) in evaluations],
+            [sim_recipes for _, (_, _, sim_recipes, _) in evaluations],
+            success,
+        )
+        if self.query_log is not None:
+            self.query_log.log_evaluations(evaluations)
+
+    def learn_evaluations(self, evaluations, write=True):
+        """
+        Apply a batch of evaluations: update the counters at once, learn the successful cases, forget once and write
+        once.
+
+        Parameters
+        ----------
+        evaluations : list of tuple
+            The score given by the user and the state of the evaluated query, from :meth:`CBR.get_state`, of each
+            evaluation.
+
+        write : bool, default True
+            Whether to write the case library.
+        """
+        learned = 0
+        self.record_evaluations(evaluations)
+        start = time.perf_counter()
+        for _, (_, _, _, adapted_recipe) in evaluations:
+            if adapted_recipe.evaluation == "success":
+                self.case_library.add_case(adapted_recipe, write=False)
+                self.logger.info("Learning: learning the new case")
+                LEARNED_CASES.inc()
+                learned += 1
+        if learned:
+            self.forget_cases(write=False)
+        if write:
+            self.case_library.save()
+        STEP_DURATION.labels("learn").observe(time.perf_counter() - start)
+        self._check_memory_budget(learned)
+
     # Create a function to learn the cases adapted to the case_library
-    def learn(self):
+    def learn(self, write=True):
         if self.adapted_recipe.evaluation == "success":
-            self.case_library.add_case(self.adapted_recipe)
+            start = time.perf_counter()
+            self.case_library.add_case(self.adapted_recipe, write)
             self.logger.info("Learning: learning the new case")
-            self.forget_cases()
+            LEARNED_CASES.inc()
+            self.forget_cases(write)
+            STEP_DURATION.labels("learn").observe(time.perf_counter() - start)
+            self._check_memory_budget(1)
         else:
             self.logger.info("Learning: There is nothing to learn.")
 
     # Create a function to forget the case from the case library that has less success or with the highest similarity
-    def forget_cases(self):
-        for recipe in self.case_library.findall(f".//cocktail[utility < {self.UTILITY_THRESHOLD}]"):
+    def forget_cases(self, write=True):
+        for recipe in self.case_library.low_utility_cases(self.UTILITY_THRESHOLD):
             alc_types = (ingredient.attrib["alc_type"] for ingredient in recipe.ingredients.iterchildren())
             basic_tastes = (ingredient.attrib["basic_taste"] for ingredient in recipe.ingredients.iterchildren())
-            if (
-                len(
-                    self.case_library.findall(
-                        ConstraintsBuilder(recipe.category, recipe.glass)
-                        .filter_alc_type(list(alc_types))
-                        .filter_taste(list(basic_tastes))
-                    )
-                )
-                > 1
-            ):
-                self.case_library.remove_case(recipe)
+            constraints = (
+                ConstraintsBuilder(recipe.category, recipe.glass)
+                .filter_alc_type(list(alc_types))
+                .filter_taste(list(basic_tastes))
+            )
+            if self._has_similar_case(recipe, constraints):
+                self.case_library.remove_case(recipe, write)
+                FORGOTTEN_CASES.inc()
                 self.logger.info(
                     f"Learning: Remove case {recipe.name} with utility {recipe.utility} from the Case Library."
                 )
+
+    def _has_similar_case(self, recipe, constraints):
+        """
+        Whether another case of the case library matches the constraints. The neighbours of the recipe are tested first,
+        so the case library is only searched when none of them matches.
+        """
+        if self.neighbours is not None:
+            test = etree.XPath(constraints.build_case_test())
+            if any(test(neighbour) for neighbour in self.neighbours.neighbours_of(recipe)):
+                return True
+        return len(self.case_library.findall(constraints)) > 1
@@ -0,0 +1,220 @@
+import bisect
+import threading
+from collections import Counter, defaultdict
+
+# The vocabularies of the case library that can be completed, named as the lists of :class:`CaseLibrary`
+FIELDS = ("drink_types", "glass_types", "alc_types", "taste_types", "ingredients")
+
+
+def _ngrams(key, n=3):
+    """
+    The character n-grams of a lowercase value, padded so the start of the words weighs more.
+    """
+    padded = f"  {key} "
+    return {padded[i : i + n] for i in range(len(padded) - n + 1)}
+
+
+class CompletionIndex:
+    """
+    Prefix and typo tolerant search of the values of the case library, for the autocompletion and validation of the
+    user inputs.
+
+    The values of each field are kept in an array sorted by their lowercase form, searched by bisection, and their
+    character trigrams in an inverted index. Registered with :meth:`CaseLibrary.register_index`, the index is updated
+    whenever a case is added or removed. A lock makes it safe to search it while the cases are updated in another
+    thread.
+
+    Attributes
+    ----------
+    counts : dict of collections.Counter
+        The number of cases with each value of each field.
+
+    Examples
+    --------
+    >>> index = CompletionIndex()
+    >>> case_library.register_index(index)
+    >>> index.complete("ingredients", "lim")
+    ['lime', 'lime juice', 'lime vodka', ...]
+    >>> index.suggest("ingredients", "lmon juice")
+    ['lemon juice', ...]
+    """
+
+    def __init__(self):
+        self.counts = {field: Counter() for field in FIELDS}
+        self._keys = {field: [] for field in FIELDS}
+        self._ngrams = {field: defaultdict(set) for field in FIELDS}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_value_counter(cls, value_counter):
+        """
+        Create an index of the values counted in the type sets of a case library, without reading its cases, e.g. for
+        a :class:`cbr.case_library.StreamingCaseLibrary`.
+
+        Parameters
+        ----------
+        value_counter : dict
+            The number of entries of each value of each field, see :attr:`CaseLibrary.value_counter`. A value used
+            twice in a case is counted twice, unlike in an index built from the cases.
+
+        Returns
+        -------
+        index : :class:`CompletionIndex`
+            The index.
+        """
+        index = cls()
+        for field in FIELDS:
+            for value, count in value_counter[field].items():
+                if value and count > 0:
+                    index._insert(field, value)
+                    index.counts[field][value] = count
+        return index
+
+    def build(self, cases):
+        """
+        Index the values of a list of cases, discarding the previous values.
+        """
+        with self._lock:
+            for field in FIELDS:
+                self.counts[field].clear()
+                self._keys[field].clear()
+                self._ngrams[field].clear()
+            for case in cases:
+                self.add(case)
+
+    def add(self, case):
+        """
+        Index the values of a new case.
+        """
+        self._update(case, 1)
+
+    def remove(self, case):
+        """
+        Discount the values of a removed case, removing the ones no other case has.
+        """
+        self._update(case, -1)
+
+    def _update(self, case, delta):
+        values = {field: set() for field in FIELDS}
+        values["drink_types"].add(case.findtext("category"))
+        values["glass_types"].add(case.findtext("glass"))
+        for ingredient in case.find("ingredients").iterchildren():
+            values["ingredients"].add(ingredient.text)
+            values["alc_types"].add(ingredient.attrib["alc_type"])
+            values["taste_types"].add(ingredient.attrib["basic_taste"])
+        with self._lock:
+            for field, field_values in values.items():
+                counts = self.counts[field]
+                for value in field_values:
+                    if not value:
+                        continue
+                    if delta > 0:
+                        if value not in counts:
+                            self._insert(field, value)
+                        counts[value] += delta
+                    elif value in counts:
+                        counts[value] += delta
+                        if counts[value] <= 0:
+                            del counts[value]
+                            self._delete(field, value)
+
+    def _insert(self, field, value):
+        bisect.insort(self._keys[field], (value.lower(), value))
+        for ngram in _ngrams(value.lower()):
+            self._ngrams[field][ngram].add(value)
+
+    def _delete(self, field, value):
+        keys = self._keys[field]
+        del keys[bisect.bisect_left(keys, (value.lower(), value))]
+        ngrams = self._ngrams[field]
+        for ngram in _ngrams(value.lower()):
+            ngrams[ngram].discard(value)
+            if not ngrams[ngram]:
+                del ngrams[ngram]
+
+    def contains(self, field, value):
+        """
+        Whether a value of a field is in the case library, with the same case.
+        """
+        with self._lock:
+            return value in self.counts[field]
+
+    def values(self, field):
+        """
+        Get all the values of a field.
+
+        Returns
+        -------
+        values : list of str
+            The values, sorted case insensitively.
+        """
+        with self._lock:
+            return [value for _, value in self._keys[field]]
+
+    def complete(self, field, prefix, limit=None):
+        """
+        Get the values of a field that start with a prefix, ignoring the case.
+
+        Parameters
+        ----------
+        field : str
+            The field, one of :data:`FIELDS`.
+
+        prefix : str
+            The start of the values.
+
+        limit : int or None
+            The maximum number of values. If None all the values are returned.
+
+        Returns
+        -------
+        values : list of str
+            The matching values, sorted case insensitively.
+        """
+        prefix = prefix.lower()
+        completions = []
+        with self._lock:
+            keys = self._keys[field]
+            i = bisect.bisect_left(keys, (prefix,))
+            while i < len(keys) and keys[i][0].startswith(prefix) and len(completions) != limit:
+                completions.append(keys[i][1])
+                i += 1
+        return completions
+
+    def suggest(self, field, text, limit=5, min_similarity=0.3):
+        """
+        Get the values of a field that are most similar to a text, e.g. to correct a typo.
+
+        The similarity is the Dice coefficient between the character trigrams of the lowercase text and value.
+
+        Parameters
+        ----------
+        field : str
+            The field, one of :data:`FIELDS`.
+
+        text : str
+            The text entered by the user.
+
+        limit : int, default 5
+            The maximum number of values.
+
+        min_similarity : float, default 0.3
+            The minimum similarity of the values.
+
+        Returns
+        -------
+        values : list of str
+            The values by decreasing similarity, then alphabetically.
+        """
+        ngrams = _ngrams(text.strip().lower())
+        shared = Counter()
+        with self._lock:
+            postings = self._ngrams[field]
+            for ngram in ngrams:
+                shared.update(postings.get(ngram, ()))
+        scores = []
+        for value, n_shared in shared.items():
+            similarity = 2 * n_shared / (len(ngrams) + len(_ngrams(value.lower())))
+            if similarity >= min_similarity:
+                scores.append((-similarity, value))
+        return [value for _, value in sorted(scores)[:limit]]
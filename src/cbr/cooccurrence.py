@@ -0,0 +1,185 @@
+from collections import Counter, defaultdict
+
+
+class CooccurrenceIndex:
+    """
+    Sparse co-occurrence counts of the ingredients of a case library, grouped by alcohol type and basic taste.
+
+    The counts are kept as a dictionary of counters, with only the pairs of ingredients found together in some case.
+    Registered with :meth:`CaseLibrary.register_index`, the index is updated whenever a case is added or removed.
+
+    Attributes
+    ----------
+    counts : collections.Counter
+        The number of cases with each ingredient.
+
+    pairs : dict of collections.Counter
+        The number of cases with each pair of different ingredients.
+
+    groups : dict of collections.Counter
+        The number of entries of each ingredient, by ``(alc_type, basic_taste)``.
+
+    Examples
+    --------
+    >>> index = CooccurrenceIndex()
+    >>> case_library.register_index(index)
+    >>> index.substitutes("lemon juice", "", "sour", context=["vodka", "sugar syrup"])
+    ['lime juice', 'lemon', ...]
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.pairs = defaultdict(Counter)
+        self.groups = defaultdict(Counter)
+
+    @classmethod
+    def from_ontology(cls, ingredients_onto, counts):
+        """
+        Create an index without co-occurrences, that ranks the ingredients of a group by their number of entries only.
+
+        It is built from the type sets of a case library, without reading its cases, e.g. for a
+        :class:`cbr.case_library.StreamingCaseLibrary`.
+
+        Parameters
+        ----------
+        ingredients_onto : dict
+            The alcohol type of each alcoholic ingredient and the basic taste of each non-alcoholic ingredient, see
+            :attr:`CaseLibrary.ingredients_onto`.
+
+        counts : dict
+            The number of entries of each ingredient, see :attr:`CaseLibrary.value_counter`.
+
+        Returns
+        -------
+        index : :class:`CooccurrenceIndex`
+            The index.
+        """
+        index = cls()
+        index.counts.update(counts)
+        for name, alc_type in ingredients_onto["alcoholic"].items():
+            index.groups[(alc_type, "")][name] = counts.get(name, 0)
+        for name, basic_taste in ingredients_onto["non-alcoholic"].items():
+            index.groups[("", basic_taste)][name] = counts.get(name, 0)
+        return index
+
+    def build(self, cases):
+        """
+        Count the ingredients of a list of cases, discarding the previous counts.
+        """
+        self.counts.clear()
+        self.pairs.clear()
+        self.groups.clear()
+        for case in cases:
+            self.add(case)
+
+    def add(self, case):
+        """
+        Count the ingredients of a new case.
+        """
+        self._update(case, 1)
+
+    def remove(self, case):
+        """
+        Discount the ingredients of a removed case.
+        """
+        self._update(case, -1)
+
+    def _update(self, case, delta):
+        names = set()
+        for ingredient in case.ingredients.iterchildren():
+            names.add(ingredient.text)
+            key = (ingredient.attrib["alc_type"], ingredient.attrib["basic_taste"])
+            group = self.groups[key]
+            group[ingredient.text] += delta
+            if group[ingredient.text] <= 0:
+                del group[ingredient.text]
+                if not group:
+                    del self.groups[key]
+        for name in names:
+            self.counts[name] += delta
+            if self.counts[name] <= 0:
+                del self.counts[name]
+            pairs = self.pairs[name]
+            for other in names:
+                if other != name:
+                    pairs[other] += delta
+                    if pairs[other] <= 0:
+                        del pairs[other]
+            if not pairs:
+                del self.pairs[name]
+
+    def rank(self, candidates, context=(), exclude=()):
+        """
+        Rank ingredients by how often they are found with the ingredients of a context.
+
+        Parameters
+        ----------
+        candidates : iterable of str
+            The ingredients to rank.
+
+        context : iterable of str
+            The ingredients the candidates go with, e.g. the other ingredients of a recipe.
+
+        exclude : iterable of str
+            Ingredients that are left out of the ranking.
+
+        Returns
+        -------
+        ranking : list of str
+            The candidates by decreasing co-occurrence with the context, then by decreasing number of cases and name.
+        """
+        exclude = set(exclude)
+        context = set(context)
+        scores = []
+        for candidate in candidates:
+            if candidate in exclude:
+                continue
+            pairs = self.pairs.get(candidate, {})
+            scores.append((-sum(pairs.get(name, 0) for name in context), -self.counts[candidate], candidate))
+        return [candidate for _, _, candidate in sorted(scores)]
+
+    def candidates(self, alc_type="", basic_taste="", context=(), exclude=()):
+        """
+        Rank the ingredients with an alcohol type or basic taste, like :meth:`CaseLibrary.find_ingredients`.
+
+        Only the first of the given filters is used, in the same order as the parameters of
+        :meth:`CaseLibrary.find_ingredients`.
+
+        Returns
+        -------
+        ranking : list of str
+            The ranked ingredients, see :meth:`CooccurrenceIndex.rank`. Empty if no filter is given.
+        """
+        if basic_taste:
+            names = (name for (_, taste), group in self.groups.items() if taste == basic_taste for name in group)
+        elif alc_type:
+            names = (name for (alc, _), group in self.groups.items() if alc == alc_type for name in group)
+        else:
+            return []
+        return self.rank(set(names), context, exclude)
+
+    def substitutes(self, ingredient, alc_type, basic_taste, context=(), exclude=()):
+        """
+        Rank the ingredients that can replace an ingredient, i.e. with the same alcohol type and basic taste.
+
+        Parameters
+        ----------
+        ingredient : str
+            The ingredient to replace.
+
+        alc_type, basic_taste : str
+            The alcohol type and basic taste of the ingredient.
+
+        context : iterable of str
+            The other ingredients of the recipe.
+
+        exclude : iterable of str
+            Ingredients that can not be used.
+
+        Returns
+        -------
+        ranking : list of str
+            The ranked substitutes, see :meth:`CooccurrenceIndex.rank`.
+        """
+        group = self.groups.get((alc_type, basic_taste), {})
+        return self.rank(group, context, set(exclude) | {ingredient})
@@ -1,4 +1,21 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
 import numpy as np
+from lxml import etree as ET
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import ConstraintsBuilder, load_case_library
+from src.cbr.cbr import CBR
+from src.entity.query import Query
+from src.utils.metrics import Histogram
+
+MODES = {
+    "cached": dict(),
+    "uncached": dict(cache_size=0),
+}
 
 
 # This script is going to have different functions to do the evaluation in the CBR
@@ -11,7 +28,9 @@ def get_jaccard_simmilarity(list1, list2):
     """
 
     set1, set2 = set(list1), set(list2)
-    n = len(set.intersection(set2))
+    if not set1 and not set2:
+        return 1.0
+    n = len(set1.intersection(set2))
     jaccard_metric = n / float(len(set1) + len(set2) - n)
 
     return jaccard_metric
@@ -184,3 +203,176 @@ class Evaluation:
                 )
         self.similarity_evaluation_score = score
         return self.similarity_evaluation_score
+
+
+def query_from_case(cocktail, case_library):
+    """
+    Build the query a user could have made to obtain a case.
+
+    The query has the category, glass, ingredients, alcohol types and basic tastes of the case that are available in the
+    case library, as the user can only choose those.
+
+    Parameters
+    ----------
+    cocktail : :class:`lxml.objectify.ObjectifiedElement`
+        The case.
+
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library the query is made to.
+
+    Returns
+    -------
+    query : :class:`entity.query.Query`
+        The query of the case.
+    """
+    ingredients = set(case_library.ingredients)
+    alc_types = set(case_library.alc_types)
+    taste_types = set(case_library.taste_types)
+    query = Query()
+    category = cocktail.findtext("category")
+    query.set_category(category if category in case_library.drink_types else "")
+    glass = cocktail.findtext("glass")
+    query.set_glass(glass if glass in case_library.glass_types else "")
+    entries = list(cocktail.ingredients.iterchildren())
+    query.set_ingredients(list(dict.fromkeys(entry.text for entry in entries if entry.text in ingredients)))
+    query.set_alc_types(
+        list(dict.fromkeys(entry.attrib["alc_type"] for entry in entries if entry.attrib["alc_type"] in alc_types))
+    )
+    query.set_basic_tastes(
+        list(
+            dict.fromkeys(
+                entry.attrib["basic_taste"] for entry in entries if entry.attrib["basic_taste"] in taste_types
+            )
+        )
+    )
+    return query
+
+
+@contextmanager
+def held_out(case_library, case):
+    """
+    Remove a case from a case library, without writing it, and put it back at the same place afterwards.
+    """
+    parent = case.getparent()
+    index = parent.index(case)
+    derivation = case.findtext("derivation")
+    case_library.remove_case(case, write=False)
+    try:
+        yield case
+    finally:
+        case_library.add_case(case, write=False)
+        case.derivation = derivation
+        parent.insert(index, case)
+        case_library.case_store.derivation[case_library.case_store.row(case)] = derivation
+
+
+_cbr = None
+_seed = None
+
+
+def _init_worker(case_library_file, seed, cbr_kwargs):
+    global _cbr, _seed
+    _cbr = CBR(case_library_file, **cbr_kwargs)
+    _seed = seed
+
+
+def _evaluate_cases(names):
+    """
+    Evaluate the given cases of the CBR of the worker, holding out each one.
+    """
+    cbr = _cbr
+    results = []
+    for name in names:
+        case = cbr.case_library.find_case(name)
+        with held_out(cbr.case_library, case):
+            query = query_from_case(case, cbr.case_library)
+            # Seed each case, so the ties are broken the same way whatever worker evaluates it
+            random.seed(f"{_seed}-{name}")
+            start = time.perf_counter()
+            try:
+                cbr.run_query(query, f"{name} (held out)")
+            except Exception as e:
+                results.append(dict(name=name, error=repr(e)))
+                continue
+            latency = time.perf_counter() - start
+            expected = [entry.text for entry in case.ingredients.iterchildren()]
+            results.append(
+                dict(
+                    name=name,
+                    retrieved=str(cbr.retrieved_recipe.name),
+                    jaccard_retrieved=get_jaccard_simmilarity(
+                        expected, [entry.text for entry in cbr.retrieved_recipe.ingredients.iterchildren()]
+                    ),
+                    jaccard_adapted=get_jaccard_simmilarity(
+                        expected, [entry.text for entry in cbr.adapted_recipe.ingredients.iterchildren()]
+                    ),
+                    similarity=cbr._similarity_cocktail(cbr.adapted_recipe),
+                    latency=latency,
+                )
+            )
+    return results
+
+
+def leave_one_out(case_library_file=None, n_workers=None, limit=None, seed=2022, chunk_size=16, **cbr_kwargs):
+    """
+    Leave-one-out evaluation of the CBR.
+
+    Each case is held out of the case library in turn, a query is built from it with :func:`query_from_case` and the
+    query is retrieved and adapted. The held out case is compared with the retrieved and adapted cases with the Jaccard
+    index of their ingredients. The cases are evaluated in parallel by a pool of processes, each with its own copy of
+    the case library, and the latency of each query is measured in the process running it.
+
+    Parameters
+    ----------
+    case_library_file : str or None
+        The path to the case library. If None it uses the default case library.
+
+    n_workers : int or None
+        The number of worker processes. If None it uses one per CPU.
+
+    limit : int or None
+        The maximum number of cases to evaluate. If None all the cases are evaluated.
+
+    seed : int, default 2022
+        The seed of the random choices of the CBR. The results do not depend on the number of workers.
+
+    chunk_size : int, default 16
+        The number of cases sent to a worker at once.
+
+    **cbr_kwargs
+        Arguments of the :class:`cbr.cbr.CBR` of the workers, e.g. one of the :data:`MODES`.
+
+    Returns
+    -------
+    report : dict
+        The mean Jaccard index of the retrieved and adapted cases, the mean similarity of the adapted cases, the
+        latency histogram of the queries, the wall time, the throughput, and the result of each case.
+    """
+    # The parent only lists the names of the cases, without the indexes of a CBR
+    case_library = load_case_library(case_library_file or CASE_LIBRARY_FILE)
+    names = [str(case.name) for case in case_library.findall(ConstraintsBuilder())]
+    if limit is not None:
+        names = names[:limit]
+    chunks = [names[i : i + chunk_size] for i in range(0, len(names), chunk_size)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        n_workers, initializer=_init_worker, initargs=(case_library_file, seed, cbr_kwargs)
+    ) as pool:
+        results = [result for chunk in pool.map(_evaluate_cases, chunks) for result in chunk]
+    wall_time = time.perf_counter() - start
+
+    latency = Histogram()
+    scored = [result for result in results if "error" not in result]
+    for result in scored:
+        latency.observe(result["latency"])
+    return dict(
+        n_cases=len(results),
+        errors=len(results) - len(scored),
+        jaccard_retrieved=float(np.mean([result["jaccard_retrieved"] for result in scored])) if scored else 0.0,
+        jaccard_adapted=float(np.mean([result["jaccard_adapted"] for result in scored])) if scored else 0.0,
+        similarity=float(np.mean([result["similarity"] for result in scored])) if scored else 0.0,
+        latency=latency.snapshot(),
+        wall_time=wall_time,
+        throughput=len(results) / wall_time if wall_time else 0.0,
+        cases=results,
+    )
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+
+from lxml import etree, objectify
+
+from src.utils.metrics import REGISTRY, weak_function
+
+JOURNAL_BYTES = REGISTRY.gauge("cbr_journal_bytes", "Bytes of the learning journal.")
+PENDING_EVALUATIONS = REGISTRY.gauge("cbr_pending_evaluations", "Evaluations waiting to be applied by the learner.")
+
+
+def journal_file_for(case_library_path):
+    """
+    Default path of the learning journal of a case library file or directory.
+    """
+    return f"{os.path.normpath(case_library_path)}.journal.jsonl"
+
+
+def case_key(case):
+    """
+    Stable id of a case, since the names are not unique: a digest of its name, category, glass, ingredients and
+    preparation, which do not change when the case is evaluated, unlike its counters and utility.
+    """
+    content = [
+        case.findtext("name"),
+        case.findtext("category"),
+        case.findtext("glass"),
+        [(ingredient.text, ingredient.get("measure")) for ingredient in case.find("ingredients").iterchildren()],
+        [step.text for step in case.find("preparation").iterchildren()],
+    ]
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def _find_case(case_library, name, key):
+    for case in case_library.find_cases(name):
+        if key is None or case_key(case) == key:
+            return case
+    return None
+
+
+def evaluation_record(user_score, state):
+    """
+    Serializable record of an evaluation, with the names and keys of the cases of the query instead of the elements.
+
+    Parameters
+    ----------
+    user_score : float
+        The score given by the user, between 0 and 1.
+
+    state : tuple
+        The state of the evaluated query, from :meth:`CBR.get_state`.
+
+    Returns
+    -------
+    record : dict
+        The score, the names and the keys, from :func:`case_key`, of the retrieved and similar cases, and the adapted
+        case as XML.
+    """
+    _, retrieved_recipe, sim_recipes, adapted_recipe = state
+    return dict(
+        score=user_score,
+        retrieved=str(retrieved_recipe.name),
+        retrieved_key=case_key(retrieved_recipe),
+        similar=[str(recipe.name) for recipe in sim_recipes],
+        similar_keys=[case_key(recipe) for recipe in sim_recipes],
+        adapted=etree.tostring(adapted_recipe, encoding="unicode"),
+    )
+
+
+def resolve_record(case_library, record):
+    """
+    Find the cases of an evaluation record from :func:`evaluation_record` in a case library.
+
+    Returns
+    -------
+    state : tuple or None
+        The state of the evaluated query, without the query, or None if the retrieved case is not in the case library.
+        Similar cases that are not in the case library are left out. The cases are matched by name and key, or only by
+        name if the record has no keys.
+    """
+    retrieved_recipe = _find_case(case_library, record["retrieved"], record.get("retrieved_key"))
+    if retrieved_recipe is None:
+        return None
+    similar_keys = record.get("similar_keys", [None] * len(record["similar"]))
+    sim_recipes = [_find_case(case_library, name, key) for name, key in zip(record["similar"], similar_keys)]
+    adapted_recipe = objectify.fromstring(record["adapted"])
+    return None, retrieved_recipe, [recipe for recipe in sim_recipes if recipe is not None], adapted_recipe
+
+
+class BackgroundLearner:
+    """
+    Applies the evaluations of a CBR system in the background.
+
+    :meth:`BackgroundLearner.submit` appends the evaluation to a journal, syncs it to disk and returns, so the user does
+    not wait for the case library to be updated. A background thread applies the evaluations in batches: it updates the
+    counters of the cases of every evaluation, adds the successful adapted cases, runs one forget pass and writes the
+    case library once per batch. The sequence number of the last evaluation of the batch is written with the case
+    library, see :attr:`CaseLibrary.journal_seq`, so the batch is committed with the case library itself.
+
+    Evaluations in the journal after the sequence number of the case library, e.g. because the process stopped, are
+    applied when the learner starts, exactly once. If a batch fails the learner stops applying evaluations, since the
+    case library in memory may be partially updated: the failed and the following evaluations stay in the journal, and
+    are applied to the saved case library when the learner starts again.
+
+    Queries must not run while a batch is applied, so they must hold :attr:`BackgroundLearner.lock`.
+
+    Parameters
+    ----------
+    cbr : :class:`cbr.cbr.CBR`
+        The CBR system.
+
+    journal_file : str or None
+        The path to the journal. If None it is next to the case library.
+
+    batch_size : int, default 32
+        The maximum number of evaluations applied in a batch.
+
+    flush_interval : float, default 0.5
+        The seconds to wait for more evaluations before applying a batch.
+
+    Attributes
+    ----------
+    lock : threading.RLock
+        Lock held while a batch is applied.
+
+    applied : int
+        The number of evaluations applied.
+
+    batches : int
+        The number of batches applied.
+
+    failed : bool
+        Whether a batch failed, so the learner stopped applying evaluations.
+
+    Examples
+    --------
+    >>> learner = BackgroundLearner(cbr)
+    >>> with learner.lock:
+    ...     retrieved_case, adapted_case = cbr.run_query(query, "My cocktail")
+    >>> learner.submit(0.8)
+    >>> learner.close()
+    """
+
+    def __init__(self, cbr, journal_file=None, batch_size=32, flush_interval=0.5):
+        self.cbr = cbr
+        self.journal_file = journal_file or journal_file_for(cbr.case_library.case_library_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger("CBR")
+        self.applied = 0
+        self.batches = 0
+        self.failed = False
+        self._queue = queue.Queue()
+        self._journal_lock = threading.Lock()
+        self._recover()
+        self._seq = cbr.case_library.journal_seq
+        self._journal = open(self.journal_file, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="cbr-learner", daemon=True)
+        JOURNAL_BYTES.set_function(weak_function(self, BackgroundLearner._journal_size))
+        PENDING_EVALUATIONS.set_function(weak_function(self, lambda learner: learner._queue.qsize()))
+        self._thread.start()
+
+    def submit(self, user_score, state=None):
+        """
+        Enqueue the evaluation of a query. It returns once the evaluation is synced to the journal.
+
+        Parameters
+        ----------
+        user_score : float
+            The score given by the user, between 0 and 1.
+
+        state : tuple or None
+            The state of the evaluated query, from :meth:`CBR.get_state`. If None it is the state of the last query of
+            the CBR.
+        """
+        # The cases of the state are read holding the lock, since a batch may be updating them
+        with self.lock:
+            state = state or self.cbr.get_state()
+            record = evaluation_record(user_score, state)
+        with self._journal_lock:
+            self._seq += 1
+            record["seq"] = self._seq
+            self._append(record)
+            self._queue.put((self._seq, user_score, state))
+
+    def flush(self):
+        """
+        Wait until all the submitted evaluations are applied.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Apply the pending evaluations and stop the background thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._journal.close()
+
+    def _journal_size(self):
+        with self._journal_lock:
+            return self._journal.tell() if not self._journal.closed else None
+
+    def _append(self, record):
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if not self.failed:
+                try:
+                    self._apply([(score, state) for _, score, state in batch], batch[-1][0])
+                    self._compact(batch[-1][0])
+                except Exception:
+                    # The case library was not saved with the sequence number of the batch, so the batch and the
+                    # following ones stay in the journal and are applied by the next learner
+                    self.failed = True
+                    self.logger.exception("Learning: failed to apply a batch of evaluations, stopping the learner")
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _apply(self, batch, seq):
+        """
+        Apply a batch of evaluations: update the counters at once, learn the successful cases, forget once and write
+        once, with the sequence number of the last evaluation.
+        """
+        case_library = self.cbr.case_library
+        with self.lock:
+            self.cbr.learn_evaluations(batch, write=False)
+            previous, case_library.journal_seq = case_library.journal_seq, seq
+            try:
+                case_library.save()
+            except Exception:
+                case_library.journal_seq = previous
+                raise
+        self.applied += len(batch)
+        self.batches += 1
+
+    def _compact(self, seq):
+        with self._journal_lock:
+            if seq == self._seq:
+                # Nothing was submitted after the batch, so the journal can start over
+                self._journal.truncate(0)
+                self._journal.seek(0)
+                os.fsync(self._journal.fileno())
+
+    def _recover(self):
+        """
+        Apply the evaluations of the journal after the sequence number of the case library.
+        """
+        if not os.path.exists(self.journal_file):
+            return
+        records = []
+        with open(self.journal_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record cut by a crash was never acknowledged
+                    break
+                records.append(record)
+        batch = []
+        for record in records:
+            if record["seq"] <= self.cbr.case_library.journal_seq:
+                continue
+            state = resolve_record(self.cbr.case_library, record)
+            if state is None:
+                self.logger.warning(f"Learning: the case {record['retrieved']} of a journaled evaluation is missing")
+                continue
+            batch.append((record["score"], state))
+        if batch:
+            self._apply(batch, records[-1]["seq"])
+            self.logger.info(f"Learning: recovered {len(batch)} evaluations from the journal")
+        os.remove(self.journal_file)
@@ -0,0 +1,335 @@
+import copy
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.cbr.cbr import CBR
+from src.entity.cocktail import cocktail_to_dict
+from src.entity.query import Query
+from src.utils.metrics import Histogram
+
+# The maximum number of values of each field of the queries of each kind, with None for a single value and 0 to leave
+# the field empty
+QUERY_MIXES = {
+    "full": dict(
+        category=None, glass=None, ingredients=5, exc_ingredients=5, basic_tastes=5, alc_types=5, exc_alc_types=0
+    ),
+    "category": dict(
+        category=None, glass=0, ingredients=0, exc_ingredients=0, basic_tastes=0, alc_types=0, exc_alc_types=0
+    ),
+    "ingredients": dict(
+        category=None, glass=0, ingredients=3, exc_ingredients=2, basic_tastes=0, alc_types=0, exc_alc_types=0
+    ),
+    "tastes": dict(
+        category=None, glass=0, ingredients=0, exc_ingredients=0, basic_tastes=2, alc_types=2, exc_alc_types=1
+    ),
+}
+# The vocabulary of the case library of each field of a query
+POOLS = dict(
+    category="drink_types",
+    glass="glass_types",
+    ingredients="ingredients",
+    exc_ingredients="ingredients",
+    basic_tastes="taste_types",
+    alc_types="alc_types",
+    exc_alc_types="alc_types",
+)
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+def parse_mix(mix):
+    """
+    Parse a query mix like ``full=1,ingredients=3``, i.e. the relative weight of each kind of :data:`QUERY_MIXES`.
+
+    Returns
+    -------
+    mix : dict
+        The weight of each kind of query.
+
+    Raises
+    ------
+    ValueError
+        If a kind is unknown or a weight is not a positive number.
+    """
+    weights = dict()
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in QUERY_MIXES:
+            raise ValueError(f"Unknown kind of query {kind!r}, expected one of {', '.join(QUERY_MIXES)}")
+        weights[kind] = float(weight) if weight else 1.0
+        if weights[kind] <= 0:
+            raise ValueError(f"The weight of {kind!r} must be positive")
+    return weights
+
+
+def fix_ingr_lists(query, case_library, rng=random):
+    """
+    Ensures that none of ingredients to exclude in the query are in the ingredients to include list.
+
+    Each excluded ingredient that is also included is replaced by another random ingredient, or dropped if none is
+    found after a few tries.
+    """
+    exc_ingredients = []
+    for ingredient in query.get_exc_ingredients():
+        for _ in range(10):
+            if ingredient not in query.get_ingredients() and ingredient not in exc_ingredients:
+                exc_ingredients.append(ingredient)
+                break
+            ingredient = str(rng.choice(case_library.ingredients))
+    query.set_exc_ingredients(exc_ingredients)
+
+
+def build_query(case_library, rng=random, kind="full"):
+    """
+    Build a random query with the values of a case library.
+
+    Parameters
+    ----------
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library.
+
+    rng : random.Random, default random
+        The pseudo-random number generator.
+
+    kind : str, default "full"
+        The kind of query, one of :data:`QUERY_MIXES`.
+
+    Returns
+    -------
+    query : :class:`entity.query.Query`
+        The query.
+    """
+    query = Query()
+    for field, max_n_values in QUERY_MIXES[kind].items():
+        pool = getattr(case_library, POOLS[field])
+        if max_n_values is None:
+            setattr(query, field, str(rng.choice(pool)))
+        elif max_n_values:
+            setattr(
+                query, field, [str(value) for value in rng.sample(pool, rng.randint(0, min(max_n_values, len(pool))))]
+            )
+    fix_ingr_lists(query, case_library, rng)
+    return query
+
+
+_cbr = None
+_seed = None
+_mix = None
+
+
+def _init_worker(case_library_file, seed, mix, cbr_kwargs):
+    global _cbr, _seed, _mix
+    _cbr = CBR(case_library_file, **cbr_kwargs)
+    _seed = seed
+    _mix = mix
+
+
+def _warm():
+    # Keeps the worker busy for a moment, so the other tasks go to other workers
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _run_query(i, transcript=False):
+    """
+    Build and run the i-th query of the load with the CBR of the worker. The case library is not changed.
+    """
+    rng = random.Random(f"{_seed}-{i}")
+    kind = rng.choices(list(_mix), weights=list(_mix.values()))[0]
+    query = build_query(_cbr.case_library, rng, kind)
+    # The retrieval relaxes the query in place, so the fields are copied before
+    fields = copy.deepcopy(vars(query))
+    # Seed each query, so the ties are broken the same way whatever worker runs it
+    random.seed(f"{_seed}-{i}")
+    start = time.perf_counter()
+    try:
+        retrieved_case, adapted_case = _cbr.run_query(query, f"Load {i}")
+    except Exception as e:
+        return dict(i=i, kind=kind, service_time=time.perf_counter() - start, error=type(e).__name__)
+    result = dict(i=i, kind=kind, service_time=time.perf_counter() - start)
+    if transcript:
+        result.update(query=fields, retrieved=cocktail_to_dict(retrieved_case), adapted=cocktail_to_dict(adapted_case))
+    return result
+
+
+def _closed_loop(worker, concurrency, start, warmup, duration, transcript):
+    """
+    Run queries back to back from a start time, for the warm-up and the duration.
+    """
+    results = []
+    i = worker
+    while time.time() < start:
+        time.sleep(min(0.01, max(start - time.time(), 0)))
+    while time.time() < start + warmup + duration:
+        result = _run_query(i, transcript)
+        result["warmup"] = time.time() < start + warmup
+        result["latency"] = result["service_time"]
+        results.append(result)
+        i += concurrency
+    return results
+
+
+def _summary(latencies):
+    if not latencies:
+        return dict(count=0, mean=0.0, max=0.0, **{f"p{p:g}": 0.0 for p in PERCENTILES})
+    values = np.percentile(latencies, PERCENTILES)
+    return dict(
+        count=len(latencies),
+        mean=float(np.mean(latencies)),
+        max=float(np.max(latencies)),
+        **{f"p{p:g}": float(value) for p, value in zip(PERCENTILES, values)},
+    )
+
+
+def run_load(
+    case_library_file=None,
+    concurrency=1,
+    duration=10.0,
+    warmup=2.0,
+    rate=None,
+    mix="full",
+    seed=2022,
+    transcript=False,
+    **cbr_kwargs,
+):
+    """
+    Run random queries against the CBR and measure their latency.
+
+    The queries run in a pool of processes, each with its own copy of the case library. The case library is loaded by
+    every worker before the load starts, and the queries are not evaluated, so neither the loading nor the learning is
+    measured. The i-th query only depends on the seed, so two runs with the same arguments send the same queries.
+
+    Without a rate the load is closed loop: each worker runs queries back to back. With a rate the load is open loop:
+    the queries arrive at random times, as a Poisson process, whether the previous ones finished or not. The latency of
+    a query then counts from its arrival, so it includes the time it waited for a free worker.
+
+    Parameters
+    ----------
+    case_library_file : str or None
+        The path to the case library. If None it uses the default case library.
+
+    concurrency : int, default 1
+        The number of worker processes.
+
+    duration : float, default 10.0
+        The seconds the load is measured.
+
+    warmup : float, default 2.0
+        The seconds the load runs before it is measured, e.g. to fill the query cache.
+
+    rate : float or None
+        The mean number of queries per second of an open loop load. If None the load is closed loop.
+
+    mix : str or dict, default "full"
+        The weight of each kind of query of :data:`QUERY_MIXES`, see :func:`parse_mix`.
+
+    seed : int, default 2022
+        The seed of the queries.
+
+    transcript : bool, default False
+        Whether to add the query and the retrieved and adapted cases of each query to the report.
+
+    **cbr_kwargs
+        Arguments of the :class:`cbr.cbr.CBR` of the workers.
+
+    Returns
+    -------
+    report : dict
+        The parameters of the load, the number of measured queries and errors by type, the throughput, the
+        percentiles of the latency and service time in seconds overall and by kind of query, the latency histogram,
+        and the transcript if requested.
+    """
+    if isinstance(mix, str):
+        mix = parse_mix(mix)
+    with ProcessPoolExecutor(
+        concurrency, initializer=_init_worker, initargs=(case_library_file, seed, mix, cbr_kwargs)
+    ) as pool:
+        # Start all the workers and load their case libraries before the clock starts
+        pids = set()
+        while len(pids) < concurrency:
+            pids.update(future.result() for future in [pool.submit(_warm) for _ in range(concurrency)])
+        if rate is None:
+            results = _closed(pool, concurrency, warmup, duration, transcript)
+        else:
+            results = _open(pool, rate, warmup, duration, seed, transcript)
+
+    measured = [result for result in results if not result["warmup"]]
+    errors = Counter(result["error"] for result in measured if "error" in result)
+    ok = [result for result in measured if "error" not in result]
+    histogram = Histogram()
+    for result in ok:
+        histogram.observe(result["latency"])
+    report = dict(
+        mode="closed" if rate is None else "open",
+        concurrency=concurrency,
+        rate=rate,
+        duration=duration,
+        warmup=warmup,
+        mix=mix,
+        seed=seed,
+        n_queries=len(measured),
+        n_errors=sum(errors.values()),
+        errors=dict(errors),
+        throughput=len(ok) / duration if duration else 0.0,
+        latency=_summary([result["latency"] for result in ok]),
+        service_time=_summary([result["service_time"] for result in ok]),
+        kinds={kind: _summary([result["latency"] for result in ok if result["kind"] == kind]) for kind in sorted(mix)},
+        histogram=histogram.snapshot()["buckets"],
+    )
+    if transcript:
+        report["transcript"] = sorted(measured, key=lambda result: result["i"])
+    return report
+
+
+def _closed(pool, concurrency, warmup, duration, transcript):
+    # Every worker runs one loop, starting at the same time
+    start = time.time() + 0.1
+    futures = [
+        pool.submit(_closed_loop, worker, concurrency, start, warmup, duration, transcript)
+        for worker in range(concurrency)
+    ]
+    return [result for future in futures for result in future.result()]
+
+
+def _open(pool, rate, warmup, duration, seed, transcript):
+    rng = random.Random(seed)
+    # The callbacks only record when each query finished, the results are read from the futures once all finished, so
+    # an error of the pool, e.g. a BrokenProcessPool, is raised here
+    finished = dict()
+    all_finished = threading.Condition()
+    futures = []
+    arrivals = []
+    start = time.perf_counter()
+    arrival = 0.0
+    i = 0
+    while arrival < warmup + duration:
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        future = pool.submit(_run_query, i, transcript)
+
+        def done(future, i=i):
+            with all_finished:
+                finished[i] = time.perf_counter() - start
+                all_finished.notify_all()
+
+        future.add_done_callback(done)
+        futures.append(future)
+        arrivals.append(arrival)
+        arrival += rng.expovariate(rate)
+        i += 1
+    with all_finished:
+        all_finished.wait_for(lambda: len(finished) == len(futures))
+    results = []
+    for i, (future, arrival) in enumerate(zip(futures, arrivals)):
+        result = future.result()
+        result["warmup"] = arrival < warmup
+        result["latency"] = finished[i] - arrival
+        results.append(result)
+    return results
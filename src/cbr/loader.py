@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from src.cbr.cbr import CBR
+from src.cbr.learning_queue import BackgroundLearner
+
+
+class CBRLoader:
+    """
+    Loads a CBR system and its background learner in a thread, so a user interface can start before the case library
+    is parsed.
+
+    Parameters
+    ----------
+    **cbr_kwargs
+        The arguments of :class:`cbr.cbr.CBR`.
+
+    Attributes
+    ----------
+    started : float
+        The value of :func:`time.perf_counter` when the loading started.
+
+    load_time : float or None
+        The seconds taken to load the CBR system and start the learner, or None if it is not loaded yet.
+
+    Examples
+    --------
+    >>> loader = CBRLoader()
+    >>> name = input("- Name of the recipe: ")
+    >>> cbr, learner = loader.result()
+    """
+
+    def __init__(self, **cbr_kwargs):
+        self.started = time.perf_counter()
+        self.load_time = None
+        self._future = Future()
+        self._thread = threading.Thread(target=self._load, kwargs=cbr_kwargs, name="CBRLoader", daemon=True)
+        self._thread.start()
+
+    def _load(self, **cbr_kwargs):
+        self._future.set_running_or_notify_cancel()
+        try:
+            cbr = CBR(**cbr_kwargs)
+            learner = BackgroundLearner(cbr)
+        except BaseException as e:
+            self._future.set_exception(e)
+        else:
+            self.load_time = time.perf_counter() - self.started
+            self._future.set_result((cbr, learner))
+
+    def ready(self):
+        """
+        Whether the loading finished, successfully or not.
+        """
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the CBR system to be loaded.
+
+        Parameters
+        ----------
+        timeout : float or None
+            The maximum seconds to wait. If None it waits until the loading finishes.
+
+        Returns
+        -------
+        cbr : :class:`cbr.cbr.CBR`
+            The CBR system.
+
+        learner : :class:`cbr.learning_queue.BackgroundLearner`
+            The background learner of the CBR system, already started.
+
+        Raises
+        ------
+        concurrent.futures.TimeoutError
+            If the CBR system is not loaded before the timeout.
+        Exception
+            The exception raised while loading, if any.
+        """
+        return self._future.result(timeout)
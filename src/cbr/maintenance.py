@@ -0,0 +1,378 @@
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import _relax_query
+from src.cbr.neighbours import CaseMatrix
+from src.entity.query import Query
+
+
+@dataclass
+class MaintenanceReport:
+    """
+    Result of the maintenance of a case library.
+
+    Attributes
+    ----------
+    n_cases : int
+        The number of cases before the maintenance.
+
+    removed : list of dict
+        The name, reason, utility, coverage and reachability of each removed case, and the name of the remaining case
+        that solves it, if any. The reason is "redundant" if the competence of the case library is preserved without
+        the case, and "coverage" if it was removed to reach the target size.
+
+    clusters : list of list of str
+        The names of the cases of each group of redundant cases, which are as similar to each other as the redundancy
+        threshold.
+
+    loo_before, loo_after : float
+        The mean leave-one-out score of all the cases before and after the maintenance.
+
+    unsolved : int
+        The number of cases of the case library before the maintenance not solved by any remaining case.
+
+    applied : bool
+        Whether the cases were removed from the case library.
+    """
+
+    n_cases: int
+    removed: List[dict] = field(default_factory=list)
+    clusters: List[List[str]] = field(default_factory=list)
+    loo_before: float = 0.0
+    loo_after: float = 0.0
+    unsolved: int = 0
+    applied: bool = False
+
+    def summary(self):
+        """
+        Get a short text summary of the report.
+        """
+        redundant = sum(entry["reason"] == "redundant" for entry in self.removed)
+        return (
+            f"Cases: {self.n_cases} -> {self.n_cases - len(self.removed)} "
+            f"({redundant} redundant, {len(self.removed) - redundant} for coverage)\n"
+            f"Redundant clusters: {len(self.clusters)}\n"
+            f"Cases without a solving case: {self.unsolved}\n"
+            f"Leave-one-out score: {self.loo_before:.4f} -> {self.loo_after:.4f}\n"
+            f"Applied: {'yes' if self.applied else 'no'}"
+        )
+
+
+def competence(case_matrix, weights, threshold=1.0, redundancy_threshold=1.0, block_size=256):
+    """
+    Compute the competence model of a set of cases.
+
+    A case solves another case of the same category if its similarity for the other case is at least the threshold.
+    The coverage set of a case is the set of cases it solves and its reachability set the set of cases that solve it.
+
+    Parameters
+    ----------
+    case_matrix : CaseMatrix
+        The cases.
+
+    weights : dict
+        The similarity weights, as in :attr:`CBR.sim_weights`.
+
+    threshold : float, default 1.0
+        The minimum similarity of a case to solve another case.
+
+    redundancy_threshold : float, default 1.0
+        The minimum similarity, in both directions, of two redundant cases.
+
+    block_size : int, default 256
+        The number of cases compared at once, see :meth:`CaseMatrix.similarity`.
+
+    Returns
+    -------
+    solvers : list of numpy.ndarray of int
+        The reachability set of each case, without the case.
+
+    clusters : list of list of int
+        The groups of redundant cases with more than one case.
+    """
+    solvers = []
+    redundant = []
+    for start, sim in case_matrix.similarity(weights, block_size):
+        same_category = case_matrix.category[start : start + len(sim), None] == case_matrix.category[None, :]
+        sim = np.where(same_category, sim, -np.inf)
+        sim[np.arange(len(sim)), np.arange(start, start + len(sim))] = -np.inf
+        solvers.extend(np.flatnonzero(row >= threshold) for row in sim)
+        cases, others = np.nonzero(sim >= redundancy_threshold)
+        redundant.append(np.stack((cases + start, others), axis=1))
+
+    # Group the pairs of cases redundant in both directions
+    parent = np.arange(len(case_matrix))
+
+    def find(case):
+        while parent[case] != case:
+            parent[case] = parent[parent[case]]
+            case = parent[case]
+        return case
+
+    pairs = set(map(tuple, np.concatenate(redundant).tolist())) if redundant else set()
+    for case, other in pairs:
+        if case < other and (other, case) in pairs:
+            parent[find(case)] = find(other)
+    groups = dict()
+    for case in range(len(case_matrix)):
+        groups.setdefault(find(case), []).append(case)
+    return solvers, [group for group in groups.values() if len(group) > 1]
+
+
+def plan_compaction(solvers, utility, adapted, target_size=None):
+    """
+    Choose the cases to remove from a set of cases.
+
+    Cases are removed greedily while every case, including the removed ones, is still solved by a remaining case. The
+    adapted cases are tried first, then the cases solved by more cases, solving fewer cases and with lower utility. If
+    the target size is not reached, the remaining cases solving fewer cases are removed.
+
+    Parameters
+    ----------
+    solvers : list of numpy.ndarray of int
+        The reachability set of each case, as returned by :func:`competence`.
+
+    utility : numpy.ndarray of float
+        The utility of each case.
+
+    adapted : numpy.ndarray of bool
+        Whether each case was learned.
+
+    target_size : int or None
+        The number of cases to keep. If None only the redundant cases are removed.
+
+    Returns
+    -------
+    removed : list of tuple
+        The removed cases and whether they were redundant, in removal order.
+
+    support : numpy.ndarray of int
+        The number of remaining cases solving each case, without the case itself.
+    """
+    n_cases = len(solvers)
+    covers = [[] for _ in range(n_cases)]
+    for case, case_solvers in enumerate(solvers):
+        for solver in case_solvers:
+            covers[solver].append(case)
+    coverage = np.array([len(cases) for cases in covers])
+    support = np.array([len(case_solvers) for case_solvers in solvers])
+    n_remove = n_cases - target_size if target_size is not None else n_cases
+    is_removed = np.zeros(n_cases, dtype=bool)
+    removed = []
+
+    def remove(case, redundant):
+        is_removed[case] = True
+        removed.append((case, redundant))
+        for covered in covers[case]:
+            support[covered] -= 1
+
+    for case in np.lexsort((utility, coverage, -support, ~adapted)):
+        if len(removed) >= n_remove:
+            break
+        # The case must be solved by another case, and every removed case it solves too
+        if support[case] > 0 and all(support[covered] > 1 for covered in covers[case] if is_removed[covered]):
+            remove(case, True)
+    if target_size is not None:
+        for case in np.lexsort((utility, coverage, ~adapted)):
+            if len(removed) >= n_remove:
+                break
+            if not is_removed[case]:
+                remove(case, False)
+    return removed, support
+
+
+def _case_query(case_store, row):
+    """
+    Query with the category, glass, ingredients, alcohol types and basic tastes of a case of the case store.
+    """
+    vocabulary = case_store.vocabulary
+    entries = range(case_store.offsets[row], case_store.offsets[row + 1])
+    alc_types = dict.fromkeys(vocabulary.value("alc_types", case_store.alc_types[entry]) for entry in entries)
+    basic_tastes = dict.fromkeys(vocabulary.value("taste_types", case_store.basic_tastes[entry]) for entry in entries)
+    return Query(
+        category=vocabulary.value("drink_types", case_store.category[row]),
+        glass=vocabulary.value("glass_types", case_store.glass[row]),
+        ingredients=[vocabulary.value("ingredients", case_store.ingredients[entry]) for entry in entries],
+        alc_types=[alc_type for alc_type in alc_types if alc_type],
+        basic_tastes=[basic_taste for basic_taste in basic_tastes if basic_taste],
+    )
+
+
+def relaxed_candidates(case_library, query, searched):
+    """
+    Search the candidate cases of a query in the case store of a case library, relaxing the query like
+    :meth:`CBR.retrieve` until having at least 5 cases.
+
+    Parameters
+    ----------
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library.
+
+    query : :class:`entity.query.Query`
+        User query with recipe requirements.
+
+    searched : numpy.ndarray of bool
+        Whether each row of the case store can be a candidate.
+
+    Returns
+    -------
+    rows : numpy.ndarray of int
+        The rows of the candidate cases, in the order of :meth:`CBR.retrieve`. A case can appear more than once.
+    """
+    encode = case_library.vocabulary.encode_query
+    candidates = []
+    counter = 0
+    soft_query = Query(**vars(query))
+    while True:
+        candidates.append(
+            np.flatnonzero(
+                case_library.case_store.matches(encode(soft_query, case_library.ingredients_onto)) & searched
+            )
+        )
+        if sum(map(len, candidates)) >= 5 or counter > 5:
+            return np.concatenate(candidates)
+        _relax_query(soft_query, counter)
+        counter += 1
+
+
+def leave_one_out(case_library, weights, rows, library_rows=None):
+    """
+    Vectorized leave-one-out evaluation of the retrieval over the case store of a case library.
+
+    Each case is held out and a query is built from it. The query is searched, relaxing it like :meth:`CBR.retrieve`,
+    among the other cases of the library, and the held out case is compared with the most similar one. Ties are
+    broken by taking the first case instead of a random one, so the result is deterministic.
+
+    Parameters
+    ----------
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library.
+
+    weights : dict
+        The similarity weights, as in :attr:`CBR.sim_weights`.
+
+    rows : numpy.ndarray of int
+        The rows of the held out cases in the case store.
+
+    library_rows : numpy.ndarray of int or None
+        The rows of the cases to search. If None all the cases of the case store are searched.
+
+    Returns
+    -------
+    scores : numpy.ndarray of float
+        The Jaccard index between the ingredients of each held out case and its retrieved case.
+    """
+    case_store = case_library.case_store
+    encode = case_library.vocabulary.encode_query
+    searched = np.frombuffer(case_store.alive, dtype=np.uint8) == 1
+    if library_rows is not None:
+        searched = np.zeros(len(searched), dtype=bool)
+        searched[library_rows] = True
+    offsets = np.frombuffer(case_store.offsets, dtype=np.uint32)
+    ingredients = np.frombuffer(case_store.ingredients, dtype=np.uint16)
+    scores = np.zeros(len(rows))
+    for i, row in enumerate(rows):
+        query = _case_query(case_store, row)
+        is_searched, searched[row] = searched[row], False
+        candidates = relaxed_candidates(case_library, query, searched)
+        searched[row] = is_searched
+        if len(candidates) == 0:
+            continue
+        sim_list = case_store.similarity(encode(query, case_library.ingredients_onto), weights, candidates)
+        retrieved = candidates[np.argmax(sim_list)]
+        held_out = set(ingredients[offsets[row] : offsets[row + 1]].tolist())
+        found = set(ingredients[offsets[retrieved] : offsets[retrieved + 1]].tolist())
+        scores[i] = len(held_out & found) / len(held_out | found)
+    return scores
+
+
+def maintain(
+    case_library,
+    weights,
+    target_size=None,
+    threshold=1.0,
+    redundancy_threshold=1.0,
+    block_size=256,
+    max_loss=None,
+    apply=True,
+):
+    """
+    Compact a case library, removing the redundant cases first.
+
+    The competence model of all the cases is computed with :func:`competence`, the cases to remove are chosen with
+    :func:`plan_compaction` and the retrieval quality is measured with :func:`leave_one_out` for all the cases, before
+    and after removing them.
+
+    Parameters
+    ----------
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library.
+
+    weights : dict
+        The similarity weights, as in :attr:`CBR.sim_weights`.
+
+    target_size : int or None
+        The number of cases to keep. If None only the redundant cases are removed.
+
+    threshold : float, default 1.0
+        The minimum similarity of a case to solve another case.
+
+    redundancy_threshold : float, default 1.0
+        The minimum similarity, in both directions, of two redundant cases.
+
+    block_size : int, default 256
+        The number of cases compared at once.
+
+    max_loss : float or None
+        The maximum decrease of the leave-one-out score. If it decreases more, the case library is not changed.
+
+    apply : bool, default True
+        Whether to remove the cases from the case library and save it.
+
+    Returns
+    -------
+    report : MaintenanceReport
+        What was removed and the leave-one-out score before and after the maintenance.
+    """
+    case_store = case_library.case_store
+    cases = case_library.findall(ConstraintsBuilder())
+    case_matrix = CaseMatrix(case_store, case_store.rows(cases))
+    solvers, clusters = competence(case_matrix, weights, threshold, redundancy_threshold, block_size)
+    adapted = np.array([case_store.derivation[row] == "adapted" for row in case_matrix.rows], dtype=bool)
+    removed, support = plan_compaction(solvers, case_matrix.utility, adapted, target_size)
+
+    coverage = np.bincount(np.concatenate(solvers), minlength=len(cases)) if cases else np.zeros(0, dtype=int)
+    is_removed = np.zeros(len(cases), dtype=bool)
+    is_removed[[case for case, _ in removed]] = True
+    report = MaintenanceReport(
+        n_cases=len(cases),
+        clusters=[[case_store.names[case_matrix.rows[case]] for case in cluster] for cluster in clusters],
+        unsolved=int(np.count_nonzero(is_removed & (support == 0))),
+    )
+    for case, redundant in removed:
+        remaining = [solver for solver in solvers[case] if not is_removed[solver]]
+        report.removed.append(
+            dict(
+                name=case_store.names[case_matrix.rows[case]],
+                reason="redundant" if redundant else "coverage",
+                utility=float(case_matrix.utility[case]),
+                coverage=int(coverage[case]),
+                reachability=len(solvers[case]),
+                solved_by=case_store.names[case_matrix.rows[remaining[0]]] if remaining else None,
+            )
+        )
+    report.loo_before = float(leave_one_out(case_library, weights, case_matrix.rows).mean())
+    report.loo_after = float(
+        leave_one_out(case_library, weights, case_matrix.rows, case_matrix.rows[~is_removed]).mean()
+    )
+    if max_loss is not None and report.loo_before - report.loo_after > max_loss:
+        apply = False
+    if apply and removed:
+        report.applied = True
+        for case, _ in removed:
+            case_library.remove_case(cases[case], write=False)
+        case_library.save()
+    return report
@@ -0,0 +1,121 @@
+from collections import Counter, defaultdict
+
+
+class MeasureIndex:
+    """
+    Distribution of the measures of each ingredient of a case library.
+
+    Registered with :meth:`CaseLibrary.register_index`, the index is updated whenever a case is added or removed. The
+    most common measure of each ingredient is cached until one of its entries changes.
+
+    Attributes
+    ----------
+    measures : dict of collections.Counter
+        The number of entries of each ingredient with each ``(measure, quantity, unit)``.
+
+    Examples
+    --------
+    >>> index = MeasureIndex()
+    >>> case_library.register_index(index)
+    >>> index.most_common("lime juice")
+    ('1/2 oz', 15.0, 'ml')
+    >>> index.median("lime juice", "ml")
+    15.0
+    """
+
+    def __init__(self):
+        self.measures = defaultdict(Counter)
+        self._most_common = dict()
+
+    def build(self, cases):
+        """
+        Count the measures of a list of cases, discarding the previous counts.
+        """
+        self.measures.clear()
+        self._most_common.clear()
+        for case in cases:
+            self.add(case)
+
+    def clear_cache(self):
+        """
+        Forget the cached most common measures, e.g. to release memory. They are computed again when needed.
+        """
+        self._most_common.clear()
+
+    def add(self, case):
+        """
+        Count the measures of a new case.
+        """
+        self._update(case, 1)
+
+    def remove(self, case):
+        """
+        Discount the measures of a removed case.
+        """
+        self._update(case, -1)
+
+    def _update(self, case, delta):
+        for ingredient in case.ingredients.iterchildren():
+            name = ingredient.text
+            key = (ingredient.attrib["measure"], float(ingredient.attrib["quantity"]), ingredient.attrib["unit"])
+            measures = self.measures[name]
+            measures[key] += delta
+            if measures[key] <= 0:
+                del measures[key]
+                if not measures:
+                    del self.measures[name]
+            self._most_common.pop(name, None)
+
+    def most_common(self, ingredient):
+        """
+        Get the most common measure of an ingredient.
+
+        Entries without measure are ignored. Among equally common measures the first in alphabetical order is chosen.
+
+        Parameters
+        ----------
+        ingredient : str
+            The name of the ingredient.
+
+        Returns
+        -------
+        measure : tuple of (str, float, str) or None
+            The measure, quantity and unit, or None if the ingredient has no measure in the case library.
+        """
+        if ingredient not in self._most_common:
+            measures = [(-count, key) for key, count in self.measures.get(ingredient, {}).items() if key[0]]
+            self._most_common[ingredient] = min(measures)[1] if measures else None
+        return self._most_common[ingredient]
+
+    def median(self, ingredient, unit):
+        """
+        Get the median quantity of an ingredient in a unit.
+
+        Parameters
+        ----------
+        ingredient : str
+            The name of the ingredient.
+
+        unit : str
+            The unit of the quantities, e.g. "ml" or "gr".
+
+        Returns
+        -------
+        quantity : float or None
+            The median of the quantities of the entries of the ingredient in the unit, or None if there is none.
+        """
+        quantities = sorted(
+            (quantity, count)
+            for (_, quantity, key_unit), count in self.measures.get(ingredient, {}).items()
+            if key_unit == unit
+        )
+        total = sum(count for _, count in quantities)
+        if total == 0:
+            return None
+        seen = 0
+        for i, (quantity, count) in enumerate(quantities):
+            seen += count
+            if 2 * seen > total:
+                return quantity
+            if 2 * seen == total:
+                return (quantity + quantities[i + 1][0]) / 2
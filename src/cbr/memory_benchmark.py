@@ -0,0 +1,83 @@
+import copy
+import os
+import tempfile
+
+from lxml import etree
+
+from src.cbr.cbr import CBR
+
+
+def grow_case_library(case_library_file, factor, output_file):
+    """
+    Write a case library with ``factor`` copies of every case of another one.
+
+    The copies are renamed ``name #k`` and added next to their case, so the categories, glasses and values of the case
+    library do not change, only the number of cases.
+
+    Parameters
+    ----------
+    case_library_file : str
+        The path to the case library.
+
+    factor : int
+        The number of copies of each case, the case included.
+
+    output_file : str
+        The path to the grown case library.
+    """
+    tree = etree.parse(case_library_file, etree.XMLParser(remove_blank_text=True))
+    for cocktail in tree.getroot().findall(".//cocktail"):
+        parent = cocktail.getparent()
+        for k in range(1, factor):
+            copied = copy.deepcopy(cocktail)
+            copied.find("name").text = f"{cocktail.findtext('name')} #{k}"
+            parent.append(copied)
+    tree.write(output_file, pretty_print=True, encoding="utf-8")
+
+
+def memory_growth(case_library_file, factors=(1, 2, 4, 8), **cbr_kwargs):
+    """
+    Measure the memory used by the CBR as its case library grows.
+
+    For each factor the case library is grown with :func:`grow_case_library` and loaded by a new CBR, whose memory is
+    reported with :meth:`CBR.memory_report`.
+
+    Parameters
+    ----------
+    case_library_file : str
+        The path to the case library.
+
+    factors : sequence of int, default (1, 2, 4, 8)
+        The number of copies of each case of each measure.
+
+    **cbr_kwargs
+        Arguments of the :class:`cbr.cbr.CBR`.
+
+    Returns
+    -------
+    results : list of dict
+        The factor, the number of cases, the bytes of each component and their total, the bytes per case and the
+        marginal bytes per case, i.e. the bytes added by each case since the previous factor, of each measure.
+    """
+    results = []
+    previous = None
+    with tempfile.TemporaryDirectory() as directory:
+        for factor in factors:
+            path = os.path.join(directory, f"case_library_{factor}.xml")
+            grow_case_library(case_library_file, factor, path)
+            report = CBR(path, **cbr_kwargs).memory_report()
+            result = dict(
+                factor=factor,
+                n_cases=report["n_cases"],
+                total=report["total"],
+                bytes_per_case=report["per_case"]["total"],
+                marginal_bytes_per_case=None,
+                components=report["components"],
+            )
+            if previous is not None and report["n_cases"] > previous["n_cases"]:
+                result["marginal_bytes_per_case"] = (report["total"] - previous["total"]) / (
+                    report["n_cases"] - previous["n_cases"]
+                )
+            results.append(result)
+            previous = result
+    return results
@@ -0,0 +1,359 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class CaseMatrix:
+    """
+    One-hot encoding of a set of cases of a case store, used to compare all the cases with each other.
+
+    Parameters
+    ----------
+    case_store : :class:`cbr.vocabulary.CaseStore`
+        The case store of the cases.
+
+    rows : numpy.ndarray of int
+        The rows of the cases in the case store. The cases are indexed by their position in ``rows``.
+
+    Attributes
+    ----------
+    ingredients, alc_types, basic_tastes : numpy.ndarray of bool
+        Whether each case has an ingredient with each value id. The empty alcohol type and basic taste are never set, as
+        they never match a query.
+
+    entry_cases : numpy.ndarray of int
+        The case of each ingredient of the cases.
+
+    entry_ingredients, entry_alc_types, entry_basic_tastes : numpy.ndarray of int
+        The value ids of each ingredient of the cases.
+    """
+
+    def __init__(self, case_store, rows):
+        vocabulary = case_store.vocabulary
+        self.rows = np.asarray(rows, dtype=np.intp)
+        n_cases = len(self.rows)
+        case_of_row = np.full(len(case_store), -1, dtype=np.intp)
+        case_of_row[self.rows] = np.arange(n_cases)
+        entry_cases = case_of_row[np.frombuffer(case_store.entry_rows, dtype=np.uint32)]
+        entries = entry_cases >= 0
+        self.entry_cases = entry_cases[entries]
+        self.entry_ingredients = np.frombuffer(case_store.ingredients, dtype=np.uint16)[entries].astype(np.intp)
+        self.entry_alc_types = np.frombuffer(case_store.alc_types, dtype=np.uint16)[entries].astype(np.intp)
+        self.entry_basic_tastes = np.frombuffer(case_store.basic_tastes, dtype=np.uint16)[entries].astype(np.intp)
+        self.category = np.frombuffer(case_store.category, dtype=np.uint16)[self.rows]
+        self.glass = np.frombuffer(case_store.glass, dtype=np.uint16)[self.rows]
+        self.utility = np.frombuffer(case_store.utility, dtype=np.float64)[self.rows]
+        self.ingredients = self._one_hot(self.entry_ingredients, vocabulary.size("ingredients"))
+        self.alc_types = self._one_hot(self.entry_alc_types, vocabulary.size("alc_types"))
+        self.basic_tastes = self._one_hot(self.entry_basic_tastes, vocabulary.size("taste_types"))
+        self.alc_types[:, 0] = False
+        self.basic_tastes[:, 0] = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _one_hot(self, values, size):
+        one_hot = np.zeros((len(self.rows), size), dtype=bool)
+        one_hot[self.entry_cases, values] = True
+        return one_hot
+
+    def similarity(self, weights, block_size=256):
+        """
+        Pairwise similarity between the cases, computed in blocks of cases.
+
+        The similarity of case ``j`` for case ``i`` is the similarity computed by :meth:`CBR._similarity_cocktail` for
+        case ``j`` and a query with the glass, ingredients, alcohol types and basic tastes of case ``i``, without the
+        utility. It is not symmetric.
+
+        Parameters
+        ----------
+        weights : dict
+            The similarity weights, as in :attr:`CBR.sim_weights`.
+
+        block_size : int, default 256
+            The number of cases of each block. A block uses about ``block_size * len(self) * 40`` bytes.
+
+        Yields
+        ------
+        start : int
+            The first case of the block.
+
+        similarity : numpy.ndarray of float
+            The similarity of every case (columns) for the cases ``start:start + block_size`` (rows).
+        """
+        alc_types = self.alc_types.astype(np.float64)
+        basic_tastes = self.basic_tastes.astype(np.float64)
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            entries = np.flatnonzero((self.entry_cases >= start) & (self.entry_cases < stop))
+            # Score of every case for each ingredient of the block, as for the ingredients of a query
+            scores = np.where(
+                self.ingredients[:, self.entry_ingredients[entries]].T,
+                weights["ingr_match"],
+                np.where(
+                    self.alc_types[:, self.entry_alc_types[entries]].T,
+                    weights["ingr_alc_type_match"],
+                    np.where(
+                        self.basic_tastes[:, self.entry_basic_tastes[entries]].T, weights["ingr_basic_taste_match"], 0
+                    ),
+                ),
+            )
+            entry_block = np.zeros((stop - start, len(entries)))
+            entry_block[self.entry_cases[entries] - start, np.arange(len(entries))] = 1
+            sim = entry_block @ scores
+            sim += weights["alc_type_match"] * (alc_types[start:stop] @ alc_types.T)
+            sim += weights["basic_taste_match"] * (basic_tastes[start:stop] @ basic_tastes.T)
+            sim += np.where(self.glass[start:stop, None] == self.glass[None, :], weights["glass_type_match"], 0)
+            norm = (
+                weights["ingr_match"] * entry_block.sum(axis=1)
+                + weights["alc_type_match"] * alc_types[start:stop].sum(axis=1)
+                + weights["basic_taste_match"] * basic_tastes[start:stop].sum(axis=1)
+                + weights["glass_type_match"]
+            )
+            yield start, sim / norm[:, None]
+
+
+class NeighbourIndex:
+    """
+    Graph of the most similar cases of each case of a case library.
+
+    The neighbours of a case are the cases with the highest similarity of :meth:`CaseMatrix.similarity` for it, i.e. the
+    cases retrieved for a query with its glass, ingredients, alcohol types and basic tastes, without the utility, so the
+    graph does not change when cases are evaluated. The graph is computed in blocks of cases and, registered with
+    :meth:`CaseLibrary.register_index`, updated locally: a new case gets its neighbours and becomes a neighbour of the
+    cases for which it is more similar than their last neighbour, and the cases that had a removed case as neighbour
+    look for their neighbours again.
+
+    Parameters
+    ----------
+    case_store : :class:`cbr.vocabulary.CaseStore`
+        The case store of the case library.
+
+    weights : dict
+        The similarity weights, as in :attr:`CBR.sim_weights`. The graph must be built again when they change.
+
+    k : int, default 8
+        The number of neighbours of each case.
+
+    block_size : int, default 256
+        The number of cases compared at once when building the graph, see :meth:`CaseMatrix.similarity`.
+
+    Attributes
+    ----------
+    neighbours : dict of numpy.ndarray of int
+        The rows of the neighbours of each row of the case store, by decreasing similarity.
+
+    similarities : dict of numpy.ndarray of float
+        The similarity of the neighbours of each row.
+
+    reverse : dict of set of int
+        The rows that have each row as neighbour.
+
+    Examples
+    --------
+    >>> index = NeighbourIndex(case_library.case_store, cbr.sim_weights)
+    >>> case_library.register_index(index)
+    >>> [neighbour.name for neighbour in index.neighbours_of(cocktail)]
+    """
+
+    def __init__(self, case_store, weights, k=8, block_size=256):
+        self.case_store = case_store
+        self.weights = weights
+        self.k = k
+        self.block_size = block_size
+        self.neighbours = dict()
+        self.similarities = dict()
+        self.reverse = defaultdict(set)
+        self._rows = dict()
+
+    def __len__(self):
+        return len(self.neighbours)
+
+    def build(self, cases):
+        """
+        Compute the neighbours of a list of cases, discarding the previous graph.
+        """
+        self.neighbours.clear()
+        self.similarities.clear()
+        self.reverse.clear()
+        rows = self.case_store.rows(cases)
+        self._rows = dict(zip(cases, rows.tolist()))
+        case_matrix = CaseMatrix(self.case_store, rows)
+        for start, sim in case_matrix.similarity(self.weights, self.block_size):
+            sim[np.arange(len(sim)), np.arange(start, start + len(sim))] = -np.inf
+            for i, row_sim in enumerate(sim):
+                self._link(int(rows[start + i]), rows, row_sim)
+
+    def add(self, case):
+        """
+        Compute the neighbours of a new case and add it to the neighbours of the cases it is similar enough to.
+        """
+        row = self.case_store.row(case)
+        rows = self._graph_rows()
+        self._rows[case] = row
+        if len(rows) == 0:
+            self._link(row, rows, np.zeros(0))
+            return
+        self._link(row, rows, self._similarity_from([row], rows)[0])
+        sim = self._similarity_to(row, rows)
+        last = np.array([self._last(other) for other in rows.tolist()])
+        for other, other_sim in zip(rows[sim > last].tolist(), sim[sim > last].tolist()):
+            self._insert(other, row, other_sim)
+
+    def remove(self, case):
+        """
+        Remove a case from the graph and find new neighbours for the cases that had it as neighbour.
+        """
+        row = self._rows.pop(case, None)
+        if row is None:
+            return
+        self._unlink(row)
+        del self.neighbours[row]
+        del self.similarities[row]
+        affected = sorted(self.reverse.pop(row, ()))
+        if not affected:
+            return
+        rows = self._graph_rows()
+        sim = self._similarity_from(affected, rows)
+        sim[np.arange(len(affected)), np.searchsorted(rows, affected)] = -np.inf
+        for other, other_sim in zip(affected, sim):
+            self._unlink(other)
+            self._link(other, rows, other_sim)
+
+    def neighbours_of(self, case):
+        """
+        Get the neighbours of a case of the case library.
+
+        Returns
+        -------
+        neighbours : list of :class:`lxml.objectify.ObjectifiedElement`
+            The neighbours of the case by decreasing similarity, or an empty list if it is not in the graph.
+        """
+        row = self._rows.get(case)
+        if row is None:
+            return []
+        return [self.case_store.cases[neighbour] for neighbour in self.neighbours[row].tolist()]
+
+    def _graph_rows(self):
+        return np.array(sorted(self.neighbours), dtype=np.intp)
+
+    def _last(self, row):
+        similarities = self.similarities[row]
+        return similarities[-1] if len(similarities) >= self.k else -np.inf
+
+    def _link(self, row, rows, sim):
+        n_neighbours = min(self.k, int(np.isfinite(sim).sum()))
+        top = np.argpartition(-sim, n_neighbours - 1)[:n_neighbours] if n_neighbours else np.zeros(0, dtype=np.intp)
+        top = top[np.lexsort((rows[top], -sim[top]))]
+        self.neighbours[row] = rows[top]
+        self.similarities[row] = sim[top]
+        for neighbour in rows[top].tolist():
+            self.reverse[neighbour].add(row)
+
+    def _unlink(self, row):
+        for neighbour in self.neighbours[row].tolist():
+            self.reverse[neighbour].discard(row)
+
+    def _insert(self, row, neighbour, sim):
+        similarities = self.similarities[row]
+        if len(similarities) >= self.k:
+            self.reverse[int(self.neighbours[row][-1])].discard(row)
+        # Among equal similarities the previous neighbours come first
+        position = len(similarities) - np.searchsorted(similarities[::-1], sim, side="left")
+        self.neighbours[row] = np.insert(self.neighbours[row], position, neighbour)[: self.k]
+        self.similarities[row] = np.insert(similarities, position, sim)[: self.k]
+        self.reverse[neighbour].add(row)
+
+    def _similarity_from(self, query_rows, rows):
+        """
+        Similarity of the cases of ``rows`` (columns) for each case of ``query_rows`` (rows) as a query.
+        """
+        case_store = self.case_store
+        weights = self.weights
+        offsets = np.frombuffer(case_store.offsets, dtype=np.uint32)
+        entries = np.concatenate([np.arange(offsets[row], offsets[row + 1]) for row in query_rows])
+        entry_queries = np.repeat(np.arange(len(query_rows)), np.diff(offsets)[query_rows])
+        ingredients = np.frombuffer(case_store.ingredients, dtype=np.uint16)[entries].astype(np.intp)
+        alc_types = np.frombuffer(case_store.alc_types, dtype=np.uint16)[entries].astype(np.intp)
+        basic_tastes = np.frombuffer(case_store.basic_tastes, dtype=np.uint16)[entries].astype(np.intp)
+        has_ingredient = self._has(case_store.ingredients, ingredients, rows)
+        has_alc_type = self._has(case_store.alc_types, alc_types, rows)
+        has_basic_taste = self._has(case_store.basic_tastes, basic_tastes, rows)
+        scores = np.where(
+            has_ingredient,
+            weights["ingr_match"],
+            np.where(
+                has_alc_type,
+                weights["ingr_alc_type_match"],
+                np.where(has_basic_taste, weights["ingr_basic_taste_match"], 0),
+            ),
+        )
+        sim = np.zeros((len(query_rows), len(rows)))
+        np.add.at(sim, entry_queries, scores)
+        norm = weights["ingr_match"] * np.bincount(entry_queries, minlength=len(query_rows))
+        for values, has, name in (
+            (alc_types, has_alc_type, "alc_type_match"),
+            (basic_tastes, has_basic_taste, "basic_taste_match"),
+        ):
+            # Each alcohol type (basic taste) of a query counts once
+            _, first = np.unique(entry_queries * (values.max(initial=0) + 1) + values, return_index=True)
+            first = first[values[first] != 0]
+            np.add.at(sim, entry_queries[first], weights[name] * has[first])
+            norm += weights[name] * np.bincount(entry_queries[first], minlength=len(query_rows))
+        glass = np.frombuffer(case_store.glass, dtype=np.uint16)
+        sim += np.where(glass[query_rows, None] == glass[None, rows], weights["glass_type_match"], 0)
+        norm += weights["glass_type_match"]
+        return np.divide(sim, norm[:, None], out=np.zeros_like(sim), where=norm[:, None] != 0)
+
+    def _similarity_to(self, row, rows):
+        """
+        Similarity of the case of ``row`` for each case of ``rows`` as a query.
+        """
+        case_store = self.case_store
+        weights = self.weights
+        offsets = np.frombuffer(case_store.offsets, dtype=np.uint32)
+        selected = np.zeros(len(case_store), dtype=bool)
+        selected[rows] = True
+        entry_rows = np.frombuffer(case_store.entry_rows, dtype=np.uint32).astype(np.intp)
+        entries = selected[entry_rows]
+        entry_rows = entry_rows[entries]
+        columns = []
+        for column in (case_store.ingredients, case_store.alc_types, case_store.basic_tastes):
+            values = np.frombuffer(column, dtype=np.uint16)
+            target = np.setdiff1d(values[offsets[row] : offsets[row + 1]], [0])
+            values = values[entries].astype(np.intp)
+            columns.append((values, np.isin(values, target) & (values != 0)))
+        (_, has_ingredient), (alc_types, has_alc_type), (basic_tastes, has_basic_taste) = columns
+        scores = np.where(
+            has_ingredient,
+            weights["ingr_match"],
+            np.where(
+                has_alc_type,
+                weights["ingr_alc_type_match"],
+                np.where(has_basic_taste, weights["ingr_basic_taste_match"], 0),
+            ),
+        )
+        sim = np.bincount(entry_rows, scores, minlength=len(case_store))
+        norm = weights["ingr_match"] * np.bincount(entry_rows, minlength=len(case_store))
+        for values, has, name in (
+            (alc_types, has_alc_type, "alc_type_match"),
+            (basic_tastes, has_basic_taste, "basic_taste_match"),
+        ):
+            # Each alcohol type (basic taste) of a query counts once
+            _, first = np.unique(entry_rows * (values.max(initial=0) + 1) + values, return_index=True)
+            first = first[values[first] != 0]
+            sim += weights[name] * np.bincount(entry_rows[first], has[first], minlength=len(case_store))
+            norm += weights[name] * np.bincount(entry_rows[first], minlength=len(case_store))
+        glass = np.frombuffer(case_store.glass, dtype=np.uint16)
+        sim += np.where(glass == glass[row], weights["glass_type_match"], 0)
+        norm += weights["glass_type_match"]
+        return np.divide(sim[rows], norm[rows], out=np.zeros(len(rows)), where=norm[rows] != 0)
+
+    def _has(self, column, values, rows):
+        """
+        Whether each case of ``rows`` (columns) has an ingredient with each value id (rows). The id 0 never matches.
+        """
+        has = dict()
+        for value in np.unique(values).tolist():
+            has[value] = self.case_store._has(column, value if value else -1)[rows]
+        return np.array([has[value] for value in values.tolist()]).reshape(len(values), len(rows))
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from lxml import etree
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.learning_queue import case_key
+
+
+def case_digest(case):
+    """
+    Digest of the XML of a case, to compare the cases of two runs.
+    """
+    return hashlib.sha1(etree.tostring(case)).hexdigest()
+
+
+def query_fields(query):
+    """
+    Copy of the fields of a query with only str values, that can be serialized to JSON.
+    """
+    return dict(
+        category=str(query.category),
+        glass=str(query.glass),
+        ingredients=[str(value) for value in query.ingredients],
+        exc_ingredients=[str(value) for value in query.exc_ingredients],
+        alc_types=[str(value) for value in query.alc_types],
+        exc_alc_types=[str(value) for value in query.exc_alc_types],
+        basic_tastes=[str(value) for value in query.basic_tastes],
+    )
+
+
+class QueryLog:
+    """
+    Structured capture of the queries and evaluations of a CBR system, as JSON lines.
+
+    The log starts with a ``start`` event with the number of cases and the similarity weights of the CBR. Then each
+    query is logged as a ``query`` event, with its fields, the name of the adapted case, the seed of the random
+    choices of the CBR, the names of the retrieved and similar cases, the key of the retrieved case, since the names are
+    not unique, see :func:`cbr.learning_queue.case_key`, the digest of the adapted case and its latency.
+    Each batch of evaluations applied to the case library is logged as an ``evaluations`` event, with the id of the
+    query and the score of each evaluation. An evaluation whose query is not known, e.g. recovered from the journal of
+    the learner, has a null id. Every event has the wall clock ``time`` it was logged.
+
+    Events are appended in the order the CBR runs them, so :func:`cbr.replay.replay` can run them again in the same
+    order.
+
+    Parameters
+    ----------
+    path : str
+        The path to the log file. Events are appended to it.
+
+    cbr : :class:`cbr.cbr.CBR`
+        The CBR system whose queries are logged.
+
+    max_pending : int, default 4096
+        The maximum number of queries whose evaluation is awaited. The oldest ones are forgotten first.
+
+    Attributes
+    ----------
+    session : str
+        The id of the session, the prefix of the ids of its queries.
+    """
+
+    def __init__(self, path, cbr, max_pending=4096):
+        self.path = path
+        self.session = uuid.uuid4().hex[:8]
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._n_queries = 0
+        # Id of the query of each adapted case, kept with the case so the id of the object is not reused
+        self._pending = OrderedDict()
+        self._file = open(path, "a", encoding="utf-8")
+        self._write(
+            dict(
+                type="start",
+                session=self.session,
+                case_library=str(cbr.case_library.case_library_path),
+                n_cases=len(cbr.case_library.findall(ConstraintsBuilder())),
+                sim_weights=dict(cbr.sim_weights),
+            )
+        )
+
+    def log_query(self, fields, name, seed, state, latency):
+        """
+        Log a query.
+
+        Parameters
+        ----------
+        fields : dict
+            The fields of the query before it was run, from :func:`query_fields`.
+
+        name : str
+            The name of the adapted case.
+
+        seed : int
+            The seed of the random choices of the CBR for the query.
+
+        state : tuple
+            The state of the query, from :meth:`CBR.get_state`.
+
+        latency : float
+            The seconds taken by the query.
+
+        Returns
+        -------
+        query_id : str
+            The id of the query.
+        """
+        _, retrieved_recipe, sim_recipes, adapted_recipe = state
+        with self._lock:
+            self._n_queries += 1
+            query_id = f"{self.session}-{self._n_queries}"
+            self._pending[id(adapted_recipe)] = (adapted_recipe, query_id)
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+            self._write(
+                dict(
+                    type="query",
+                    id=query_id,
+                    query=fields,
+                    name=name,
+                    seed=seed,
+                    retrieved=str(retrieved_recipe.name),
+                    retrieved_key=case_key(retrieved_recipe),
+                    similar=[str(recipe.name) for recipe in sim_recipes],
+                    adapted=case_digest(adapted_recipe),
+                    latency=latency,
+                )
+            )
+        return query_id
+
+    def log_evaluations(self, evaluations):
+        """
+        Log a batch of evaluations, see :meth:`CBR.record_evaluations`.
+        """
+        with self._lock:
+            logged = []
+            for user_score, (_, _, _, adapted_recipe) in evaluations:
+                adapted_recipe, query_id = self._pending.pop(id(adapted_recipe), (adapted_recipe, None))
+                logged.append(dict(id=query_id, score=user_score))
+            self._write(dict(type="evaluations", evaluations=logged))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, event):
+        event["time"] = time.time()
+        self._file.write(json.dumps(event) + "\n")
+        self._file.flush()
+
+
+def read_query_log(path):
+    """
+    Read the events of a query log, skipping the lines that are not valid JSON, e.g. cut by a crash.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
@@ -0,0 +1,110 @@
+import random
+import time
+from collections import OrderedDict
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.learning_queue import case_key
+from src.cbr.query_log import case_digest
+from src.entity.query import Query
+from src.utils.metrics import Histogram
+
+
+def replay(events, case_library_file=None, speed=0.0, **cbr_kwargs):
+    """
+    Run the queries and evaluations of a query log again, and check that they give the same results.
+
+    The queries run with their logged seed, and the evaluations are applied in the same batches, so a case library in
+    the same state as when the log started gives the same retrieved and adapted cases. The retrieved cases are compared
+    by name and by key, since the names are not unique. The similarity weights of each session of the log are used. The
+    case library is not written.
+
+    Parameters
+    ----------
+    events : iterable of dict
+        The events of the log, from :func:`read_query_log`.
+
+    case_library_file : str or None
+        The path to a snapshot of the case library taken when the log started. If None it uses the default case
+        library.
+
+    speed : float, default 0.0
+        The speed of the replay relative to the logged times, e.g. 1 to wait between the events as much as when they
+        were logged. If 0 the events run as fast as possible.
+
+    **cbr_kwargs
+        Arguments of the :class:`cbr.cbr.CBR`.
+
+    Returns
+    -------
+    report : dict
+        The number of queries and evaluations replayed, the evaluations whose query is not in the log, the sessions
+        whose case library has a different number of cases, the queries with different results and the fields that
+        differ, whether the replay is deterministic, the latency histogram of the replayed queries, the wall time and
+        the throughput.
+    """
+    cbr = CBR(case_library_file, **cbr_kwargs)
+    states = OrderedDict()
+    latency = Histogram()
+    mismatches = []
+    mismatched_sessions = []
+    n_queries = n_evaluations = n_unmatched = 0
+    first_time = None
+    start = time.perf_counter()
+    for event in events:
+        if speed and "time" in event:
+            if first_time is None:
+                first_time = event["time"]
+            delay = (event["time"] - first_time) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if event["type"] == "start":
+            if event["n_cases"] != len(cbr.case_library.findall(ConstraintsBuilder())):
+                mismatched_sessions.append(event["session"])
+            if event["sim_weights"] != cbr.sim_weights:
+                cbr.set_weights(event["sim_weights"])
+        elif event["type"] == "query":
+            random.seed(event["seed"])
+            query_start = time.perf_counter()
+            try:
+                cbr.run_query(Query(**event["query"]), event["name"])
+            except Exception as e:
+                mismatches.append(dict(id=event["id"], error=repr(e)))
+                continue
+            latency.observe(time.perf_counter() - query_start)
+            n_queries += 1
+            _, retrieved_recipe, sim_recipes, adapted_recipe = state = cbr.get_state()
+            actual = dict(
+                retrieved=str(retrieved_recipe.name),
+                retrieved_key=case_key(retrieved_recipe),
+                similar=[str(recipe.name) for recipe in sim_recipes],
+                adapted=case_digest(adapted_recipe),
+            )
+            # The logs written before the key of the retrieved case was logged do not have it
+            fields = [field for field, value in actual.items() if field in event and event[field] != value]
+            if fields:
+                mismatches.append(dict(id=event["id"], fields=fields))
+            states[event["id"]] = state
+        elif event["type"] == "evaluations":
+            batch = []
+            for evaluation in event["evaluations"]:
+                state = states.pop(evaluation["id"], None)
+                if state is None:
+                    n_unmatched += 1
+                    continue
+                batch.append((evaluation["score"], state))
+            if batch:
+                cbr.learn_evaluations(batch, write=False)
+                n_evaluations += len(batch)
+    wall_time = time.perf_counter() - start
+    return dict(
+        n_queries=n_queries,
+        n_evaluations=n_evaluations,
+        unmatched_evaluations=n_unmatched,
+        mismatched_sessions=mismatched_sessions,
+        mismatches=mismatches,
+        deterministic=not mismatches,
+        latency=latency.snapshot(),
+        wall_time=wall_time,
+        throughput=n_queries / wall_time if wall_time else 0.0,
+    )
@@ -0,0 +1,362 @@
+import itertools
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.maintenance import _case_query, relaxed_candidates
+from src.cbr.vocabulary import SIMILARITY_TERMS
+
+# Weights of matching terms are positive and weights of excluded terms negative
+BOUNDS = np.array([(-1.0, 0.0) if term.startswith("exc_") else (0.0, 1.0) for term in SIMILARITY_TERMS])
+
+
+def weights_to_array(weights):
+    """
+    Array of similarity weights, in the order of :data:`cbr.vocabulary.SIMILARITY_TERMS`.
+    """
+    return np.array([weights[term] for term in SIMILARITY_TERMS])
+
+
+def array_to_weights(array):
+    """
+    Dictionary of similarity weights, as in :attr:`CBR.sim_weights`, from an array of weights.
+    """
+    return {term: float(weight) for term, weight in zip(SIMILARITY_TERMS, array)}
+
+
+def save_weights(path, weights, **info):
+    """
+    Write similarity weights to a JSON file that can be loaded with :meth:`CBR.load_weights`.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+
+    weights : dict
+        The similarity weights, as in :attr:`CBR.sim_weights`.
+
+    **info
+        Other values to write to the file, e.g. the score of the weights.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(sim_weights=weights, **info), f, indent=2)
+
+
+class TuningProblem:
+    """
+    Leave-one-out retrieval problems whose score can be computed for many similarity weights at once.
+
+    Each case of the case library is held out in turn and a query is built from it, with some random exclusions. The
+    candidate cases of the query are searched once, and the number of matches of each term of the similarity is
+    counted for every candidate with :meth:`CaseArrays.match_counts`. The similarity of all the candidates for some
+    weights is then a product of the counts and the weights.
+
+    The score of some weights is the mean, over the queries, of the Jaccard index between the ingredients of the held
+    out case and the ingredients of the retrieved case. Ties are counted with their mean Jaccard index, as the CBR
+    chooses randomly among them.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray of float
+        The match counts of each candidate of every query, one query after the other.
+
+    norms : numpy.ndarray of float
+        The normalization counts of each query.
+
+    utility : numpy.ndarray of float
+        The utility of each candidate.
+
+    gains : numpy.ndarray of float
+        The Jaccard index between each candidate and the held out case of its query.
+
+    offsets : numpy.ndarray of int
+        The first candidate of each query, and the number of candidates at the end.
+    """
+
+    def __init__(self, counts, norms, utility, gains, offsets):
+        self.counts = counts
+        self.norms = norms
+        self.utility = utility
+        self.gains = gains
+        self.offsets = offsets
+        self.lengths = np.diff(offsets)
+
+    def __len__(self):
+        return len(self.norms)
+
+    @property
+    def active(self):
+        """
+        Whether each weight changes the similarity of any candidate.
+        """
+        return self.counts.any(axis=0)
+
+    @classmethod
+    def from_case_library(cls, case_library, n_excluded=2, n_excluded_alc_types=1, seed=2022):
+        """
+        Build the problems of all the cases of a case library.
+
+        Parameters
+        ----------
+        case_library : :class:`cbr.case_library.CaseLibrary`
+            The case library.
+
+        n_excluded : int, default 2
+            The number of random ingredients, not in the held out case, excluded by each query.
+
+        n_excluded_alc_types : int, default 1
+            The number of random alcohol types, not in the held out case, excluded by each query.
+
+        seed : int, default 2022
+            The seed of the random exclusions.
+
+        Returns
+        -------
+        problem : TuningProblem
+            The problems.
+        """
+        rng = random.Random(seed)
+        case_store = case_library.case_store
+        encode = case_library.vocabulary.encode_query
+        rows = case_store.rows(case_library.findall(ConstraintsBuilder()))
+        searched = np.frombuffer(case_store.alive, dtype=np.uint8) == 1
+        offsets = np.frombuffer(case_store.offsets, dtype=np.uint32)
+        ingredients = np.frombuffer(case_store.ingredients, dtype=np.uint16)
+        counts, norms, utility, gains, lengths = [], [], [], [], []
+        for row in rows:
+            query = _case_query(case_store, row)
+            other_ingredients = [value for value in case_library.ingredients if value not in query.ingredients]
+            query.set_exc_ingredients(rng.sample(other_ingredients, min(n_excluded, len(other_ingredients))))
+            other_alc_types = [value for value in case_library.alc_types if value not in query.alc_types]
+            query.set_exc_alc_types(rng.sample(other_alc_types, min(n_excluded_alc_types, len(other_alc_types))))
+            searched[row] = False
+            candidates = relaxed_candidates(case_library, query, searched)
+            searched[row] = True
+            if len(candidates) == 0:
+                continue
+            query_counts, query_norm = case_store.match_counts(encode(query, case_library.ingredients_onto), candidates)
+            held_out = set(ingredients[offsets[row] : offsets[row + 1]].tolist())
+            for candidate in candidates:
+                found = set(ingredients[offsets[candidate] : offsets[candidate + 1]].tolist())
+                gains.append(len(held_out & found) / len(held_out | found))
+            counts.append(query_counts)
+            norms.append(query_norm)
+            utility.append(np.frombuffer(case_store.utility, dtype=np.float64)[candidates])
+            lengths.append(len(candidates))
+        return cls(
+            np.concatenate(counts),
+            np.array(norms),
+            np.concatenate(utility),
+            np.array(gains),
+            np.concatenate(([0], np.cumsum(lengths))),
+        )
+
+    def score(self, weights):
+        """
+        Score several weights.
+
+        Parameters
+        ----------
+        weights : numpy.ndarray of float
+            The weights, one row for each setting, in the order of :data:`cbr.vocabulary.SIMILARITY_TERMS`.
+
+        Returns
+        -------
+        scores : numpy.ndarray of float
+            The mean Jaccard index of the retrieved cases for each setting.
+        """
+        weights = np.atleast_2d(weights)
+        starts = self.offsets[:-1]
+        norm = np.repeat(self.norms @ weights.T, self.lengths, axis=0)
+        sim = np.divide(self.counts @ weights.T, norm, out=np.ones_like(norm), where=norm != 0)
+        sim *= self.utility[:, None]
+        # Equal similarities can differ in the last bits depending on how the product is blocked
+        is_max = sim >= np.repeat(np.maximum.reduceat(sim, starts, axis=0), self.lengths, axis=0) - 1e-9
+        gains = np.add.reduceat(is_max * self.gains[:, None], starts, axis=0) / np.add.reduceat(is_max, starts, axis=0)
+        return gains.mean(axis=0)
+
+
+_problem = None
+
+
+def _init_worker(problem):
+    global _problem
+    _problem = problem
+
+
+def _score(weights):
+    return _problem.score(weights)
+
+
+class WeightTuner:
+    """
+    Search of the similarity weights with the best leave-one-out score of a :class:`TuningProblem`.
+
+    The weights are scored in chunks by a pool of processes, each with its own copy of the problem. Only the weights
+    that change the similarity of some candidate are searched; the others keep their value in the initial weights.
+
+    Parameters
+    ----------
+    problem : TuningProblem
+        The problem.
+
+    weights : dict
+        The initial similarity weights, as in :attr:`CBR.sim_weights`.
+
+    n_workers : int or None
+        The number of worker processes. If None it uses one per CPU, and if 0 the weights are scored in this process.
+
+    chunk_size : int, default 256
+        The number of weights scored at once by a worker.
+
+    Attributes
+    ----------
+    best_weights : dict
+        The best weights found.
+
+    best_score : float
+        The score of the best weights.
+
+    baseline_score : float
+        The score of the initial weights.
+
+    n_scored : int
+        The number of weights scored.
+
+    Examples
+    --------
+    >>> with WeightTuner(TuningProblem.from_case_library(cbr.case_library), cbr.sim_weights) as tuner:
+    ...     tuner.random_search(10000)
+    ...     tuner.coordinate_search()
+    >>> save_weights("sim_weights.json", tuner.best_weights, score=tuner.best_score)
+    """
+
+    def __init__(self, problem, weights, n_workers=None, chunk_size=256):
+        self.problem = problem
+        self.chunk_size = chunk_size
+        self.initial = weights_to_array(weights)
+        self.active = np.flatnonzero(problem.active)
+        self.n_scored = 0
+        self._pool = None
+        if n_workers != 0:
+            self._pool = ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(problem,))
+        self.baseline_score = self.best_score = float(problem.score(self.initial)[0])
+        self.best_weights = array_to_weights(self.initial)
+        self._best = self.initial
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def score(self, weights):
+        """
+        Score several weights, keeping the best ones.
+
+        Parameters
+        ----------
+        weights : numpy.ndarray of float
+            The weights, one row for each setting, in the order of :data:`cbr.vocabulary.SIMILARITY_TERMS`.
+
+        Returns
+        -------
+        scores : numpy.ndarray of float
+            The score of each setting.
+        """
+        chunks = [weights[i : i + self.chunk_size] for i in range(0, len(weights), self.chunk_size)]
+        if self._pool is not None and len(chunks) > 1:
+            scores = np.concatenate(list(self._pool.map(_score, chunks)))
+        else:
+            scores = np.concatenate([self.problem.score(chunk) for chunk in chunks])
+        self.n_scored += len(weights)
+        best = int(np.argmax(scores))
+        if scores[best] > self.best_score:
+            self.best_score = float(scores[best])
+            self.best_weights = array_to_weights(weights[best])
+            self._best = weights[best]
+        return scores
+
+    def _candidates(self, values):
+        """
+        Copies of the best weights with the searched weights replaced by the given values.
+        """
+        candidates = np.repeat(self._best[None], len(values), axis=0)
+        candidates[:, self.active] = values
+        return candidates
+
+    def random_search(self, n_candidates, seed=2022):
+        """
+        Score weights drawn uniformly between the bounds of each weight.
+
+        Parameters
+        ----------
+        n_candidates : int
+            The number of weights to score.
+
+        seed : int, default 2022
+            The seed of the random weights.
+        """
+        rng = np.random.default_rng(seed)
+        bounds = BOUNDS[self.active]
+        self.score(self._candidates(rng.uniform(bounds[:, 0], bounds[:, 1], (n_candidates, len(self.active)))))
+
+    def grid_search(self, levels=3):
+        """
+        Score all the combinations of evenly spaced values of each weight.
+
+        Parameters
+        ----------
+        levels : int, default 3
+            The number of values of each weight, including its bounds. There are ``levels ** n`` combinations for
+            ``n`` searched weights.
+        """
+        axes = [np.linspace(low, high, levels) for low, high in BOUNDS[self.active]]
+        for chunk in _batched(itertools.product(*axes), 64 * self.chunk_size):
+            self.score(self._candidates(np.array(chunk)))
+
+    def coordinate_search(self, steps=21, rounds=10):
+        """
+        Improve the best weights one weight at a time.
+
+        Each round scores, for every searched weight, evenly spaced values between its bounds while keeping the other
+        weights, and keeps the best value before moving to the next weight. It stops after a round without
+        improvement.
+
+        Parameters
+        ----------
+        steps : int, default 21
+            The number of values of each weight scored in a round.
+
+        rounds : int, default 10
+            The maximum number of rounds.
+        """
+        for _ in range(rounds):
+            start_score = self.best_score
+            for i, term in enumerate(self.active):
+                values = np.repeat(self._best[self.active][None], steps, axis=0)
+                values[:, i] = np.linspace(*BOUNDS[term], steps)
+                self.score(self._candidates(values))
+            if self.best_score <= start_score:
+                return
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,665 @@
+import sys
+from array import array
+
+import numpy as np
+
+VALUE_TYPES = ("drink_types", "glass_types", "ingredients", "alc_types", "taste_types", "garnish_types")
+COUNTERS = ("UaS", "UaF", "success_count", "failure_count")
+SIMILARITY_TERMS = (
+    "ingr_match",
+    "ingr_alc_type_match",
+    "ingr_basic_taste_match",
+    "alc_type_match",
+    "basic_taste_match",
+    "glass_type_match",
+    "exc_ingr_match",
+    "exc_ingr_alc_type_match",
+    "exc_ingr_basic_taste_match",
+    "exc_alc_type",
+    "exc_basic_taste",
+)
+
+
+def compute_utility(UaS, UaF, success_count, failure_count):
+    """
+    Utility of cases from their evaluation counters. It works on single values and on arrays.
+    """
+    return ((UaS / (success_count + 1e-5)) - (UaF / (failure_count + 1e-5)) + 1) / 2
+
+
+class Vocabulary:
+    """
+    Maps each distinct value of the case library to a small integer id.
+
+    There is one id space for each type of value (the keys of :attr:`CaseLibrary.value_counter`). The empty string
+    always has the id 0, so empty attributes are encoded like any other value. Ids are never reused, so they stay valid
+    when the values disappear from the case library.
+
+    Attributes
+    ----------
+    values : dict of list of str
+        The interned values of each type, indexed by their id.
+
+    See Also
+    --------
+    CaseStore : Compact integer encoding of the cases of a case library.
+    """
+
+    def __init__(self):
+        self.values = {value_type: [""] for value_type in VALUE_TYPES}
+        self._ids = {value_type: {"": 0} for value_type in VALUE_TYPES}
+
+    def add(self, value_type, value):
+        """
+        Get the id of a value, adding it to the vocabulary if it is new.
+
+        Parameters
+        ----------
+        value_type : str
+            The type of the value, e.g. "ingredients".
+
+        value : str
+            The value.
+
+        Returns
+        -------
+        id : int
+            The id of the value.
+        """
+        ids = self._ids[value_type]
+        value_id = ids.get(value)
+        if value_id is None:
+            value = sys.intern(str(value))
+            value_id = len(self.values[value_type])
+            ids[value] = value_id
+            self.values[value_type].append(value)
+        return value_id
+
+    def id(self, value_type, value):
+        """
+        Get the id of a value.
+
+        Parameters
+        ----------
+        value_type : str
+            The type of the value, e.g. "ingredients".
+
+        value : str or None
+            The value.
+
+        Returns
+        -------
+        id : int
+            The id of the value, or -1 if the value is not in the vocabulary.
+        """
+        if value is None:
+            return -1
+        return self._ids[value_type].get(str(value), -1)
+
+    def value(self, value_type, value_id):
+        """
+        Get the value of an id.
+        """
+        return self.values[value_type][value_id]
+
+    def size(self, value_type):
+        """
+        Get the number of values of a type, including the empty string.
+        """
+        return len(self.values[value_type])
+
+    def encode_query(self, query, ingredients_onto):
+        """
+        Translate a query into ids.
+
+        Parameters
+        ----------
+        query : :class:`entity.query.Query`
+            User query with recipe requirements.
+
+        ingredients_onto : dict
+            Ontology of ingredients of the case library.
+
+        Returns
+        -------
+        encoded_query : EncodedQuery
+            The query encoded with the ids of this vocabulary.
+        """
+        return EncodedQuery(
+            category=self.id("drink_types", query.category),
+            ingredients=[self._encode_ingredient(ingredient, ingredients_onto) for ingredient in query.ingredients],
+            alc_types=[self.id("alc_types", alc_type) for alc_type in query.alc_types],
+            basic_tastes=[self.id("taste_types", basic_taste) for basic_taste in query.basic_tastes],
+            glass=self.id("glass_types", query.glass),
+            exc_ingredients=[
+                self._encode_ingredient(ingredient, ingredients_onto) for ingredient in query.exc_ingredients
+            ],
+            exc_alc_types=[self.id("alc_types", alc_type) for alc_type in query.exc_alc_types],
+        )
+
+    def _encode_ingredient(self, ingredient, ingredients_onto):
+        ingredient = str(ingredient)
+        return (
+            self.id("ingredients", ingredient),
+            self.id("alc_types", ingredients_onto["alcoholic"].get(ingredient, None)),
+            self.id("taste_types", ingredients_onto["non-alcoholic"].get(ingredient, None)),
+        )
+
+
+class EncodedQuery:
+    """
+    A query translated into the ids of a :class:`Vocabulary`. Values that are not in the vocabulary have the id -1.
+
+    Attributes
+    ----------
+    category : int
+        Category of the recipe.
+
+    ingredients : list of tuple of int
+        The (ingredient, alcohol type, basic taste) ids of each ingredient to include.
+
+    alc_types : list of int
+        Alcohol types to include.
+
+    basic_tastes : list of int
+        Basic tastes to include.
+
+    glass : int
+        Glass to serve the recipe in.
+
+    exc_ingredients : list of tuple of int
+        The (ingredient, alcohol type, basic taste) ids of each ingredient to exclude.
+
+    exc_alc_types : list of int
+        Alcohol types to exclude.
+    """
+
+    __slots__ = ("category", "ingredients", "alc_types", "basic_tastes", "glass", "exc_ingredients", "exc_alc_types")
+
+    def __init__(self, category, ingredients, alc_types, basic_tastes, glass, exc_ingredients, exc_alc_types):
+        self.category = category
+        self.ingredients = ingredients
+        self.alc_types = alc_types
+        self.basic_tastes = basic_tastes
+        self.glass = glass
+        self.exc_ingredients = exc_ingredients
+        self.exc_alc_types = exc_alc_types
+
+
+class CaseArrays:
+    """
+    Vectorized search over the integer columns of the cases of a case library.
+
+    Subclasses provide the ``category``, ``glass``, ``utility``, ``alive``, ``ingredients``, ``alc_types``,
+    ``basic_tastes`` and ``entry_rows`` columns described in :class:`CaseStore`, as arrays or buffers.
+    """
+
+    def matches(self, query):
+        """
+        Vectorized equivalent of searching the case library with ``ConstraintsBuilder().from_query(query)``.
+
+        Parameters
+        ----------
+        query : EncodedQuery
+            The query encoded with the vocabulary of the store.
+
+        Returns
+        -------
+        matches : numpy.ndarray of bool
+            Whether each row is alive and matches the query.
+        """
+        mask = np.frombuffer(self.alive, dtype=np.uint8) == 1
+        # An empty category or glass has the id 0 and does not constrain the cases
+        if query.category != 0:
+            mask &= np.frombuffer(self.category, dtype=np.uint16) == query.category
+        if query.glass != 0:
+            mask &= np.frombuffer(self.glass, dtype=np.uint16) == query.glass
+        # All the alcohol types (basic tastes) must be the one of a single ingredient
+        for values, value_ids in ((self.alc_types, query.alc_types), (self.basic_tastes, query.basic_tastes)):
+            value_ids = set(value_ids)
+            if len(value_ids) > 1:
+                mask[:] = False
+            elif value_ids:
+                mask &= self._has(values, value_ids.pop())
+        for ingredient, _, _ in query.ingredients:
+            mask &= self._has(self.ingredients, ingredient)
+        # An excluded ingredient only requires the case to have some other ingredient
+        for ingredient, _, _ in query.exc_ingredients:
+            mask &= self._has_other(ingredient)
+        return mask
+
+    def batch(self, queries):
+        """
+        View of the arrays for a batch of queries, which finds the rows with each value of the queries in a single pass
+        over the ingredients of the cases, instead of one pass for every value of every query.
+
+        Parameters
+        ----------
+        queries : list of EncodedQuery
+            The queries of the batch. Their relaxations only have values of the queries, so they can be searched with
+            the view too.
+
+        Returns
+        -------
+        arrays : CaseArrays
+            The view, with the same :meth:`CaseArrays.matches` and :meth:`CaseArrays.similarity`. It is only valid
+            until a case is added to the arrays.
+        """
+        return BatchArrays(self, queries)
+
+    def _has(self, values, value_id):
+        """
+        Boolean array telling which rows have an ingredient with the given id.
+        """
+        has = np.zeros(len(self.alive), dtype=bool)
+        if value_id >= 0:
+            has[
+                np.frombuffer(self.entry_rows, dtype=np.uint32)[np.frombuffer(values, dtype=np.uint16) == value_id]
+            ] = True
+        return has
+
+    def _has_other(self, ingredient):
+        """
+        Boolean array telling which rows have an ingredient with an id other than the given one.
+        """
+        entry_rows = np.frombuffer(self.entry_rows, dtype=np.uint32)
+        ingredients = np.frombuffer(self.ingredients, dtype=np.uint16)
+        return np.bincount(entry_rows[ingredients != ingredient], minlength=len(self.alive)) > 0
+
+    def similarity(self, query, weights, rows):
+        """
+        Vectorized similarity between a query and the cases of the given rows.
+
+        It computes the same similarity as :meth:`CBR._similarity_cocktail` for all the rows at once, comparing ids
+        instead of strings.
+
+        Parameters
+        ----------
+        query : EncodedQuery
+            The query encoded with the vocabulary of the store.
+
+        weights : dict
+            The similarity weights, as in :attr:`CBR.sim_weights`.
+
+        rows : numpy.ndarray of int
+            The rows to compute the similarity for.
+
+        Returns
+        -------
+        similarity : numpy.ndarray of float
+            The normalized similarity of each row weighted by its utility.
+        """
+        sim = np.zeros(len(rows))
+        cumulative_norm_score = 0
+
+        for ingredient, alc_type, basic_taste in query.ingredients:
+            sim += np.where(
+                self._has(self.ingredients, ingredient)[rows],
+                weights["ingr_match"],
+                np.where(
+                    self._has(self.alc_types, alc_type)[rows],
+                    weights["ingr_alc_type_match"],
+                    np.where(self._has(self.basic_tastes, basic_taste)[rows], weights["ingr_basic_taste_match"], 0),
+                ),
+            )
+            cumulative_norm_score += weights["ingr_match"]
+
+        for alc_type in query.alc_types:
+            sim += np.where(self._has(self.alc_types, alc_type)[rows], weights["alc_type_match"], 0)
+            cumulative_norm_score += weights["alc_type_match"]
+
+        for basic_taste in query.basic_tastes:
+            sim += np.where(self._has(self.basic_tastes, basic_taste)[rows], weights["basic_taste_match"], 0)
+            cumulative_norm_score += weights["basic_taste_match"]
+
+        glass = np.frombuffer(self.glass, dtype=np.uint16)[rows]
+        sim += np.where(glass == query.glass, weights["glass_type_match"], 0)
+        cumulative_norm_score += weights["glass_type_match"]
+
+        for ingredient, alc_type, basic_taste in query.exc_ingredients:
+            sim += np.where(
+                self._has(self.ingredients, ingredient)[rows],
+                weights["exc_ingr_match"],
+                np.where(
+                    self._has(self.alc_types, alc_type)[rows],
+                    weights["exc_ingr_alc_type_match"],
+                    np.where(self._has(self.basic_tastes, basic_taste)[rows], weights["exc_ingr_basic_taste_match"], 0),
+                ),
+            )
+            cumulative_norm_score += weights["ingr_match"]
+
+        for alc_type in query.exc_alc_types:
+            sim += np.where(self._has(self.alc_types, alc_type)[rows], weights["exc_alc_type"], 0)
+            cumulative_norm_score += weights["ingr_match"]
+
+        if cumulative_norm_score == 0:
+            normalized_sim = np.ones(len(rows))
+        else:
+            normalized_sim = sim / cumulative_norm_score
+
+        return normalized_sim * np.frombuffer(self.utility, dtype=np.float64)[rows]
+
+    def match_counts(self, query, rows):
+        """
+        Count how many times each term of the similarity is matched by the cases of the given rows.
+
+        For any weights ``w``, given as an array in the order of :data:`SIMILARITY_TERMS`, :meth:`CaseArrays.similarity`
+        is ``counts @ w / (norm @ w)`` times the utility of the rows, or just the utility if ``norm @ w`` is 0.
+
+        Parameters
+        ----------
+        query : EncodedQuery
+            The query encoded with the vocabulary of the store.
+
+        rows : numpy.ndarray of int
+            The rows to count the matches for.
+
+        Returns
+        -------
+        counts : numpy.ndarray of float
+            The number of matches of each term, with one row for each of the given rows.
+
+        norm : numpy.ndarray of float
+            The number of times each weight is added to the normalization of the similarity.
+        """
+        counts = np.zeros((len(rows), len(SIMILARITY_TERMS)))
+        norm = np.zeros(len(SIMILARITY_TERMS))
+        for column, ingredients in ((0, query.ingredients), (6, query.exc_ingredients)):
+            for ingredient, alc_type, basic_taste in ingredients:
+                has_ingredient = self._has(self.ingredients, ingredient)[rows]
+                has_alc_type = ~has_ingredient & self._has(self.alc_types, alc_type)[rows]
+                has_basic_taste = ~has_ingredient & ~has_alc_type & self._has(self.basic_tastes, basic_taste)[rows]
+                counts[:, column] += has_ingredient
+                counts[:, column + 1] += has_alc_type
+                counts[:, column + 2] += has_basic_taste
+                norm[0] += 1
+        for alc_type in query.alc_types:
+            counts[:, 3] += self._has(self.alc_types, alc_type)[rows]
+            norm[3] += 1
+        for basic_taste in query.basic_tastes:
+            counts[:, 4] += self._has(self.basic_tastes, basic_taste)[rows]
+            norm[4] += 1
+        counts[:, 5] = np.frombuffer(self.glass, dtype=np.uint16)[rows] == query.glass
+        norm[5] += 1
+        for alc_type in query.exc_alc_types:
+            counts[:, 9] += self._has(self.alc_types, alc_type)[rows]
+            norm[0] += 1
+        return counts, norm
+
+
+class BatchArrays(CaseArrays):
+    """
+    Columns of a case store with the number of ingredients of each row having each value of a batch of queries, see
+    :meth:`CaseArrays.batch`.
+
+    Parameters
+    ----------
+    arrays : CaseArrays
+        The columns of the cases. They are not copied.
+
+    queries : list of EncodedQuery
+        The queries of the batch.
+    """
+
+    def __init__(self, arrays, queries):
+        for name in ("category", "glass", "utility", "alive", "ingredients", "alc_types", "basic_tastes", "entry_rows"):
+            setattr(self, name, getattr(arrays, name))
+        value_ids = dict(ingredients=set(), alc_types=set(), basic_tastes=set())
+        for query in queries:
+            for ingredient, alc_type, basic_taste in query.ingredients + query.exc_ingredients:
+                value_ids["ingredients"].add(ingredient)
+                value_ids["alc_types"].add(alc_type)
+                value_ids["basic_tastes"].add(basic_taste)
+            value_ids["alc_types"].update(query.alc_types + query.exc_alc_types)
+            value_ids["basic_tastes"].update(query.basic_tastes)
+        entry_rows = np.frombuffer(self.entry_rows, dtype=np.uint32)
+        self._lengths = np.bincount(entry_rows, minlength=len(self.alive))
+        self._counts = dict()
+        for name, ids in value_ids.items():
+            ids = np.array(sorted(value_id for value_id in ids if value_id >= 0), dtype=np.int64)
+            values = np.frombuffer(getattr(self, name), dtype=np.uint16)
+            positions = np.searchsorted(ids, values)
+            found = positions < len(ids)
+            found[found] = ids[positions[found]] == values[found]
+            counts = np.zeros((len(self.alive), len(ids)), dtype=np.uint16)
+            np.add.at(counts, (entry_rows[found], positions[found]), 1)
+            self._counts[name] = (ids, counts)
+
+    def _column(self, values, value_id):
+        name = (
+            "ingredients" if values is self.ingredients else "alc_types" if values is self.alc_types else "basic_tastes"
+        )
+        ids, counts = self._counts[name]
+        i = np.searchsorted(ids, value_id)
+        if i == len(ids) or ids[i] != value_id:
+            return None
+        return counts[:, i]
+
+    def _has(self, values, value_id):
+        counts = self._column(values, value_id)
+        if counts is None:
+            # A value that is not in the batch
+            return super()._has(values, value_id)
+        return counts > 0
+
+    def _has_other(self, ingredient):
+        counts = self._column(self.ingredients, ingredient)
+        if counts is None:
+            return super()._has_other(ingredient)
+        return self._lengths > counts
+
+
+class CaseStore(CaseArrays):
+    """
+    Compact integer encoding of the cases of a case library.
+
+    Each case is a row. The ingredients of all the cases are stored one after the other in flat arrays of ids, and
+    ``offsets[row]:offsets[row + 1]`` are the ingredients of a row. Removed cases keep their row, marked as not alive.
+
+    Parameters
+    ----------
+    vocabulary : Vocabulary
+        The vocabulary used to encode the cases.
+
+    Attributes
+    ----------
+    cases : list of :class:`lxml.objectify.ObjectifiedElement`
+        The cocktail element of each row, or None if it was removed.
+
+    category, glass : array of int
+        The category and glass ids of each row.
+
+    utility : array of float
+        The utility of each row.
+
+    alive : array of int
+        1 if the case of the row is in the case library, 0 otherwise.
+
+    offsets : array of int
+        Start of the ingredients of each row in the ingredient arrays.
+
+    ingredients, alc_types, basic_tastes, garnish_types : array of int
+        The ids of each ingredient of the cases.
+
+    entry_rows : array of int
+        The row of each ingredient.
+
+    names, derivation, evaluation : list of str
+        The name, derivation and evaluation of each row.
+
+    preparation : list of tuple of str
+        The preparation steps of each row.
+
+    UaS, UaF, success_count, failure_count : array of int
+        The evaluation counters of each row. They, and the utility, are the up to date values: the elements of the
+        cases are only updated by :meth:`CaseLibrary.sync_counters`.
+
+    dirty : array of int
+        1 if the counters or the utility of the row changed since they were written to its element, 0 otherwise.
+
+    entry_ids, measures, units : list of str
+        The id, measure and unit of each ingredient of the cases.
+
+    quantities : array of float
+        The quantity of each ingredient of the cases.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.cases = []
+        self._rows = dict()
+        self.category = array("H")
+        self.glass = array("H")
+        self.utility = array("d")
+        self.alive = array("B")
+        self.offsets = array("I", [0])
+        self.ingredients = array("H")
+        self.alc_types = array("H")
+        self.basic_tastes = array("H")
+        self.garnish_types = array("H")
+        self.entry_rows = array("I")
+        self.names = []
+        self.derivation = []
+        self.evaluation = []
+        self.preparation = []
+        self.UaS = array("I")
+        self.UaF = array("I")
+        self.success_count = array("I")
+        self.failure_count = array("I")
+        self.dirty = array("B")
+        self.entry_ids = []
+        self.measures = []
+        self.quantities = array("d")
+        self.units = []
+
+    def __len__(self):
+        return len(self.cases)
+
+    def add(self, cocktail):
+        """
+        Encode a cocktail as a new row.
+
+        Parameters
+        ----------
+        cocktail : :class:`lxml.objectify.ObjectifiedElement`
+            The cocktail to add.
+
+        Returns
+        -------
+        row : int
+            The row of the cocktail.
+        """
+        row = self._rows.get(cocktail)
+        if row is not None:
+            return row
+        row = len(self.cases)
+        vocabulary = self.vocabulary
+        self.cases.append(cocktail)
+        self._rows[cocktail] = row
+        self.category.append(vocabulary.add("drink_types", cocktail.findtext("category")))
+        self.glass.append(vocabulary.add("glass_types", cocktail.findtext("glass")))
+        self.utility.append(float(cocktail.findtext("utility")))
+        self.alive.append(1)
+        self.names.append(cocktail.findtext("name"))
+        self.derivation.append(sys.intern(cocktail.findtext("derivation")))
+        self.evaluation.append(sys.intern(cocktail.findtext("evaluation")))
+        self.preparation.append(tuple(step.text for step in cocktail.find("preparation").iterchildren()))
+        for counter in COUNTERS:
+            getattr(self, counter).append(int(cocktail.findtext(counter)))
+        self.dirty.append(0)
+        for ingredient in cocktail.find("ingredients").iterchildren():
+            self.ingredients.append(vocabulary.add("ingredients", ingredient.text))
+            self.alc_types.append(vocabulary.add("alc_types", ingredient.attrib["alc_type"]))
+            self.basic_tastes.append(vocabulary.add("taste_types", ingredient.attrib["basic_taste"]))
+            self.garnish_types.append(vocabulary.add("garnish_types", ingredient.attrib["garnish_type"]))
+            self.entry_rows.append(row)
+            self.entry_ids.append(sys.intern(ingredient.attrib["id"]))
+            self.measures.append(sys.intern(ingredient.attrib["measure"]))
+            self.quantities.append(float(ingredient.attrib["quantity"]))
+            self.units.append(sys.intern(ingredient.attrib["unit"]))
+        self.offsets.append(len(self.ingredients))
+        return row
+
+    def remove(self, cocktail):
+        """
+        Mark the row of a cocktail as removed.
+        """
+        row = self._rows.pop(cocktail, None)
+        if row is not None:
+            self.alive[row] = 0
+            self.cases[row] = None
+
+    def row(self, cocktail):
+        """
+        Get the row of a cocktail, or None if it is not in the store.
+        """
+        return self._rows.get(cocktail)
+
+    def rows(self, cocktails):
+        """
+        Get the rows of a list of cocktails, adding the ones that are not in the store yet.
+
+        Returns
+        -------
+        rows : numpy.ndarray of int
+            The row of each cocktail.
+        """
+        return np.fromiter((self.add(cocktail) for cocktail in cocktails), dtype=np.intp, count=len(cocktails))
+
+    def find_rows(self, cocktails):
+        """
+        Get the rows of a list of cocktails without adding the ones that are not in the store, e.g. removed cases.
+
+        Returns
+        -------
+        rows : numpy.ndarray of int
+            The row of each cocktail, or -1 if it is not in the store.
+        """
+        rows = self._rows
+        return np.fromiter((rows.get(cocktail, -1) for cocktail in cocktails), dtype=np.intp, count=len(cocktails))
+
+    def record_feedback(self, retrieved_rows, similar_rows, success):
+        """
+        Vectorized update of the evaluation counters and utility for a batch of evaluations.
+
+        The retrieved case of a successful evaluation counts a success and a use as a success, and its similar cases
+        count a success. Failures are counted the same way. The utility of the updated rows is then recomputed once.
+
+        Parameters
+        ----------
+        retrieved_rows : numpy.ndarray of int
+            The row of the retrieved case of each evaluation, or -1 if it is not in the store.
+
+        similar_rows : list of numpy.ndarray of int
+            The rows of the similar cases of each evaluation. The negative rows are skipped.
+
+        success : numpy.ndarray of bool
+            Whether each evaluation was a success.
+
+        Returns
+        -------
+        rows : numpy.ndarray of int
+            The updated rows.
+        """
+        empty = np.zeros(0, dtype=np.intp)
+        similar_success = np.concatenate([empty] + [rows[rows >= 0] for rows, ok in zip(similar_rows, success) if ok])
+        similar_failure = np.concatenate(
+            [empty] + [rows[rows >= 0] for rows, ok in zip(similar_rows, success) if not ok]
+        )
+        # The evaluations of a case removed since it was retrieved only update its similar cases
+        found = retrieved_rows >= 0
+        retrieved_rows, success = retrieved_rows[found], success[found]
+        UaS = np.frombuffer(self.UaS, dtype=np.uint32)
+        UaF = np.frombuffer(self.UaF, dtype=np.uint32)
+        success_count = np.frombuffer(self.success_count, dtype=np.uint32)
+        failure_count = np.frombuffer(self.failure_count, dtype=np.uint32)
+        np.add.at(UaS, retrieved_rows[success], 1)
+        np.add.at(UaF, retrieved_rows[~success], 1)
+        np.add.at(success_count, np.concatenate((retrieved_rows[success], similar_success)), 1)
+        np.add.at(failure_count, np.concatenate((retrieved_rows[~success], similar_failure)), 1)
+        rows = np.unique(np.concatenate((retrieved_rows, similar_success, similar_failure)))
+        np.frombuffer(self.utility, dtype=np.float64)[rows] = compute_utility(
+            UaS[rows], UaF[rows], success_count[rows], failure_count[rows]
+        )
+        np.frombuffer(self.dirty, dtype=np.uint8)[rows] = 1
+        return rows
@@ -0,0 +1,438 @@
+import gc
+import multiprocessing
+import pickle
+import queue
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import RELAXATION_LEVEL, _relax_query
+from src.cbr.vocabulary import VALUE_TYPES, CaseArrays, CaseStore, Vocabulary
+from src.entity.query import Query
+
+COLUMNS = (
+    ("category", np.uint16),
+    ("glass", np.uint16),
+    ("utility", np.float64),
+    ("alive", np.uint8),
+    ("offsets", np.uint32),
+    ("ingredients", np.uint16),
+    ("alc_types", np.uint16),
+    ("basic_tastes", np.uint16),
+    ("garnish_types", np.uint16),
+    ("entry_rows", np.uint32),
+)
+HEADER_SIZE = 8
+
+
+class BrokenWorkerPool(RuntimeError):
+    """
+    Raised when a worker of a :class:`WorkerPool` died or did not answer in time.
+    """
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def _plain_query(query):
+    """
+    Copy of a query with only str values, so it can be sent to the workers.
+    """
+    return Query(
+        str(query.category),
+        str(query.glass),
+        [str(value) for value in query.ingredients],
+        [str(value) for value in query.exc_ingredients],
+        [str(value) for value in query.alc_types],
+        [str(value) for value in query.exc_alc_types],
+        [str(value) for value in query.basic_tastes],
+    )
+
+
+class SharedCaseStore(CaseArrays):
+    """
+    Read-only view of the integer columns of a case store in shared memory.
+
+    The block starts with the size of a pickled header, followed by the header and the columns. The header has the
+    version, the layout of the columns, the values of the vocabulary and the ontology of ingredients. Attaching to a
+    block does not copy the columns.
+
+    Parameters
+    ----------
+    shm : :class:`multiprocessing.shared_memory.SharedMemory`
+        The shared memory block.
+
+    Attributes
+    ----------
+    version : int
+        The version of the case library published in the block.
+
+    vocabulary : :class:`cbr.vocabulary.Vocabulary`
+        The vocabulary of the case store.
+
+    ingredients_onto : dict
+        Ontology of ingredients of the case library.
+
+    See Also
+    --------
+    SharedCaseStore.publish : Copy a case store to a new shared memory block.
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        header_size = int.from_bytes(bytes(shm.buf[:HEADER_SIZE]), "little")
+        header = pickle.loads(bytes(shm.buf[HEADER_SIZE : HEADER_SIZE + header_size]))
+        start = _align(HEADER_SIZE + header_size)
+        self.version = header["version"]
+        self.ingredients_onto = header["ingredients_onto"]
+        self.vocabulary = Vocabulary()
+        for value_type in VALUE_TYPES:
+            for value in header["values"][value_type][1:]:
+                self.vocabulary.add(value_type, value)
+        for name, dtype, offset, length in header["layout"]:
+            setattr(self, name, np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start + offset))
+
+    @classmethod
+    def publish(cls, case_store, ingredients_onto, version):
+        """
+        Copy the integer columns of a case store to a new shared memory block.
+
+        Parameters
+        ----------
+        case_store : :class:`cbr.vocabulary.CaseStore`
+            The case store to publish.
+
+        ingredients_onto : dict
+            Ontology of ingredients of the case library.
+
+        version : int
+            The version of the case library.
+
+        Returns
+        -------
+        store : SharedCaseStore
+            The store of the new block. The caller owns the block and must unlink it.
+        """
+        columns = [(name, np.frombuffer(getattr(case_store, name), dtype=dtype)) for name, dtype in COLUMNS]
+        layout = []
+        size = 0
+        for name, column in columns:
+            layout.append((name, column.dtype, size, len(column)))
+            size = _align(size + column.nbytes)
+        header = pickle.dumps(
+            dict(version=version, layout=layout, values=case_store.vocabulary.values, ingredients_onto=ingredients_onto)
+        )
+        start = _align(HEADER_SIZE + len(header))
+        shm = shared_memory.SharedMemory(create=True, size=max(start + size, 1))
+        shm.buf[:HEADER_SIZE] = len(header).to_bytes(HEADER_SIZE, "little")
+        shm.buf[HEADER_SIZE : HEADER_SIZE + len(header)] = header
+        for (name, dtype, offset, length), (_, column) in zip(layout, columns):
+            np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start + offset)[:] = column
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to the shared memory block of a published case store.
+
+        Parameters
+        ----------
+        name : str
+            The name of the block.
+
+        Returns
+        -------
+        store : SharedCaseStore
+            The store of the block.
+        """
+        return cls(shared_memory.SharedMemory(name))
+
+    def close(self):
+        """
+        Release the views of the columns and detach from the block.
+        """
+        for name, _ in COLUMNS:
+            setattr(self, name, None)
+        self.shm.close()
+
+    def retrieve(self, query, weights):
+        """
+        Search the candidate cases for a query and compute their similarity.
+
+        It gives the same candidates, in the same order, and the same similarity as :meth:`CBR.retrieve` on the
+        published case library.
+
+        Parameters
+        ----------
+        query : :class:`entity.query.Query`
+            User query with recipe requirements.
+
+        weights : dict
+            The similarity weights, as in :attr:`CBR.sim_weights`.
+
+        Returns
+        -------
+        rows : numpy.ndarray of int
+            The rows of the candidate cases.
+
+        sim_list : numpy.ndarray of float
+            The similarity of each candidate case.
+
+        counter : int
+            The number of times the query was relaxed.
+        """
+        encode = self.vocabulary.encode_query
+        rows = [np.flatnonzero(self.matches(encode(query, self.ingredients_onto)))]
+
+        # Relax the query progressively until having at least 5 cases, like CBR.retrieve
+        counter = 0
+        soft_query = Query(**vars(query))
+        while sum(map(len, rows)) < 5:
+            _relax_query(soft_query, counter)
+            rows.append(np.flatnonzero(self.matches(encode(soft_query, self.ingredients_onto))))
+            counter += 1
+        rows = np.concatenate(rows)
+        return rows, self.similarity(encode(query, self.ingredients_onto), weights, rows), counter
+
+
+def _worker(tasks, results):
+    store = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, name, query, weights = task
+        try:
+            if store is None or store.shm.name != name:
+                if store is not None:
+                    store.close()
+                store = SharedCaseStore.attach(name)
+            results.put((task_id, store.retrieve(query, weights)))
+        except Exception as e:
+            results.put((task_id, e))
+    if store is not None:
+        store.close()
+
+
+class WorkerPool:
+    """
+    Pool of retrieval worker processes sharing one copy of the case library.
+
+    The pool is owned by a single coordinator process, which holds the case library and applies all the learn and forget
+    updates. The coordinator publishes the integer columns of the cases to shared memory, and the workers attach to it
+    without copying it, so the memory used by the cases does not grow with the number of workers. The pool is
+    registered as an index of the case library: whenever cases were added or removed, a new version is published before
+    the next retrieval and the old one is released. When only the utility of the cases changed, e.g. after an
+    evaluation, it is written in place to the published version, between two retrievals.
+
+    If a worker dies or does not answer in time, :meth:`WorkerPool.map` raises :class:`BrokenWorkerPool` instead of
+    waiting forever, and the pool can not be used anymore.
+
+    Workers only search and score the candidate cases; the coordinator adapts the retrieved case, since it needs the
+    elements of the case library. The pool is not thread safe.
+
+    Parameters
+    ----------
+    case_library : :class:`cbr.case_library.CaseLibrary`
+        The case library of the coordinator.
+
+    n_workers : int or None
+        The number of workers. If None it uses one per CPU.
+
+    timeout : float, default 60
+        The seconds to wait for the results of a retrieval.
+
+    Examples
+    --------
+    >>> with WorkerPool(cbr.case_library, 4) as pool:
+    ...     candidates = pool.map(queries, cbr.sim_weights)
+    >>> retrieved_case, adapted_case = cbr.run_query(queries[0], "My cocktail", candidates[0])
+    """
+
+    def __init__(self, case_library, n_workers=None, timeout=60):
+        self.case_library = case_library
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.store = None
+        self.cases = []
+        self._version = 0
+        self._epoch = None
+        self._changed = True
+        self._broken = None
+        self._task_ids = 0
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(target=_worker, args=(self._tasks, self._results), daemon=True)
+            for _ in range(self.n_workers)
+        ]
+        # Share the resource tracker of the coordinator, so the workers do not unlink the shared memory when they exit
+        resource_tracker.ensure_running()
+        # Keep the garbage collector from touching, and so copying, the pages of the coordinator in the workers
+        gc.freeze()
+        try:
+            for worker in self._workers:
+                worker.start()
+        finally:
+            gc.unfreeze()
+        case_library.register_index(self, build=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, case):
+        """
+        Publish a new version before the next retrieval, since a case was added.
+        """
+        self._changed = True
+
+    def remove(self, case):
+        """
+        Publish a new version before the next retrieval, since a case was removed.
+        """
+        self._changed = True
+
+    def publish(self):
+        """
+        Publish the current cases of the case library as a new version.
+
+        The evaluation counters and utility recorded since the last version are written to the cases first, since the
+        published columns are encoded from them.
+        """
+        self.case_library.sync_counters()
+        case_store = CaseStore(self.case_library.vocabulary)
+        cases = self.case_library.findall(ConstraintsBuilder())
+        case_store.rows(cases)
+        self._version += 1
+        store = SharedCaseStore.publish(case_store, self.case_library.ingredients_onto, self._version)
+        # Workers attach to the new version on their next task, and keep the old block mapped until then
+        self._release()
+        self.store = store
+        self.cases = cases
+        self._epoch = self.case_library.epoch
+        self._changed = False
+
+    def _publish_utility(self):
+        """
+        Write the utility of the case store of the case library to the published version, for the cases it has.
+        """
+        case_store = self.case_library.case_store
+        rows = case_store.find_rows(self.cases)
+        found = rows >= 0
+        self.store.utility[found] = np.frombuffer(case_store.utility, dtype=np.float64)[rows[found]]
+        self._epoch = self.case_library.epoch
+
+    def map(self, queries, weights, query_cache=None):
+        """
+        Retrieve the candidate cases of several queries in parallel.
+
+        The relaxation level of each query searched by the workers is observed in the coordinator, like in
+        :meth:`CBR.retrieve`.
+
+        Parameters
+        ----------
+        queries : list of :class:`entity.query.Query`
+            User queries with recipe requirements.
+
+        weights : dict
+            The similarity weights, as in :attr:`CBR.sim_weights`.
+
+        query_cache : :class:`cbr.cache.QueryCache` or None
+            The query cache of the CBR. The queries found in it are not sent to the workers, and the results of the
+            workers are stored in it. If None every query is searched by the workers.
+
+        Returns
+        -------
+        candidates : list of tuple
+            For each query the list of candidate cocktail elements and the list of their similarity, as expected by
+            :meth:`CBR.retrieve`.
+
+        Raises
+        ------
+        BrokenWorkerPool
+            If a worker died or the results did not arrive within the timeout.
+        """
+        if self._broken is not None:
+            raise BrokenWorkerPool(self._broken)
+        case_store = self.case_library.case_store
+        candidates = [None] * len(queries)
+        keys = [None] * len(queries)
+        if query_cache is not None:
+            for i, query in enumerate(queries):
+                keys[i] = (query.freeze(), tuple(weights.items()))
+                found = query_cache.get(keys[i], self.case_library.epoch)
+                if found is not None:
+                    rows, scores = found
+                    candidates[i] = ([case_store.cases[row] for row in rows], scores.tolist())
+        indices = [i for i in range(len(queries)) if candidates[i] is None]
+        if not indices:
+            return candidates
+
+        if self._changed or self.store is None:
+            self.publish()
+        elif self._epoch != self.case_library.epoch:
+            self._publish_utility()
+        first = self._task_ids
+        self._task_ids += len(indices)
+        for task, i in enumerate(indices):
+            self._tasks.put((first + task, self.store.shm.name, _plain_query(queries[i]), dict(weights)))
+        results = dict()
+        deadline = time.monotonic() + self.timeout
+        while len(results) < len(indices):
+            try:
+                task_id, result = self._results.get(timeout=min(1.0, self.timeout))
+            except queue.Empty:
+                dead = sum(not worker.is_alive() for worker in self._workers)
+                if dead:
+                    self._broken = f"{dead} of the {len(self._workers)} workers died."
+                elif time.monotonic() > deadline:
+                    self._broken = f"The workers did not answer in {self.timeout} seconds."
+                else:
+                    continue
+                raise BrokenWorkerPool(self._broken)
+            # Results of an earlier retrieval that failed are ignored
+            if first <= task_id < self._task_ids:
+                results[task_id - first] = result
+        for task, i in enumerate(indices):
+            if isinstance(results[task], Exception):
+                raise results[task]
+            rows, sim_list, counter = results[task]
+            RELAXATION_LEVEL.observe(counter)
+            list_recipes = [self.cases[row] for row in rows]
+            sim_list = sim_list.tolist()
+            if query_cache is not None:
+                query_cache.put(keys[i], self.case_library.epoch, case_store.rows(list_recipes), sim_list)
+            candidates[i] = (list_recipes, sim_list)
+        return candidates
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory.
+        """
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers = []
+        if self in self.case_library.indexes:
+            self.case_library.unregister_index(self)
+        self._release()
+
+    def _release(self):
+        if self.store is not None:
+            self.store.close()
+            self.store.shm.unlink()
+            self.store = None
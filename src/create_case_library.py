@@ -11,7 +11,13 @@ from pandas import DataFrame
 
 sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
 
-from definitions import CASE_BASE_FILE, CASE_LIBRARY_FILE, DATA_PATH
+from definitions import (
+    CASE_BASE_FILE,
+    CASE_LIBRARY_FILE,
+    CASE_LIBRARY_SHARDS_PATH,
+    DATA_PATH,
+)
+from src.cbr.case_library import ShardedCaseLibrary
 from src.utils.helper import powerset
 
 
@@ -160,3 +166,4 @@ if __name__ == "__main__":
     df = df.sort_values("Cocktail")
     create_case_base(df, CASE_BASE_FILE)
     create_case_library(CASE_LIBRARY_FILE)
+    ShardedCaseLibrary.from_case_library(CASE_LIBRARY_FILE, CASE_LIBRARY_SHARDS_PATH)
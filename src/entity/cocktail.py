@@ -4,6 +4,33 @@ from typing import List
 from xml.etree.ElementTree import Element
 
 
+def _format_cocktail(cocktail):
+    output = f"""{cocktail.name}
+Type of drink: {cocktail.category}
+Glass: {cocktail.glass}
+Ingredients:
+"""
+
+    max_per_line = 4
+    steps = list(cocktail.preparation)
+    for i, ingredient in enumerate(cocktail.ingredients):
+        steps = [re.sub(f"\\b{ingredient.id}\\b", str(ingredient), step) for step in steps]
+        if i == 0:
+            output += f"        {ingredient}"
+        else:
+            if i % max_per_line == 0:
+                output += f",\n        {ingredient}"
+            else:
+                output += f", {ingredient}"
+
+    output += "\nPreparation:"
+    for i, step in enumerate(steps):
+
+        output += f"\n        {i}. {step}"
+    output += "\n"
+    return output
+
+
 @dataclass
 class Ingredient:
     id: str = ""
@@ -70,30 +97,7 @@ class Cocktail:
     failure_count: int = 0
 
     def __str__(self):
-        output = f"""{self.name}
-Type of drink: {self.category}
-Glass: {self.glass}
-Ingredients:
-"""
-
-        max_per_line = 4
-        steps = self.preparation.copy()
-        for i, ingredient in enumerate(self.ingredients):
-            steps = [re.sub(f"\\b{ingredient.id}\\b", str(ingredient), step) for step in steps]
-            if i == 0:
-                output += f"        {ingredient}"
-            else:
-                if i % max_per_line == 0:
-                    output += f",\n        {ingredient}"
-                else:
-                    output += f", {ingredient}"
-
-        output += "\nPreparation:"
-        for i, step in enumerate(steps):
-
-            output += f"\n        {i}. {step}"
-        output += "\n"
-        return output
+        return _format_cocktail(self)
 
     def from_element(self, element: Element):
         self.name = element.name
@@ -116,3 +120,204 @@ Ingredients:
         self.failure_count = element.failure_count
 
         return self
+
+
+class CompactIngredient:
+    """
+    Immutable ingredient with ``__slots__`` instead of a per-instance dict.
+
+    It holds the attributes of :class:`AlcoholicIngredient`, :class:`NonAlcoholicIngredient` and
+    :class:`GarnishIngredient` at once, the ones that do not apply being empty strings.
+
+    Raises
+    ------
+    TypeError
+        If an attribute has the wrong type.
+
+    ValueError
+        If the name is empty or the quantity is negative.
+    """
+
+    __slots__ = ("id", "name", "measure", "quantity", "unit", "alc_type", "basic_taste", "garnish_type")
+
+    def __init__(self, id, name, measure="", quantity=0.0, unit="", alc_type="", basic_taste="", garnish_type=""):
+        for attr, value in (
+            ("id", id),
+            ("name", name),
+            ("measure", measure),
+            ("unit", unit),
+            ("alc_type", alc_type),
+            ("basic_taste", basic_taste),
+            ("garnish_type", garnish_type),
+        ):
+            if not isinstance(value, str):
+                raise TypeError(f"{attr} must be str, not {type(value).__name__}.")
+            object.__setattr__(self, attr, value)
+        if not name:
+            raise ValueError("name must not be empty.")
+        quantity = float(quantity)
+        if quantity < 0:
+            raise ValueError("quantity must not be negative.")
+        object.__setattr__(self, "quantity", quantity)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{attr}={getattr(self, attr)!r}' for attr in self.__slots__)})"
+
+    __str__ = Ingredient.__str__
+
+
+class CompactCocktail:
+    """
+    Immutable cocktail with ``__slots__`` instead of a per-instance dict.
+
+    It has the same attributes and text representation as :class:`Cocktail`, with tuples instead of lists.
+
+    Raises
+    ------
+    TypeError
+        If an attribute has the wrong type.
+
+    ValueError
+        If the name is empty.
+
+    See Also
+    --------
+    CompactCocktail.from_store : Build a cocktail directly from a case store.
+    """
+
+    __slots__ = (
+        "name",
+        "category",
+        "glass",
+        "ingredients",
+        "preparation",
+        "utility",
+        "derivation",
+        "evaluation",
+        "UaS",
+        "UaF",
+        "success_count",
+        "failure_count",
+    )
+
+    def __init__(
+        self,
+        name,
+        category,
+        glass,
+        ingredients=(),
+        preparation=(),
+        utility=0.0,
+        derivation="",
+        evaluation="",
+        UaS=0,
+        UaF=0,
+        success_count=0,
+        failure_count=0,
+    ):
+        for attr, value in (
+            ("name", name),
+            ("category", category),
+            ("glass", glass),
+            ("derivation", derivation),
+            ("evaluation", evaluation),
+        ):
+            if not isinstance(value, str):
+                raise TypeError(f"{attr} must be str, not {type(value).__name__}.")
+            object.__setattr__(self, attr, value)
+        if not name:
+            raise ValueError("name must not be empty.")
+        ingredients = tuple(ingredients)
+        if not all(isinstance(ingredient, CompactIngredient) for ingredient in ingredients):
+            raise TypeError("ingredients must be CompactIngredient.")
+        object.__setattr__(self, "ingredients", ingredients)
+        object.__setattr__(self, "preparation", tuple(preparation))
+        object.__setattr__(self, "utility", float(utility))
+        for attr, value in (
+            ("UaS", UaS),
+            ("UaF", UaF),
+            ("success_count", success_count),
+            ("failure_count", failure_count),
+        ):
+            object.__setattr__(self, attr, int(value))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name!r}, category={self.category!r}, glass={self.glass!r})"
+
+    def __str__(self):
+        return _format_cocktail(self)
+
+    @classmethod
+    def from_store(cls, case_store, row):
+        """
+        Build a cocktail from a row of a case store, without accessing the cocktail element.
+
+        Parameters
+        ----------
+        case_store : :class:`cbr.vocabulary.CaseStore`
+            The case store with the cocktail.
+
+        row : int
+            The row of the cocktail.
+
+        Returns
+        -------
+        cocktail : CompactCocktail
+            The cocktail of the row.
+        """
+        values = case_store.vocabulary.values
+        ingredients = tuple(
+            CompactIngredient(
+                case_store.entry_ids[i],
+                values["ingredients"][case_store.ingredients[i]],
+                case_store.measures[i],
+                case_store.quantities[i],
+                case_store.units[i],
+                values["alc_types"][case_store.alc_types[i]],
+                values["taste_types"][case_store.basic_tastes[i]],
+                values["garnish_types"][case_store.garnish_types[i]],
+            )
+            for i in range(case_store.offsets[row], case_store.offsets[row + 1])
+        )
+        return cls(
+            case_store.names[row],
+            values["drink_types"][case_store.category[row]],
+            values["glass_types"][case_store.glass[row]],
+            ingredients,
+            case_store.preparation[row],
+            case_store.utility[row],
+            case_store.derivation[row],
+            case_store.evaluation[row],
+            case_store.UaS[row],
+            case_store.UaF[row],
+            case_store.success_count[row],
+            case_store.failure_count[row],
+        )
+
+
+def cocktail_to_dict(cocktail):
+    """
+    Convert a :class:`Cocktail` or :class:`CompactCocktail` to a dictionary that can be serialized to JSON.
+    """
+    return dict(
+        name=str(cocktail.name),
+        category=str(cocktail.category),
+        glass=str(cocktail.glass),
+        ingredients=[
+            dict(
+                name=str(ingredient.name),
+                measure=str(ingredient.measure),
+                quantity=float(ingredient.quantity),
+                unit=str(ingredient.unit),
+            )
+            for ingredient in cocktail.ingredients
+        ],
+        preparation=[str(step) for step in cocktail.preparation],
+        utility=float(cocktail.utility),
+    )
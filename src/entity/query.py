@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
 
 @dataclass
@@ -30,13 +31,13 @@ class Query:
         Basic tastes to include in the recipe.
     """
 
-    category = ""
-    glass = ""
-    ingredients = []
-    exc_ingredients = []
-    alc_types = []
-    exc_alc_types = []
-    basic_tastes = []
+    category: str = ""
+    glass: str = ""
+    ingredients: List[str] = field(default_factory=list)
+    exc_ingredients: List[str] = field(default_factory=list)
+    alc_types: List[str] = field(default_factory=list)
+    exc_alc_types: List[str] = field(default_factory=list)
+    basic_tastes: List[str] = field(default_factory=list)
 
     def set_category(self, category):
         self.category = category
@@ -80,6 +81,25 @@ class Query:
     def get_basic_tastes(self):
         return self.basic_tastes
 
+    def freeze(self):
+        """
+        Get an immutable and hashable copy of the query.
+
+        Returns
+        -------
+        query : FrozenQuery
+            The frozen query.
+        """
+        return FrozenQuery(
+            self.category,
+            self.glass,
+            self.ingredients,
+            self.exc_ingredients,
+            self.alc_types,
+            self.exc_alc_types,
+            self.basic_tastes,
+        )
+
     def __str__(self):
         return (
             f"- Type of drink: {self.get_category()}\n"
@@ -89,3 +109,104 @@ class Query:
             f"- Taste of the drink: {', '.join(map(str, self.get_basic_tastes()))}\n"
             f"- Type of alcohol: {', '.join(map(str, self.get_alc_types()))}"
         )
+
+
+class FrozenQuery:
+    """
+    Immutable and hashable user query with ``__slots__``.
+
+    The list attributes of :class:`Query` are stored as tuples of str. Two frozen queries are equal when their lists
+    have the same values the same number of times, in any order, since the order does not change the retrieval but a
+    repeated value is counted again by the similarity. The hash is computed once, so frozen queries are cheap to use as
+    dictionary keys.
+
+    Parameters
+    ----------
+    category : str
+        Category of the recipe.
+
+    glass : str
+        Glass to serve the recipe in.
+
+    ingredients, exc_ingredients, alc_types, exc_alc_types, basic_tastes : iterable of str
+        As in :class:`Query`. Ingredient elements are converted to their text.
+
+    Raises
+    ------
+    TypeError
+        If the category or the glass are not str.
+    """
+
+    __slots__ = (
+        "category",
+        "glass",
+        "ingredients",
+        "exc_ingredients",
+        "alc_types",
+        "exc_alc_types",
+        "basic_tastes",
+        "_hash",
+    )
+
+    def __init__(
+        self, category="", glass="", ingredients=(), exc_ingredients=(), alc_types=(), exc_alc_types=(), basic_tastes=()
+    ):
+        for attr, value in (("category", category), ("glass", glass)):
+            if not isinstance(value, str):
+                raise TypeError(f"{attr} must be str, not {type(value).__name__}.")
+            object.__setattr__(self, attr, value)
+        for attr, values in (
+            ("ingredients", ingredients),
+            ("exc_ingredients", exc_ingredients),
+            ("alc_types", alc_types),
+            ("exc_alc_types", exc_alc_types),
+            ("basic_tastes", basic_tastes),
+        ):
+            if isinstance(values, str):
+                raise TypeError(f"{attr} must be an iterable of str, not str.")
+            object.__setattr__(self, attr, tuple(str(value) for value in values))
+        object.__setattr__(self, "_hash", hash(self._key()))
+
+    def _key(self):
+        return (
+            self.category,
+            self.glass,
+            tuple(sorted(self.ingredients)),
+            tuple(sorted(self.exc_ingredients)),
+            tuple(sorted(self.alc_types)),
+            tuple(sorted(self.exc_alc_types)),
+            tuple(sorted(self.basic_tastes)),
+        )
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenQuery):
+            return NotImplemented
+        return self._hash == other._hash and self._key() == other._key()
+
+    def __repr__(self):
+        return f"{type(self).__name__}{tuple(getattr(self, attr) for attr in self.__slots__[:-1])!r}"
+
+    def to_query(self):
+        """
+        Get a mutable copy of the query.
+
+        Returns
+        -------
+        query : Query
+            The query.
+        """
+        return Query(
+            self.category,
+            self.glass,
+            list(self.ingredients),
+            list(self.exc_ingredients),
+            list(self.alc_types),
+            list(self.exc_alc_types),
+            list(self.basic_tastes),
+        )
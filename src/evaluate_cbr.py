@@ -0,0 +1,43 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.evaluation import MODES, leave_one_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Leave-one-out evaluation of the quality and latency of the CBR.")
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file or directory of shards")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of cases to evaluate")
+    parser.add_argument("--seed", type=int, default=2022)
+    parser.add_argument("--modes", default="cached", help=f"comma separated retrieval modes among {', '.join(MODES)}")
+    parser.add_argument("--output", default=None, help="path of the JSON report")
+    args = parser.parse_args()
+
+    reports = dict()
+    print(
+        f"{'mode':<10} {'cases':>6} {'errors':>6} {'jacc ret':>9} {'jacc adp':>9} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'q/s':>8}"
+    )
+    for mode in args.modes.split(","):
+        report = leave_one_out(args.case_library, args.workers, args.limit, args.seed, **MODES[mode])
+        latency = report["latency"]
+        print(
+            f"{mode:<10} {report['n_cases']:>6} {report['errors']:>6} {report['jaccard_retrieved']:>9.4f} "
+            f"{report['jaccard_adapted']:>9.4f} {latency['p50'] * 1000:>8.1f} {latency['p95'] * 1000:>8.1f} "
+            f"{report['throughput']:>8.1f}"
+        )
+        reports[mode] = report
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
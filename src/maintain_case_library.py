@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.cbr.learning_queue import BackgroundLearner
+from src.cbr.maintenance import maintain
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove the redundant cases of the case library and compact it to a target size."
+    )
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file or directory of shards")
+    parser.add_argument("--target-size", type=int, default=None, help="number of cases to keep")
+    parser.add_argument("--threshold", type=float, default=1.0, help="minimum similarity of a case to solve another")
+    parser.add_argument("--redundancy-threshold", type=float, default=1.0)
+    parser.add_argument("--block-size", type=int, default=256, help="number of cases compared at once")
+    parser.add_argument(
+        "--max-loss", type=float, default=0.02, help="maximum decrease of the leave-one-out score to apply the changes"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only report the cases that would be removed")
+    parser.add_argument("--report", default=None, help="path of the JSON report")
+    args = parser.parse_args()
+
+    cbr = CBR(args.case_library)
+    # Apply the evaluations left in the learning journal, so they do not refer to removed cases
+    BackgroundLearner(cbr).close()
+    report = maintain(
+        cbr.case_library,
+        cbr.sim_weights,
+        target_size=args.target_size,
+        threshold=args.threshold,
+        redundancy_threshold=args.redundancy_threshold,
+        block_size=args.block_size,
+        max_loss=args.max_loss,
+        apply=not args.dry_run,
+    )
+    print(report.summary())
+    if args.report is not None:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(vars(report), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
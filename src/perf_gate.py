@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import platform
+import sys
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE, PERF_BASELINE_FILE
+from src.cbr.benchmark import DEFAULT_TOLERANCES, compare, format_table, run_suite
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the benchmarks of the CBR and fail if a metric regressed from the baseline."
+    )
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file to benchmark")
+    parser.add_argument("--baseline", default=PERF_BASELINE_FILE, help="JSON file with the baseline results")
+    parser.add_argument("--scale", type=int, default=4, help="copies of each case of the synthetic scaled library")
+    parser.add_argument("--queries", type=int, default=50, help="number of random queries of each library")
+    parser.add_argument("--repeat", type=int, default=3, help="times the CBR is loaded and the case library written")
+    parser.add_argument("--seed", type=int, default=2022)
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="write the results as the new baseline instead of comparing"
+    )
+    parser.add_argument("--output", default=None, help="path of a JSON report with the results and the comparison")
+    args = parser.parse_args()
+
+    settings = dict(scale=args.scale, queries=args.queries, repeat=args.repeat, seed=args.seed)
+    results = run_suite(args.case_library, args.scale, args.queries, args.repeat, args.seed)
+
+    if args.update_baseline:
+        tolerances = dict(DEFAULT_TOLERANCES)
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                tolerances.update(json.load(f).get("tolerances", dict()))
+        baseline = dict(
+            settings=settings,
+            environment=dict(python=platform.python_version(), machine=platform.machine(), system=platform.system()),
+            tolerances=tolerances,
+            results=results,
+        )
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"- Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        parser.error(f"No baseline at {args.baseline}, create it with --update-baseline")
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print(f"- Warning: the baseline was measured with {baseline.get('settings')}, not {settings}", file=sys.stderr)
+    rows = compare(results, baseline["results"], baseline.get("tolerances"))
+    print(format_table(rows))
+    regressions = [row for row in rows if row["status"] in ("regression", "missing")]
+    print(f"- {len(regressions)} regressions" if regressions else "- No regressions")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(settings=settings, results=results, comparison=rows), f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.query_log import read_query_log
+from src.cbr.replay import replay
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query log and check that it gives the same results.")
+    parser.add_argument("log", help="JSONL query log, e.g. written with --query-log")
+    parser.add_argument(
+        "--case-library", default=CASE_LIBRARY_FILE, help="snapshot of the case library taken when the log started"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=0.0, help="speed relative to the logged times, by default as fast as possible"
+    )
+    parser.add_argument("--output", default=None, help="path of the JSON report")
+    args = parser.parse_args()
+
+    report = replay(read_query_log(args.log), args.case_library, args.speed)
+    latency = report["latency"]
+    print(
+        f"{report['n_queries']} queries, {report['n_evaluations']} evaluations, "
+        f"{len(report['mismatches'])} mismatches, {report['throughput']:.1f} q/s, "
+        f"p50 {latency['p50'] * 1000:.1f} ms, p95 {latency['p95'] * 1000:.1f} ms"
+    )
+    if report["mismatched_sessions"]:
+        print(f"- The case library does not match the start of the sessions {', '.join(report['mismatched_sessions'])}")
+    if report["unmatched_evaluations"]:
+        print(f"- {report['unmatched_evaluations']} evaluations of unknown queries were skipped")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report["deterministic"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,69 @@
+import argparse
+import json
 import os
-import random
-import shutil
 import sys
-import time
 from pathlib import Path
 
 sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
-sys.path.append(os.fspath(Path(__file__).resolve().parent.parent.parent))
 
-from cbr.cbr import CBR
-from definitions import CASE_LIBRARY_FILE, ROOT_PATH
-from entity.query import Query
-
-output_path = os.path.join(ROOT_PATH, "system_tests")
-os.makedirs(output_path, exist_ok=True)
-
-N_QUERIES = 300
-MAX_N_VALUES = 5
-random.seed(2022)
-
-tmp_case_library = "tmp_case_library.xml"
-shutil.copyfile(CASE_LIBRARY_FILE, tmp_case_library)
-
-cbr = CBR(tmp_case_library)
-query = Query()
-
-actions = [
-    query.set_category,
-    query.set_glass,
-    query.set_ingredients,
-    query.set_exc_ingredients,
-    query.set_basic_tastes,
-    query.set_alc_types,
-]
-
-pools = [
-    cbr.case_library.drink_types,
-    cbr.case_library.glass_types,
-    cbr.case_library.ingredients,
-    cbr.case_library.ingredients,
-    cbr.case_library.taste_types,
-    cbr.case_library.alc_types,
-]
-
-
-def fix_ingr_lists():
-    """
-    Ensures that none of ingredients to exclude in the query
-    are in the ingredients to include list.
-    """
-    match = map(lambda i: i in query.get_exc_ingredients(), query.get_ingredients())
-    if any(match):
-        idxs = [i for i, val in enumerate(match) if val]
-        exc_ingredients = query.get_exc_ingredients()
-        fail_idxs = []
-        for i in idxs:
-            j = 0
-            while True:
-                exc_ingredients[i] = random.choice(cbr.case_library.ingredients)
-                if exc_ingredients[i] not in query.get_ingredients():
-                    break
-                if j > 10:
-                    fail_idxs.append(i)
-                    break
-        for i in fail_idxs:
-            del exc_ingredients[i]
-        query.set_exc_ingredients(exc_ingredients)
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.evaluation import MODES
+from src.cbr.load_generator import QUERY_MIXES, parse_mix, run_load
+from src.utils import profiling
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the CBR with random queries.")
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file or directory of shards")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds the load is measured")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds the load runs before it is measured")
+    parser.add_argument(
+        "--rate", type=float, default=None, help="queries per second of an open loop load, by default it is closed loop"
+    )
+    parser.add_argument(
+        "--mix",
+        default="full",
+        help=f"weights of the kinds of queries among {', '.join(QUERY_MIXES)}, e.g. full=1,tastes=2",
+    )
+    parser.add_argument("--mode", default="cached", choices=list(MODES), help="retrieval mode")
+    parser.add_argument("--seed", type=int, default=2022)
+    parser.add_argument("--transcript", action="store_true", help="add the query and cases of each query to the report")
+    parser.add_argument("--output", default=None, help="path of the JSON report, by default the standard output")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure_from_args(args)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    report = run_load(
+        args.case_library,
+        args.concurrency,
+        args.duration,
+        args.warmup,
+        args.rate,
+        mix,
+        args.seed,
+        args.transcript,
+        **MODES[args.mode],
+    )
+    report["case_library"] = args.case_library
+    report["retrieval_mode"] = args.mode
+    latency = report["latency"]
+    print(
+        f"{report['n_queries']} queries, {report['n_errors']} errors, {report['throughput']:.1f} q/s, "
+        f"p50 {latency['p50'] * 1000:.1f} ms, p95 {latency['p95'] * 1000:.1f} ms, p99 {latency['p99'] * 1000:.1f} ms",
+        file=sys.stderr,
+    )
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
     else:
-        return
-
-
-def build_query():
-    for action, pool in zip(actions, pools):
-        if action == query.set_category or action == query.set_glass:
-            action(random.choice(pool))
-        else:
-            action(random.sample(pool, random.randint(0, MAX_N_VALUES)))
-    fix_ingr_lists()
-
-
-test = f"test{time.strftime('%d-%H%M%S')}.txt"
-total_time = 0
-for i in range(N_QUERIES):
-    print(i)
-    build_query()
-    name = f"MyRecipe{random.randint(0, 10000)}"
-    start = time.time()
-    retrieved_case, adapted_case = cbr.run_query(query, name)
-    cbr.evaluate(random.random() * 10)
-    total_time += time.time() - start
-
-    with open(os.path.join(output_path, test), "a", encoding="utf-8") as f:
-        f.write("--------------\n")
-        f.write(f"Query:\n{query}")
-        f.write(f"\n\nRetrieved case:\n{retrieved_case}")
-        f.write(f"\nAdapted case:\n{adapted_case}")
-        f.write("--------------\n\n")
-
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
 
-with open(os.path.join(output_path, test), "a", encoding="utf-8") as f:
-    f.write(f"\n\nTotal number of queries: {N_QUERIES}")
-    f.write(f"\nTotal time: {total_time}")
 
-os.remove(tmp_case_library)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.fspath(Path(__file__).resolve().parent.parent))
+
+from definitions import CASE_LIBRARY_FILE, SIM_WEIGHTS_FILE
+from src.cbr.cbr import CBR
+from src.cbr.tuning import TuningProblem, WeightTuner, save_weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the similarity weights of the CBR by leave-one-out retrieval.")
+    parser.add_argument("--case-library", default=CASE_LIBRARY_FILE, help="case library file or directory of shards")
+    parser.add_argument("--weights", default=None, help="JSON file with the initial weights")
+    parser.add_argument(
+        "--strategies", default="random,coordinate", help="comma separated search strategies: random, grid, coordinate"
+    )
+    parser.add_argument("--candidates", type=int, default=10000, help="number of weights of the random search")
+    parser.add_argument("--levels", type=int, default=3, help="number of values of each weight of the grid search")
+    parser.add_argument(
+        "--steps", type=int, default=21, help="number of values of each weight of the coordinate search"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=2022)
+    parser.add_argument("--output", default=SIM_WEIGHTS_FILE, help="path of the JSON file with the best weights")
+    args = parser.parse_args()
+
+    cbr = CBR(args.case_library, weights_file=args.weights)
+    start = time.perf_counter()
+    problem = TuningProblem.from_case_library(cbr.case_library, seed=args.seed)
+    print(f"- Precomputed {len(problem)} queries in {time.perf_counter() - start:.2f}s")
+    with WeightTuner(problem, cbr.sim_weights, args.workers) as tuner:
+        print(f"- Initial weights: {tuner.baseline_score:.4f}")
+        for strategy in args.strategies.split(","):
+            start = time.perf_counter()
+            if strategy == "random":
+                tuner.random_search(args.candidates, args.seed)
+            elif strategy == "grid":
+                tuner.grid_search(args.levels)
+            elif strategy == "coordinate":
+                tuner.coordinate_search(args.steps)
+            else:
+                parser.error(f"unknown strategy {strategy}")
+            print(f"- {strategy} search: {tuner.best_score:.4f} in {time.perf_counter() - start:.2f}s")
+    print(f"- Scored {tuner.n_scored} weights")
+    save_weights(
+        args.output,
+        tuner.best_weights,
+        score=tuner.best_score,
+        baseline_score=tuner.baseline_score,
+        case_library=os.path.basename(os.path.normpath(args.case_library)),
+    )
+    print(f"- Best weights written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
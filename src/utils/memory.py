@@ -0,0 +1,96 @@
+import sys
+import threading
+import types
+
+import numpy as np
+from lxml import etree
+
+# Size of the structures of libxml2 on 64-bit platforms, used to estimate the memory of an XML tree
+XML_NODE_BYTES = 120
+XML_ATTR_BYTES = 96
+MALLOC_OVERHEAD = 16
+
+# Objects that are not followed, e.g. shared by everything or owned by the interpreter
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, etree._Element)
+_LOCK_TYPES = (type(threading.Lock()), type(threading.RLock()))
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Memory used by a Python object and the objects it references.
+
+    Containers, NumPy arrays and the attributes of objects are followed. Each object is counted once, so passing the
+    same ``seen`` set to several calls does not count the objects they share twice. Classes, modules, functions and the
+    lxml elements are counted without following them, since they are shared or belong to an XML tree, see
+    :func:`tree_nbytes`.
+
+    Parameters
+    ----------
+    obj : object
+        The object.
+
+    seen : set or None
+        The ids of the objects already counted. It is updated with the counted objects.
+
+    Returns
+    -------
+    nbytes : int
+        The number of bytes.
+    """
+    if seen is None:
+        seen = set()
+    nbytes = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        nbytes += sys.getsizeof(obj)
+        if isinstance(obj, _OPAQUE) or isinstance(obj, _LOCK_TYPES):
+            continue
+        if isinstance(obj, np.ndarray):
+            if obj.base is not None:
+                stack.append(obj.base)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return nbytes
+
+
+def tree_nbytes(root):
+    """
+    Estimate the memory used by libxml2 for an XML tree.
+
+    lxml keeps the tree in C structures that the Python allocator does not see, so the memory is estimated from the
+    number of nodes and attributes and the length of their text: each element, text and attribute is a libxml2 node,
+    and each string is allocated separately.
+
+    Parameters
+    ----------
+    root : lxml.etree._Element
+        The root of the tree.
+
+    Returns
+    -------
+    nbytes : int
+        The estimated number of bytes.
+    """
+    nbytes = 0
+    for element in root.iter():
+        nbytes += XML_NODE_BYTES
+        for text in (element.text, element.tail):
+            if text:
+                nbytes += XML_NODE_BYTES + len(text.encode("utf-8")) + 1 + MALLOC_OVERHEAD
+        for key, value in element.attrib.items():
+            nbytes += XML_ATTR_BYTES + XML_NODE_BYTES + len(value.encode("utf-8")) + 1 + MALLOC_OVERHEAD
+    return nbytes
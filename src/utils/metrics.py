@@ -0,0 +1,473 @@
+import logging
+import os
+import threading
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Histogram of observed values over fixed buckets.
+
+    Parameters
+    ----------
+    buckets : sequence of float, default LATENCY_BUCKETS
+        The upper bounds of the buckets. A value falls in the first bucket with an upper bound greater or equal to it,
+        or in an overflow bucket if it is greater than all of them.
+
+    Attributes
+    ----------
+    counts : list of int
+        The number of values in each bucket, the last one being the overflow bucket.
+
+    count : int
+        The number of observed values.
+
+    sum : float
+        The sum of the observed values.
+
+    max : float
+        The greatest observed value.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Add a value to the histogram.
+        """
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile of the observed values.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns
+        -------
+        value : float
+            The upper bound of the bucket of the quantile, or the greatest observed value for the overflow bucket. It is
+            0 if there are no values.
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        Get a summary of the histogram.
+
+        Returns
+        -------
+        summary : dict
+            The count, sum, mean, maximum, 50th, 95th and 99th percentiles and cumulative bucket counts.
+        """
+        cumulative = 0
+        buckets = dict()
+        for bound, count in zip(self.buckets, list(self.counts)):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            mean=self.sum / self.count if self.count else 0.0,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p95=self.quantile(0.95),
+            p99=self.quantile(0.99),
+            buckets=buckets,
+        )
+
+
+class Counter:
+    """
+    Monotonic count of events.
+
+    Attributes
+    ----------
+    value : float
+        The count.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increase the count.
+        """
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, function):
+        """
+        Read the count from a function when the metrics are collected, e.g. a counter kept by another object. The count
+        is not reported while the function returns None.
+        """
+        self._function = function
+
+    def get(self):
+        return self._function() if self._function is not None else self.value
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, e.g. a size.
+    """
+
+    def set(self, value):
+        """
+        Set the value.
+        """
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        """
+        Decrease the value.
+        """
+        self.inc(-amount)
+
+
+class MetricFamily:
+    """
+    Metric with a value for each combination of the values of its labels.
+
+    Without labels the family has a single metric, and the methods of the metric can be called on the family.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of metric, "counter", "gauge" or "histogram".
+
+    name : str
+        The name of the metric.
+
+    help : str
+        The description of the metric.
+
+    labels : tuple of str
+        The names of the labels.
+
+    factory : callable
+        Creates the metric of each combination of labels.
+    """
+
+    def __init__(self, kind, name, help, labels, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._factory = factory
+        self._metrics = dict()
+        self._lock = threading.Lock()
+        if not self.label_names:
+            # Reported from the start, e.g. a counter at 0
+            self.labels()
+
+    def labels(self, *values, **kwargs):
+        """
+        Get the metric of some values of the labels, given in order or by name, creating it on first use.
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.label_names)
+        if len(values) != len(self.label_names):
+            raise ValueError(f"The metric {self.name} has the labels {self.label_names}, got {values}")
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            if values not in self._metrics:
+                self._metrics[values] = self._factory()
+            return self._metrics[values]
+
+    def __getattr__(self, name):
+        if name.startswith("_") or self.label_names:
+            raise AttributeError(name)
+        return getattr(self.labels(), name)
+
+    def collect(self):
+        """
+        Get the labels and metric of each combination of labels.
+        """
+        with self._lock:
+            return [(dict(zip(self.label_names, values)), metric) for values, metric in self._metrics.items()]
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class MetricsRegistry:
+    """
+    Registry of the metrics of a process, exported in the Prometheus text format.
+
+    The names of the metrics start with the name of the logger of the component, e.g. ``cbr_`` for the CBR and ``gui_``
+    for the GUI. Registering a metric twice returns the same family, so modules can declare their metrics at import.
+
+    Examples
+    --------
+    >>> registry = MetricsRegistry()
+    >>> queries = registry.counter("cbr_queries_total", "Queries run by the CBR.")
+    >>> queries.inc()
+    >>> latency = registry.histogram("cbr_step_duration_seconds", "Duration of each step.", labels=("step",))
+    >>> latency.labels("retrieve").observe(0.012)
+    >>> print(registry.to_prometheus())
+    """
+
+    def __init__(self):
+        self._families = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, kind, name, help, labels, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(kind, name, help, labels, factory)
+            elif family.kind != kind or family.label_names != tuple(labels):
+                raise ValueError(f"The metric {name} is already registered as a {family.kind}")
+            return family
+
+    def counter(self, name, help, labels=()):
+        """
+        Register a family of :class:`Counter`.
+        """
+        return self._register("counter", name, help, labels, Counter)
+
+    def gauge(self, name, help, labels=()):
+        """
+        Register a family of :class:`Gauge`.
+        """
+        return self._register("gauge", name, help, labels, Gauge)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Register a family of :class:`Histogram` with the given buckets.
+        """
+        return self._register("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def get(self, name):
+        """
+        Get a registered family by name, or None.
+        """
+        return self._families.get(name)
+
+    def to_prometheus(self):
+        """
+        Get the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        text : str
+            The metrics, with the ``HELP`` and ``TYPE`` of each family.
+        """
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda family: family.name)
+        lines = []
+        for family in families:
+            samples = []
+            for labels, metric in family.collect():
+                if family.kind == "histogram":
+                    snapshot = metric.snapshot()
+                    for bound, count in snapshot["buckets"].items():
+                        samples.append((f"{family.name}_bucket", dict(labels, le=bound), count))
+                    samples.append((f"{family.name}_sum", labels, snapshot["sum"]))
+                    samples.append((f"{family.name}_count", labels, snapshot["count"]))
+                    continue
+                try:
+                    value = metric.get()
+                except Exception:
+                    logging.getLogger("Metrics").exception(f"Error collecting the metric {family.name}")
+                    continue
+                if value is not None:
+                    samples.append((family.name, labels, value))
+            if not samples:
+                continue
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to a file atomically, e.g. for the textfile collector of the Prometheus node exporter.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def weak_function(obj, function):
+    """
+    Get a function for :meth:`Counter.set_function` that reads a value of an object without keeping it alive.
+
+    Parameters
+    ----------
+    obj : object
+        The object.
+
+    function : callable
+        Gets the value from the object.
+
+    Returns
+    -------
+    read : callable
+        Returns the value, or None once the object is deleted.
+    """
+    ref = weakref.ref(obj)
+
+    def read():
+        obj = ref()
+        return function(obj) if obj is not None else None
+
+    return read
+
+
+class MetricsExporter:
+    """
+    Export the metrics of a registry, served over HTTP on a local port or written periodically to a file.
+
+    Parameters
+    ----------
+    registry : :class:`MetricsRegistry` or None
+        The registry. If None it is the registry of the process, :data:`REGISTRY`.
+
+    port : int or None
+        The port where ``GET /metrics`` returns the metrics. If 0 a free port is chosen, and if None they are not
+        served.
+
+    path : str or None
+        The file where the metrics are written every ``interval`` seconds and when the exporter is closed. If None they
+        are not written.
+
+    interval : float, default 15.0
+        The seconds between two writes of the file.
+
+    host : str, default '127.0.0.1'
+        The interface to listen on.
+
+    Attributes
+    ----------
+    port : int or None
+        The port the metrics are served on.
+    """
+
+    def __init__(self, registry=None, port=None, path=None, interval=15.0, host="127.0.0.1"):
+        self.registry = registry or REGISTRY
+        self.path = path
+        self.interval = interval
+        self.port = None
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), self._handler())
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True))
+        if path is not None:
+            self._threads.append(threading.Thread(target=self._write_loop, name="metrics-file", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                content = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.registry.write(self.path)
+
+    def close(self):
+        """
+        Stop serving the metrics and write the file a last time.
+        """
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.path is not None:
+            self.registry.write(self.path)
+
+
+def add_arguments(parser):
+    """
+    Add the metrics options to the parser of a script, to be passed to :func:`start_from_args`.
+    """
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the Prometheus metrics on this port")
+    parser.add_argument("--metrics-file", default=None, help="write the Prometheus metrics to this file periodically")
+    parser.add_argument(
+        "--metrics-interval", type=float, default=15.0, help="seconds between two writes of the metrics file"
+    )
+
+
+def start_from_args(args):
+    """
+    Start exporting the metrics of the process with the options added by :func:`add_arguments`.
+
+    Returns
+    -------
+    exporter : :class:`MetricsExporter` or None
+        The exporter, or None if the metrics are not exported.
+    """
+    if args.metrics_port is None and args.metrics_file is None:
+        return None
+    return MetricsExporter(port=args.metrics_port, path=args.metrics_file, interval=args.metrics_interval)
@@ -0,0 +1,360 @@
+import atexit
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import wraps
+from multiprocessing import util
+
+from definitions import LOGS_PATH
+
+MODES = ("cprofile", "tracemalloc", "sampling")
+# The methods of the CBR that are profiled, one request each
+METHODS = ("run_query", "evaluate", "learn_evaluations")
+# The environment variables of the configuration, inherited by the worker processes
+MODE_VARIABLE = "CBR_PROFILE"
+THRESHOLD_VARIABLE = "CBR_PROFILE_THRESHOLD_MS"
+DIR_VARIABLE = "CBR_PROFILE_DIR"
+DEFAULT_THRESHOLD_MS = 100.0
+DEFAULT_DIR = os.path.join(LOGS_PATH, "profiles")
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class Profiler:
+    """
+    Profiles the requests of a CBR system, i.e. the calls to the methods of :data:`METHODS`.
+
+    Each request is profiled on its own. The profile of a request slower than the threshold is written to a file named
+    after the process, the number of the request and the method. The profiles of all the requests are also added up
+    and a report of the hottest functions is written when the process exits.
+
+    The modes are:
+
+    - ``cprofile``: deterministic profile of the function calls, written in the :mod:`pstats` format.
+    - ``tracemalloc``: the memory allocated by each line of code during the request and the peak memory, as text.
+    - ``sampling``: the stack of the thread running the request is sampled every millisecond, which has a lower
+      overhead than cProfile. It is written as collapsed stacks, the input format of flame graph tools.
+
+    Requests started while another one is profiled, e.g. an evaluation inside a query, are run without profiling.
+
+    Parameters
+    ----------
+    mode : str
+        The mode, one of :data:`MODES`.
+
+    threshold : float, default 0.1
+        The seconds a request must take to write its profile.
+
+    output_dir : str or None
+        The directory of the profiles. If None it is ``logs/profiles``.
+
+    interval : float, default 0.001
+        The seconds between two samples of the ``sampling`` mode.
+
+    Attributes
+    ----------
+    requests : int
+        The number of profiled requests.
+
+    slow_requests : int
+        The number of requests whose profile was written.
+
+    Examples
+    --------
+    >>> profiler = Profiler("cprofile", threshold=0.05)
+    >>> profiler.instrument(cbr)
+    >>> cbr.run_query(query, "My cocktail")
+    >>> print(profiler.report(limit=10))
+    """
+
+    def __init__(self, mode, threshold=DEFAULT_THRESHOLD_MS / 1000, output_dir=None, interval=0.001):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.threshold = threshold
+        self.output_dir = output_dir or DEFAULT_DIR
+        self.interval = interval
+        self.requests = 0
+        self.slow_requests = 0
+        self.logger = logging.getLogger("Profiling")
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._ids = itertools.count(1)
+        self._stats = None
+        self._totals = Counter()
+        self._written = False
+        self._tracing = mode == "tracemalloc" and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start(16)
+        os.makedirs(self.output_dir, exist_ok=True)
+        atexit.register(self.write_report)
+        # Worker processes of multiprocessing do not run the atexit handlers
+        util.Finalize(self, self.write_report, exitpriority=10)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a profiler configured by the environment variables, see :func:`configure`.
+
+        Returns
+        -------
+        profiler : :class:`Profiler` or None
+            The profiler, or None if profiling is disabled.
+        """
+        mode = os.environ.get(MODE_VARIABLE)
+        if not mode:
+            return None
+        threshold = float(os.environ.get(THRESHOLD_VARIABLE, DEFAULT_THRESHOLD_MS)) / 1000
+        return cls(mode, threshold, os.environ.get(DIR_VARIABLE))
+
+    def instrument(self, cbr):
+        """
+        Profile the requests of a CBR system, replacing its methods of :data:`METHODS` by profiled ones.
+        """
+        for method in METHODS:
+            setattr(cbr, method, self.wrap(getattr(cbr, method), method))
+
+    def wrap(self, function, name=None):
+        """
+        Get a profiled version of a function, each call being a request.
+        """
+        name = name or function.__name__
+
+        @wraps(function)
+        def profiled(*args, **kwargs):
+            if not self._active.acquire(blocking=False):
+                return function(*args, **kwargs)
+            try:
+                return self._profile(function, name, args, kwargs)
+            finally:
+                self._active.release()
+
+        return profiled
+
+    def _profile(self, function, name, args, kwargs):
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                self._record(name, time.perf_counter() - start, profile)
+        elif self.mode == "tracemalloc":
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                self._record(name, elapsed, (tracemalloc.take_snapshot().compare_to(before, "lineno"), peak))
+        else:
+            samples = Counter()
+            done = threading.Event()
+            thread_id = threading.get_ident()
+            sampler = threading.Thread(target=self._sample, args=(thread_id, samples, done), daemon=True)
+            start = time.perf_counter()
+            sampler.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                done.set()
+                sampler.join()
+                self._record(name, time.perf_counter() - start, samples)
+
+    def _sample(self, thread_id, samples, done):
+        while not done.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            samples[";".join(reversed(stack))] += 1
+
+    def _record(self, name, elapsed, profile):
+        with self._lock:
+            self.requests += 1
+            request = next(self._ids)
+            if self.mode == "cprofile":
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            elif self.mode == "tracemalloc":
+                for stat in profile[0]:
+                    if stat.size_diff > 0:
+                        self._totals[str(stat.traceback)] += stat.size_diff
+            else:
+                for stack, count in profile.items():
+                    self._totals[stack] += count
+            if elapsed < self.threshold:
+                return
+            self.slow_requests += 1
+        path = os.path.join(self.output_dir, f"{os.getpid()}-{request}-{name}")
+        if self.mode == "cprofile":
+            path += ".prof"
+            profile.dump_stats(path)
+        elif self.mode == "tracemalloc":
+            path += ".txt"
+            stats, peak = profile
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"{name}: {elapsed * 1000:.1f} ms, peak {peak / 1024:.1f} KiB\n")
+                for stat in stats[:25]:
+                    f.write(f"{stat}\n")
+        else:
+            path += ".folded"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in profile.most_common():
+                    f.write(f"{stack} {count}\n")
+        self.logger.info(f"Profiling: {name} took {elapsed * 1000:.1f} ms, profile written to {path}")
+
+    def hot_functions(self, limit=20):
+        """
+        Get the hottest functions of all the profiled requests.
+
+        Parameters
+        ----------
+        limit : int, default 20
+            The maximum number of functions.
+
+        Returns
+        -------
+        functions : list of tuple
+            The function and its cost, by decreasing cost. The cost is the internal time in seconds for ``cprofile``,
+            the allocated bytes of each line for ``tracemalloc`` and the number of samples with the function on top of
+            the stack for ``sampling``.
+        """
+        with self._lock:
+            if self.mode == "cprofile":
+                if self._stats is None:
+                    return []
+                entries = [(pstats.func_std_string(function), stat[2]) for function, stat in self._stats.stats.items()]
+                return sorted(entries, key=lambda entry: -entry[1])[:limit]
+            if self.mode == "tracemalloc":
+                return self._totals.most_common(limit)
+            functions = Counter()
+            for stack, count in self._totals.items():
+                functions[stack.rsplit(";", 1)[-1]] += count
+            return functions.most_common(limit)
+
+    def report(self, limit=20):
+        """
+        Get a text report of the hottest functions of all the profiled requests, see :meth:`Profiler.hot_functions`.
+        """
+        output = io.StringIO()
+        output.write(
+            f"{self.mode} profile of {self.requests} requests, {self.slow_requests} over {self.threshold * 1000:g} ms\n"
+        )
+        if self.mode == "cprofile" and self._stats is not None:
+            with self._lock:
+                self._stats.stream = output
+                self._stats.sort_stats("tottime").print_stats(limit)
+        else:
+            for function, cost in self.hot_functions(limit):
+                output.write(f"{cost:>12} {function}\n")
+        return output.getvalue()
+
+    def write_report(self):
+        """
+        Write the report of the process to the output directory, once and only if some request was profiled.
+        """
+        if self._written or not self.requests:
+            return
+        self._written = True
+        path = os.path.join(self.output_dir, f"{os.getpid()}-report.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+        if self.mode == "sampling":
+            with open(os.path.join(self.output_dir, f"{os.getpid()}-all.folded"), "w", encoding="utf-8") as f:
+                for stack, count in self._totals.most_common():
+                    f.write(f"{stack} {count}\n")
+
+    def close(self):
+        """
+        Write the report and stop tracing the memory allocations if the profiler started it.
+        """
+        self.write_report()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """
+    Get the profiler of the process configured by the environment variables, creating it on first use.
+
+    Returns
+    -------
+    profiler : :class:`Profiler` or None
+        The profiler, or None if profiling is disabled.
+    """
+    global _profiler
+    if not os.environ.get(MODE_VARIABLE):
+        return None
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler.from_env()
+        return _profiler
+
+
+def configure(mode, threshold_ms=None, output_dir=None):
+    """
+    Enable profiling in this process and in the processes it starts, through the environment variables.
+
+    Parameters
+    ----------
+    mode : str or None
+        The mode, one of :data:`MODES`. If None profiling is left as configured by the environment.
+
+    threshold_ms : float or None
+        The milliseconds a request must take to write its profile. If None it is 100 ms.
+
+    output_dir : str or None
+        The directory of the profiles. If None it is ``logs/profiles``.
+    """
+    if mode is None:
+        return
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {', '.join(MODES)}")
+    os.environ[MODE_VARIABLE] = mode
+    if threshold_ms is not None:
+        os.environ[THRESHOLD_VARIABLE] = str(threshold_ms)
+    if output_dir is not None:
+        os.environ[DIR_VARIABLE] = os.path.abspath(output_dir)
+
+
+def add_arguments(parser):
+    """
+    Add the profiling options to the parser of a script, to be passed to :func:`configure_from_args`.
+    """
+    parser.add_argument("--profile", choices=MODES, default=None, help="profile the queries and evaluations")
+    parser.add_argument(
+        "--profile-threshold",
+        type=float,
+        default=None,
+        help=f"milliseconds a request must take to write its profile, by default {DEFAULT_THRESHOLD_MS:g}",
+    )
+    parser.add_argument("--profile-dir", default=None, help="directory of the profiles, by default logs/profiles")
+
+
+def configure_from_args(args):
+    """
+    Enable profiling with the options added by :func:`add_arguments`.
+    """
+    configure(args.profile, args.profile_threshold, args.profile_dir)
@@ -0,0 +1,70 @@
+import json
+import shutil
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.batch import learn_batch, query_from_record, read_queries, run_batch
+from src.cbr.cbr import CBR
+
+RECORDS = [
+    dict(name="Sour rum", category="cocktail", alc_types=["rum"], ingredients=["lime juice"], score=0.9),
+    dict(name="Sweet vodka", category="cocktail", alc_types=["vodka"], basic_tastes=["sweet"], score=0.2),
+    dict(name="Unknown", category="cocktail", ingredients=["not an ingredient"]),
+]
+
+
+@pytest.fixture
+def case_library_file(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copyfile(CASE_LIBRARY_FILE, case_library_file)
+    return str(case_library_file)
+
+
+def test_read_queries(tmp_path):
+    jsonl_file = tmp_path / "queries.jsonl"
+    jsonl_file.write_text("\n".join(json.dumps(record) for record in RECORDS[:2]) + "\n\n{not json\n")
+    records = list(read_queries(str(jsonl_file)))
+    assert [line for line, _ in records] == [1, 2, 4]
+    assert records[0][1] == RECORDS[0] and "error" in records[2][1]
+
+    csv_file = tmp_path / "queries.csv"
+    csv_file.write_text(
+        "name,category,glass,alc_types,ingredients,score\nSour rum,cocktail,,rum,lime juice; mint,0.9\n"
+    )
+    ((line, record),) = read_queries(str(csv_file))
+    assert record == dict(
+        name="Sour rum", category="cocktail", alc_types=["rum"], ingredients=["lime juice", "mint"], score="0.9"
+    )
+    query, score = query_from_record(record)
+    assert query.ingredients == ["lime juice", "mint"] and query.glass == "" and score == 0.9
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        dict(glass="cocktail glass"),
+        dict(category="cocktail", ingredients="lime juice"),
+        dict(category="cocktail", ingredients=["lime juice"], exc_ingredients=["lime juice"]),
+        dict(category="cocktail", score=7),
+        dict(category="cocktail", colour="red"),
+    ],
+)
+def test_invalid_records(record):
+    with pytest.raises(ValueError):
+        query_from_record(record)
+
+
+def test_run_batch_and_learn(case_library_file):
+    results = list(run_batch(enumerate(RECORDS, start=1), case_library_file, n_workers=0, seed=0, chunk_size=2))
+    assert [result["line"] for result, _ in results] == [1, 2, 3]
+    assert [result["adapted"]["name"] for result, _ in results[:2]] == ["Sour rum", "Sweet vodka"]
+    assert "error" in results[2][0] and results[2][1] is None
+    # The workers do not change the case library
+    assert CBR(case_library_file).case_library.find_case("Sour rum") is None
+
+    cbr = CBR(case_library_file)
+    assert learn_batch(cbr, [evaluation for _, evaluation in results if evaluation is not None]) == 2
+    case_library = CBR(case_library_file).case_library
+    assert case_library.find_case("Sour rum") is not None
+    assert case_library.find_case("Sweet vodka") is None
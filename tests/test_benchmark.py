@@ -0,0 +1,30 @@
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.benchmark import METRICS, compare, format_table, run_suite
+
+
+def test_compare():
+    baseline = dict(default=dict(retrieve=0.010, memory=10000), scaled_2=dict(retrieve=0.020))
+    results = dict(default=dict(retrieve=0.020, memory=10100, adapt=0.001), scaled_2=dict())
+    rows = {(row["library"], row["metric"]): row for row in compare(results, baseline, dict(retrieve=(0.5, 0.001)))}
+    assert rows[("default", "retrieve")]["status"] == "regression"
+    assert rows[("default", "retrieve")]["change"] == 1.0
+    assert rows[("default", "memory")]["status"] == "ok"
+    assert rows[("default", "adapt")]["status"] == "new"
+    assert rows[("scaled_2", "retrieve")]["status"] == "missing"
+
+    improved = compare(dict(default=dict(retrieve=0.002)), dict(default=dict(retrieve=0.010)))
+    assert improved[0]["status"] == "improved"
+    # Changes under the absolute tolerance are noise
+    noise = compare(dict(default=dict(retrieve=0.0002)), dict(default=dict(retrieve=0.0001)))
+    assert noise[0]["status"] == "ok"
+
+
+def test_run_suite():
+    results = run_suite(CASE_LIBRARY_FILE, scale=2, n_queries=4, repeat=1)
+    assert set(results) == {"default", "scaled_2"}
+    for metrics in results.values():
+        assert set(metrics) == set(METRICS)
+        assert all(value > 0 for value in metrics.values())
+    rows = compare(results, results)
+    assert all(row["status"] == "ok" for row in rows)
+    assert "scaled_2" in format_table(rows)
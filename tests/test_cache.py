@@ -0,0 +1,56 @@
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cache import QueryCache
+from src.cbr.cbr import CBR
+from src.entity.query import Query
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE, seed=0)
+
+
+def _query():
+    query = Query()
+    query.set_category("cocktail")
+    query.set_alc_types(["vodka"])
+    query.set_basic_tastes(["sweet"])
+    query.set_exc_ingredients(["mint"])
+    return query
+
+
+def test_query_cache_lru():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", 0, [1, 2], [0.5, 0.25])
+    cache.put("b", 0, [3], [1.0])
+    assert cache.get("a", 0)[0].tolist() == [1, 2]
+    cache.put("c", 0, [4], [0.0])
+    assert cache.get("b", 0) is None
+    assert cache.get("c", 1) is None
+    assert cache.stats() == dict(
+        hits=1, misses=2, evictions=1, invalidations=1, hit_rate=1 / 3, entries=1, bytes=cache.nbytes
+    )
+
+
+def test_query_cache_memory_cap():
+    cache = QueryCache(max_bytes=4096)
+    for key in range(10):
+        cache.put(key, 0, range(100), [0.0] * 100)
+    assert 0 < cache.nbytes <= 4096
+    assert cache.evictions == 10 - len(cache)
+
+
+def test_retrieve_cached(cbr):
+    cbr.retrieve(_query())
+    list_recipes, sim_list = cbr._cached_retrieve()
+    hits = cbr.query_cache.hits
+    cached_recipes, cached_sim_list = cbr._cached_retrieve()
+    assert cbr.query_cache.hits == hits + 1
+    assert cached_recipes == list_recipes
+    assert cached_sim_list == sim_list
+
+    cbr.case_library.set_utility(list_recipes[0], float(list_recipes[0].utility))
+    cbr._cached_retrieve()
+    assert cbr.query_cache.hits == hits + 1
+    assert cbr.query_cache.invalidations == 1
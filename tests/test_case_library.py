@@ -1,6 +1,12 @@
 import pytest
 
-from src.cbr.case_library import ConstraintsBuilder
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import (
+    CaseLibrary,
+    ConstraintsBuilder,
+    ReadOnlyCaseLibraryError,
+    StreamingCaseLibrary,
+)
 
 
 @pytest.fixture
@@ -64,3 +70,47 @@ def test_build(builder):
         builder.build()
         == "./category[@type='cocktail'][@type!='beer']/glass[@type='martini glass']//cocktail[descendant::ingredient[@alc_type='rum' and @alc_type='creamy liqueur']][descendant::ingredient[@basic_taste='cream']][descendant::ingredient[@garnish_type!='leaf(ves)']][descendant::ingredient[text()='banana']][descendant::ingredient[text()='cherry']][descendant::ingredient[text()!='chocolate']]"
     )
+
+
+def test_build_case_test(builder):
+    builder.filter_category(include="cocktail").filter_glass(exclude="shot glass").filter_ingredient(include="banana")
+    assert (
+        builder.build_case_test()
+        == "self::cocktail[ancestor::category[@type='cocktail']][ancestor::glass[@type!='shot glass']][descendant::ingredient[text()='banana']]"
+    )
+
+
+def test_streaming_findall_matches_case_library():
+    builder = ConstraintsBuilder(include_category="cocktail").filter_alc_type(include="vodka")
+    cocktails = CaseLibrary(CASE_LIBRARY_FILE).findall(builder)
+    streamed = StreamingCaseLibrary(CASE_LIBRARY_FILE).findall(builder)
+    assert [cocktail.name.text for cocktail in streamed] == [cocktail.name.text for cocktail in cocktails]
+
+
+def test_streaming_is_read_only():
+    case_library = StreamingCaseLibrary(CASE_LIBRARY_FILE)
+    case = case_library.findall(ConstraintsBuilder(include_category="shot"))[0]
+    with pytest.raises(ReadOnlyCaseLibraryError):
+        case_library.add_case(case)
+    with pytest.raises(ReadOnlyCaseLibraryError):
+        case_library.remove_case(case)
+    with pytest.raises(PermissionError):
+        case_library.save()
+
+
+def test_streaming_top_cases():
+    case_library = StreamingCaseLibrary(CASE_LIBRARY_FILE)
+    constraints = [ConstraintsBuilder(include_category="shot", include_glass="cocktail glass"), ConstraintsBuilder()]
+    cases, scores = case_library.top_cases(constraints, _count_ingredients, k=3)
+    assert len(cases) == 3
+    assert (
+        sorted(scores, reverse=True)
+        == sorted(
+            (_count_ingredients(cocktail) for cocktail in CaseLibrary(CASE_LIBRARY_FILE).findall(".//cocktail")),
+            reverse=True,
+        )[:3]
+    )
+
+
+def _count_ingredients(cocktail):
+    return len(list(cocktail.find("ingredients").iterchildren()))
@@ -0,0 +1,129 @@
+import asyncio
+import shutil
+import threading
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.app.cbr_service import CBRService, request
+from src.cbr.cbr import CBR
+from src.utils.metrics import Histogram
+
+
+@pytest.fixture
+def cbr(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copyfile(CASE_LIBRARY_FILE, case_library_file)
+    return CBR(str(case_library_file), seed=0)
+
+
+def _payload(name):
+    return {"name": name, "category": "cocktail", "alc_types": ["vodka"], "basic_tastes": ["sweet"]}
+
+
+def test_histogram():
+    histogram = Histogram((1, 2, 4))
+    for value in (0.5, 1, 3, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [2, 0, 2, 1]
+    assert histogram.quantile(0.4) == 1
+    assert histogram.quantile(0.8) == 4
+    assert histogram.quantile(1) == 10
+    assert histogram.snapshot()["buckets"] == {"1": 2, "2": 2, "4": 4, "+Inf": 5}
+
+
+def test_service(cbr):
+    async def run():
+        service = CBRService(cbr, batch_window=0.05)
+        port = await service.start(port=0)
+        try:
+            responses = await asyncio.gather(*(request(port, "POST", "/query", _payload(f"R{i}")) for i in range(4)))
+            assert [status for status, _ in responses] == [200] * 4
+            assert [response["adapted"]["name"] for _, response in responses] == ["R0", "R1", "R2", "R3"]
+            assert service.batch_size.count < 4
+
+            status, response = await request(port, "POST", "/evaluate", {"id": responses[0][1]["id"], "score": 0.9})
+            assert (status, response["status"]) == (202, "queued")
+            assert (await request(port, "POST", "/evaluate", {"id": responses[0][1]["id"], "score": 0.9}))[0] == 404
+            assert (await request(port, "POST", "/query", {"name": "R", "category": "unknown"}))[0] == 400
+            assert (await request(port, "GET", "/query"))[0] == 405
+        finally:
+            await service.stop()
+        assert service.evaluations == 1
+        metrics = service.metrics()
+        assert metrics["latency"]["query"]["count"] == 6
+        assert metrics["cache"]["hits"] == 3
+
+    asyncio.run(run())
+
+
+def test_service_backpressure(cbr):
+    async def run():
+        service = CBRService(cbr, batch_window=0, max_batch=1, max_pending=1)
+        await service.start(port=0)
+        blocked = threading.Event()
+        service._executor.submit(blocked.wait)
+        try:
+            tasks = []
+            for i in range(3):
+                tasks.append(
+                    asyncio.create_task(service.handle("POST", "/query", f'{{"name": "R{i}", "category": "cocktail"}}'))
+                )
+                await asyncio.sleep(0.01)
+            blocked.set()
+            statuses = [status for status, _ in await asyncio.gather(*tasks)]
+        finally:
+            blocked.set()
+            await service.stop()
+        assert statuses == [200, 200, 503]
+        assert service.rejected == 1
+
+    asyncio.run(run())
+
+
+def test_service_without_its_workers(cbr):
+    async def run():
+        service = CBRService(cbr, batch_window=0, workers=1)
+        port = await service.start(port=0)
+        try:
+            service.worker_pool._workers[0].kill()
+            status, response = await request(port, "POST", "/query", _payload("R"))
+            assert (status, response["adapted"]["name"]) == (200, "R")
+            assert service.worker_pool is None
+        finally:
+            await service.stop()
+
+    asyncio.run(run())
+
+
+def test_service_batches_evaluations(cbr):
+    batches = []
+    learn_evaluations = cbr.learn_evaluations
+
+    def record(evaluations, write=True):
+        batches.append(len(evaluations))
+        learn_evaluations(evaluations, write)
+
+    cbr.learn_evaluations = record
+
+    async def run():
+        service = CBRService(cbr, batch_window=0)
+        await service.start(port=0)
+        try:
+            ids = []
+            for i in range(3):
+                _, response = await service.handle("POST", "/query", f'{{"name": "R{i}", "category": "cocktail"}}')
+                ids.append(response["id"])
+            blocked = threading.Event()
+            service._executor.submit(blocked.wait)
+            for query_id in ids:
+                assert (await service.handle("POST", "/evaluate", f'{{"id": "{query_id}", "score": 0.2}}'))[0] == 202
+            await asyncio.sleep(0.01)
+            blocked.set()
+        finally:
+            await service.stop()
+        assert service.evaluations == 3
+
+    asyncio.run(run())
+    assert sum(batches) == 3
+    assert len(batches) <= 2
@@ -0,0 +1,57 @@
+import copy
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary, ConstraintsBuilder, StreamingCaseLibrary
+from src.cbr.cbr import CBR
+from src.cbr.completion import FIELDS, CompletionIndex
+
+
+@pytest.fixture
+def case_library():
+    return CaseLibrary(CASE_LIBRARY_FILE)
+
+
+def test_completion_values_match_case_library(case_library):
+    index = CompletionIndex()
+    case_library.register_index(index)
+    for field in FIELDS:
+        assert sorted(index.values(field)) == sorted(map(str, getattr(case_library, field)))
+    values = index.values("ingredients")
+    assert values == sorted(values, key=str.lower)
+    assert index.complete("ingredients", "LIM") == [value for value in values if value.lower().startswith("lim")]
+    assert index.complete("ingredients", "lim", limit=2) == index.complete("ingredients", "lim")[:2]
+    assert index.complete("ingredients", "zzz") == []
+
+
+def test_completion_is_updated_on_learn(case_library):
+    index = CompletionIndex()
+    case_library.register_index(index)
+    case = copy.deepcopy(case_library.findall(ConstraintsBuilder())[0])
+    case.ingredients.ingredient[0]._setText("unobtainium")
+    case_library.add_case(case, write=False)
+    assert index.contains("ingredients", "unobtainium")
+    assert index.suggest("ingredients", "unobtanium")[0] == "unobtainium"
+    case_library.remove_case(case, write=False)
+    assert not index.contains("ingredients", "unobtainium")
+    assert "unobtainium" not in index.complete("ingredients", "un")
+
+
+def test_suggest_corrects_typos(case_library):
+    index = CompletionIndex()
+    case_library.register_index(index)
+    assert index.suggest("alc_types", "wisky")[0] == "whisky"
+    assert index.suggest("glass_types", "cocktial glass")[0] == "cocktail glass"
+    assert index.suggest("ingredients", "") == []
+
+
+def test_streaming_completion_from_value_counter(case_library, monkeypatch):
+    monkeypatch.setattr(StreamingCaseLibrary, "findall", lambda self, constraints: pytest.fail("findall was called"))
+    cbr = CBR(CASE_LIBRARY_FILE, streaming=True, cache_size=0)
+    assert cbr.completion not in cbr.case_library.indexes
+    expected = CompletionIndex()
+    case_library.register_index(expected)
+    for field in FIELDS:
+        assert cbr.completion.values(field) == expected.values(field)
+    assert cbr.completion.suggest("ingredients", "lmon juice") == expected.suggest("ingredients", "lmon juice")
@@ -0,0 +1,52 @@
+import copy
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary, ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.cooccurrence import CooccurrenceIndex
+
+
+@pytest.fixture
+def case_library():
+    return CaseLibrary(CASE_LIBRARY_FILE)
+
+
+def test_cooccurrence_is_updated_on_learn(case_library):
+    index = CooccurrenceIndex()
+    case_library.register_index(index)
+    case = case_library.findall(ConstraintsBuilder())[0]
+    names = {ingredient.text for ingredient in case.ingredients.iterchildren()}
+    first = sorted(names)[0]
+    count = index.counts[first]
+    case_library.add_case(copy.deepcopy(case), write=False)
+    assert index.counts[first] == count + 1
+    case_library.remove_case(case, write=False)
+    rebuilt = CooccurrenceIndex()
+    rebuilt.build(case_library.findall(ConstraintsBuilder()))
+    assert index.counts == rebuilt.counts and index.pairs == rebuilt.pairs and index.groups == rebuilt.groups
+
+
+def test_substitutes_share_alcohol_type_and_basic_taste(case_library):
+    index = CooccurrenceIndex()
+    case_library.register_index(index)
+    substitutes = index.substitutes("lemon juice", "", "sour", context=["vodka"], exclude=["lime juice"])
+    assert substitutes and "lemon juice" not in substitutes and "lime juice" not in substitutes
+    assert all(name in index.groups[("", "sour")] for name in substitutes)
+    scores = [index.pairs[name]["vodka"] for name in substitutes]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_streaming_ranks_by_popularity():
+    cbr = CBR(CASE_LIBRARY_FILE, streaming=True, cache_size=0)
+    index = cbr.cooccurrence
+    # The index is built from the type sets, not from the cases
+    assert index not in cbr.case_library.indexes
+    case_library = cbr.case_library
+    assert not index.pairs
+    candidates = index.candidates(basic_taste="sour", exclude=["lime juice"])
+    assert candidates and "lime juice" not in candidates
+    assert all(case_library.ingredients_onto["non-alcoholic"][name] == "sour" for name in candidates)
+    counts = [case_library.value_counter["ingredients"][name] for name in candidates]
+    assert counts == sorted(counts, reverse=True)
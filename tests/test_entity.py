@@ -0,0 +1,49 @@
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary
+from src.entity.cocktail import Cocktail, CompactCocktail, CompactIngredient
+from src.entity.query import FrozenQuery, Query
+
+
+def test_query_defaults_are_not_shared():
+    query = Query()
+    query.ingredients.append("banana")
+    assert Query().ingredients == []
+
+
+def test_frozen_query_is_hashable():
+    query = Query(category="cocktail", ingredients=["rum", "banana", "rum"])
+    frozen = query.freeze()
+    assert frozen.ingredients == ("rum", "banana", "rum")
+    assert frozen == Query(category="cocktail", ingredients=["banana", "rum", "rum"]).freeze()
+    # A repeated ingredient is counted again by the similarity, so it is a different query
+    assert frozen != Query(category="cocktail", ingredients=["rum", "banana"]).freeze()
+    assert len({frozen, query.freeze()}) == 1
+    assert frozen.to_query() == query
+    with pytest.raises(AttributeError):
+        frozen.category = "shot"
+
+
+def test_frozen_query_is_validated():
+    with pytest.raises(TypeError):
+        FrozenQuery(category=["cocktail"])
+    with pytest.raises(TypeError):
+        FrozenQuery(ingredients="rum")
+
+
+def test_compact_ingredient_is_validated():
+    with pytest.raises(ValueError):
+        CompactIngredient("ingr0", "")
+    with pytest.raises(ValueError):
+        CompactIngredient("ingr0", "rum", quantity=-1)
+    assert str(CompactIngredient("ingr0", "rum", measure="1 oz")) == "1 oz of rum"
+
+
+def test_compact_cocktail_from_store():
+    case_library = CaseLibrary(CASE_LIBRARY_FILE)
+    cocktail = case_library.findall(".//cocktail")[0]
+    row = case_library.case_store.add(cocktail)
+    compact = CompactCocktail.from_store(case_library.case_store, row)
+    assert str(compact) == str(Cocktail().from_element(cocktail))
+    assert not hasattr(compact, "__dict__")
@@ -0,0 +1,40 @@
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.evaluation import (
+    get_jaccard_simmilarity,
+    held_out,
+    leave_one_out,
+    query_from_case,
+)
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE)
+
+
+def test_jaccard_similarity():
+    assert get_jaccard_simmilarity(["gin", "tonic"], ["gin", "lime"]) == 1 / 3
+    assert get_jaccard_simmilarity([], []) == 1.0
+
+
+def test_held_out_restores_case_library(cbr):
+    case_library = cbr.case_library
+    names = [str(case.name) for case in case_library.findall(ConstraintsBuilder())]
+    ingredients = list(case_library.ingredients)
+    case = case_library.find_case(names[3])
+    with held_out(case_library, case):
+        assert case_library.find_case(names[3]) is None
+        query = query_from_case(case, case_library)
+        assert set(query.ingredients) <= set(case_library.ingredients)
+    assert [str(case.name) for case in case_library.findall(ConstraintsBuilder())] == names
+    assert case_library.ingredients == ingredients
+
+
+def test_leave_one_out_does_not_depend_on_workers():
+    reports = [leave_one_out(n_workers=n_workers, limit=6, chunk_size=2) for n_workers in (1, 2)]
+    assert reports[0]["errors"] == 0 and reports[0]["latency"]["count"] == 6
+    assert [case["retrieved"] for case in reports[0]["cases"]] == [case["retrieved"] for case in reports[1]["cases"]]
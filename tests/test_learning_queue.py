@@ -0,0 +1,135 @@
+import copy
+import json
+import shutil
+import threading
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.cbr.learning_queue import BackgroundLearner, evaluation_record, resolve_record
+from src.cbr.loader import CBRLoader
+from src.entity.query import Query
+
+
+@pytest.fixture
+def case_library_file(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copyfile(CASE_LIBRARY_FILE, case_library_file)
+    return str(case_library_file)
+
+
+def _run_queries(cbr, learner, n, start=0):
+    for i in range(start, start + n):
+        query = Query(category="cocktail", alc_types=["vodka"], basic_tastes=["sweet"])
+        with learner.lock:
+            cbr.run_query(query, f"Learned {i}")
+        learner.submit(0.9)
+
+
+def test_background_learner(case_library_file):
+    cbr = CBR(case_library_file, seed=0)
+    learner = BackgroundLearner(cbr, flush_interval=0.05)
+    _run_queries(cbr, learner, 3)
+    learner.close()
+    assert learner.applied == 3
+    assert learner.batches <= 3
+    assert all(cbr.case_library.find_case(f"Learned {i}") is not None for i in range(3))
+    assert CBR(case_library_file).case_library.find_case("Learned 2") is not None
+    with open(learner.journal_file) as f:
+        assert f.read() == ""
+
+
+def test_submit_waits_for_the_batch(case_library_file):
+    cbr = CBR(case_library_file, seed=0)
+    learner = BackgroundLearner(cbr, flush_interval=0.05)
+    with learner.lock:
+        cbr.run_query(Query(category="cocktail", alc_types=["vodka"]), "Learned")
+        # The cases can not be read while a batch is applied
+        submit = threading.Thread(target=learner.submit, args=(0.9,))
+        submit.start()
+        submit.join(0.1)
+        assert submit.is_alive()
+    submit.join()
+    learner.close()
+    assert learner.applied == 1
+
+
+def test_background_learner_recovery(case_library_file):
+    cbr = CBR(case_library_file, seed=0)
+    learner = BackgroundLearner(cbr, flush_interval=0.05)
+    # Journal an evaluation without applying it, as if the process stopped before the batch was applied
+    learner._apply = lambda batch, seq: None
+    learner._compact = lambda seq: None
+    _run_queries(cbr, learner, 1)
+    learner.close()
+    with open(learner.journal_file) as f:
+        record = json.loads(f.readline())
+    assert record["seq"] == 1
+
+    cbr = CBR(case_library_file)
+    learner = BackgroundLearner(cbr)
+    learner.close()
+    assert learner.applied == 1
+    assert CBR(case_library_file).case_library.find_case("Learned 0") is not None
+
+
+def test_background_learner_failure_is_applied_once(case_library_file):
+    cbr = CBR(case_library_file, seed=0)
+    learner = BackgroundLearner(cbr, flush_interval=0.05)
+
+    def fail(batch, write=True):
+        raise OSError("No space left on device")
+
+    cbr.learn_evaluations = fail
+    _run_queries(cbr, learner, 1)
+    learner.flush()
+    assert learner.failed
+    # The learner stays stopped, so the next evaluations are only journaled
+    del cbr.learn_evaluations
+    _run_queries(cbr, learner, 1, start=1)
+    learner.close()
+    assert learner.applied == 0
+    with open(learner.journal_file) as f:
+        journal = f.read()
+    assert [json.loads(line)["seq"] for line in journal.splitlines()] == [1, 2]
+
+    learner = BackgroundLearner(CBR(case_library_file))
+    learner.close()
+    assert learner.applied == 2
+    # Recover the journal again, as if the process stopped before removing it
+    with open(learner.journal_file, "w") as f:
+        f.write(journal)
+    cbr = CBR(case_library_file)
+    assert cbr.case_library.journal_seq == 2
+    learner = BackgroundLearner(cbr)
+    learner.close()
+    assert learner.applied == 0
+    assert [len(cbr.case_library.find_cases(f"Learned {i}")) for i in range(2)] == [1, 1]
+    with open(learner.journal_file) as f:
+        assert f.read() == ""
+
+
+def test_resolve_record_by_key(case_library_file):
+    cbr = CBR(case_library_file, seed=0)
+    cbr.run_query(Query(category="cocktail", alc_types=["vodka"]), "Resolved")
+    record = evaluation_record(0.9, cbr.get_state())
+    # A case with the same name before the retrieved case
+    twin = copy.deepcopy(cbr.retrieved_recipe)
+    twin.ingredients.ingredient.set("measure", "9 oz")
+    cbr.retrieved_recipe.addprevious(twin)
+    assert cbr.case_library.find_case(record["retrieved"]) is twin
+    _, retrieved_recipe, sim_recipes, _ = resolve_record(cbr.case_library, record)
+    assert retrieved_recipe is cbr.retrieved_recipe
+    assert sim_recipes == cbr.sim_recipes
+
+
+def test_loader(case_library_file, tmp_path):
+    loader = CBRLoader(case_library_file=case_library_file)
+    cbr, learner = loader.result(timeout=60)
+    assert loader.ready() and loader.load_time > 0
+    with learner.lock:
+        cbr.run_query(Query(category="cocktail", alc_types=["vodka"]), "Loaded")
+    learner.close()
+    with pytest.raises(OSError):
+        CBRLoader(case_library_file=str(tmp_path / "missing.xml")).result(timeout=60)
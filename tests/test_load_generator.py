@@ -0,0 +1,50 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr import load_generator
+from src.cbr.case_library import CaseLibrary
+from src.cbr.load_generator import QUERY_MIXES, build_query, parse_mix, run_load
+
+
+@pytest.fixture(scope="module")
+def case_library():
+    return CaseLibrary(CASE_LIBRARY_FILE)
+
+
+def test_build_query(case_library):
+    for kind in QUERY_MIXES:
+        queries = [build_query(case_library, random.Random(i), kind) for i in range(20)]
+        assert queries == [build_query(case_library, random.Random(i), kind) for i in range(20)]
+        for query in queries:
+            assert query.category in case_library.drink_types
+            assert not set(query.ingredients) & set(query.exc_ingredients)
+            assert all(isinstance(value, str) for value in query.ingredients + query.alc_types)
+
+
+def test_parse_mix():
+    assert parse_mix("full,tastes=2") == dict(full=1.0, tastes=2.0)
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1")
+
+
+@pytest.mark.parametrize("rate", [None, 50.0])
+def test_run_load(rate):
+    report = run_load(duration=0.5, warmup=0.2, rate=rate, mix="category,ingredients", transcript=True)
+    assert report["n_queries"] > 0 and report["n_errors"] == 0
+    assert report["latency"]["count"] == report["n_queries"] == len(report["transcript"])
+    assert report["latency"]["p50"] <= report["latency"]["p99"] <= report["latency"]["max"]
+    assert set(report["kinds"]) == {"category", "ingredients"}
+
+
+def test_open_load_raises_the_errors_of_the_pool(monkeypatch):
+    def broken(i, transcript=False):
+        raise BrokenProcessPool("A worker died.")
+
+    monkeypatch.setattr(load_generator, "_run_query", broken)
+    with ThreadPoolExecutor(2) as pool:
+        with pytest.raises(BrokenProcessPool):
+            load_generator._open(pool, 100.0, 0.0, 0.05, 0, False)
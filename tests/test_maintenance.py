@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.maintenance import CaseMatrix, _case_query, plan_compaction
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE)
+
+
+def test_pairwise_similarity_matches_retrieval_similarity(cbr):
+    case_library = cbr.case_library
+    case_store = case_library.case_store
+    rows = case_store.rows(case_library.findall(ConstraintsBuilder()))
+    case_matrix = CaseMatrix(case_store, rows)
+    _, sim = next(case_matrix.similarity(cbr.sim_weights, block_size=16))
+    for i in range(16):
+        query = case_library.vocabulary.encode_query(_case_query(case_store, rows[i]), case_library.ingredients_onto)
+        expected = case_store.similarity(query, cbr.sim_weights, rows) / case_matrix.utility
+        np.testing.assert_allclose(sim[i], expected)
+
+
+def test_plan_compaction_keeps_competence():
+    # Case 0 is solved by 1 and 2, case 1 by 2 and case 2 by none
+    solvers = [np.array([1, 2]), np.array([2]), np.array([], dtype=int)]
+    utility = np.ones(3)
+    adapted = np.zeros(3, dtype=bool)
+    removed, support = plan_compaction(solvers, utility, adapted)
+    assert removed == [(0, True), (1, True)] and support.tolist() == [1, 1, 0]
+    removed, _ = plan_compaction(solvers, utility, adapted, target_size=2)
+    assert removed == [(0, True)]
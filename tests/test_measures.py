@@ -0,0 +1,45 @@
+import copy
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary, ConstraintsBuilder, StreamingCaseLibrary
+from src.cbr.measures import MeasureIndex
+
+
+@pytest.fixture
+def case_library():
+    return CaseLibrary(CASE_LIBRARY_FILE)
+
+
+def test_measures_are_updated_on_learn(case_library):
+    index = MeasureIndex()
+    case_library.register_index(index)
+    case = case_library.findall(ConstraintsBuilder())[0]
+    name = case.ingredients.ingredient.text
+    most_common = index.most_common(name)
+    case_library.add_case(copy.deepcopy(case), write=False)
+    case_library.remove_case(case, write=False)
+    assert index.most_common(name) == most_common
+    rebuilt = MeasureIndex()
+    rebuilt.build(case_library.findall(ConstraintsBuilder()))
+    assert index.measures == rebuilt.measures
+
+
+def test_most_common_measure_and_median_quantity():
+    index = MeasureIndex()
+    index.measures["gin"].update({("1 oz", 30.0, "ml"): 3, ("2 oz", 60.0, "ml"): 2, ("", 0.0, ""): 9})
+    index.measures["gin"][("1 shot", 25.0, "ml")] = 1
+    assert index.most_common("gin") == ("1 oz", 30.0, "ml")
+    assert index.most_common("tonic") is None
+    assert index.median("gin", "ml") == 30.0
+    assert index.median("gin", "gr") is None
+
+
+def test_streaming_builds_measures_without_findall(case_library, monkeypatch):
+    monkeypatch.setattr(StreamingCaseLibrary, "findall", lambda self, constraints: pytest.fail("findall was called"))
+    index = MeasureIndex()
+    StreamingCaseLibrary(CASE_LIBRARY_FILE).register_index(index)
+    expected = MeasureIndex()
+    case_library.register_index(expected)
+    assert index.measures == expected.measures
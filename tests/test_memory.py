@@ -0,0 +1,81 @@
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary, ConstraintsBuilder, ShardedCaseLibrary
+from src.cbr.cbr import CBR
+from src.cbr.memory_benchmark import memory_growth
+from src.entity.query import Query
+from src.utils.memory import deep_sizeof
+
+
+def test_deep_sizeof():
+    shared = list(range(1000))
+    seen = set()
+    nbytes = deep_sizeof(dict(a=shared), seen)
+    assert nbytes > deep_sizeof(shared)
+    # The shared list is only counted once
+    assert deep_sizeof([shared], seen) < deep_sizeof(shared)
+
+
+def test_memory_report():
+    case_library = CaseLibrary(CASE_LIBRARY_FILE)
+    report = case_library.memory_report()
+    assert report["n_cases"] == 473
+    assert set(report["components"]) >= {"tree", "value_counter", "ingredients_onto", "type_lists", "case_store"}
+    assert all(nbytes > 0 for nbytes in report["components"].values())
+    assert report["total"] == sum(report["components"].values())
+    assert report["per_case"]["total"] == report["total"] / 473
+
+
+def test_sharded_memory_report(tmp_path):
+    ShardedCaseLibrary.from_case_library(CASE_LIBRARY_FILE, str(tmp_path))
+    case_library = ShardedCaseLibrary(str(tmp_path))
+    before = case_library.memory_report()
+    assert before["n_cases"] == 473
+    case_library.findall(ConstraintsBuilder(include_category="cocktail"))
+    assert case_library.memory_report()["components"]["tree"] > before["components"]["tree"]
+
+
+def test_memory_budget():
+    cbr = CBR(CASE_LIBRARY_FILE, seed=0)
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Cached")
+    report = cbr.memory_report()
+    assert {"CooccurrenceIndex", "MeasureIndex", "CompletionIndex", "NeighbourIndex", "query_cache"} <= set(
+        report["components"]
+    )
+    assert cbr.enforce_memory_budget() == []
+
+    cbr.memory_budget = report["total"] + 1
+    assert cbr.enforce_memory_budget() == []
+
+    cbr.memory_budget = 1
+    assert cbr.enforce_memory_budget() == ["clear caches", "compact trees", "disable query cache", "drop neighbours"]
+    assert cbr.query_cache is None and cbr.neighbours is None
+    assert cbr.memory_report()["total"] < report["total"]
+    # The CBR still works without the caches and the graph of neighbours
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Compact")
+
+
+def test_memory_growth():
+    first, second = memory_growth(CASE_LIBRARY_FILE, (1, 2), n_neighbours=0)
+    assert second["n_cases"] == 2 * first["n_cases"]
+    assert second["total"] > first["total"]
+    assert first["marginal_bytes_per_case"] is None
+    assert 0 < second["marginal_bytes_per_case"] < first["bytes_per_case"]
+
+
+def test_memory_budget_after_learning():
+    cbr = CBR(CASE_LIBRARY_FILE, seed=0, memory_budget=10**12)
+    reports = []
+    memory_report = cbr.memory_report
+    cbr.memory_report = lambda: reports.append(1) or memory_report()
+
+    def learn(name):
+        cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), name)
+        cbr.learn_evaluations([(0.9, cbr.get_state())], write=False)
+
+    learn("Learned 0")
+    assert reports == []
+    # The estimate grown by the learned case exceeds the budget, so the memory is measured
+    cbr.memory_budget = cbr._memory_estimate + 1
+    learn("Learned 1")
+    assert reports
+    assert cbr._learned_since_check == 0
@@ -0,0 +1,94 @@
+import shutil
+import urllib.request
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.entity.query import Query
+from src.utils.metrics import REGISTRY, MetricsExporter, MetricsRegistry, weak_function
+
+
+def _samples(text):
+    samples = dict()
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_prometheus_format():
+    registry = MetricsRegistry()
+    queries = registry.counter("cbr_queries_total", "Queries.")
+    queries.inc()
+    queries.inc(2)
+    steps = registry.histogram("cbr_step_duration_seconds", "Steps.", labels=("step",), buckets=(0.1, 1.0))
+    steps.labels("retrieve").observe(0.05)
+    steps.labels(step="retrieve").observe(0.5)
+    registry.gauge("cbr_cases", "Cases.").set_function(lambda: None)
+    assert registry.counter("cbr_queries_total", "Queries.") is queries
+    with pytest.raises(ValueError):
+        registry.gauge("cbr_queries_total", "Queries.")
+
+    text = registry.to_prometheus()
+    assert "# TYPE cbr_queries_total counter" in text
+    assert "# TYPE cbr_step_duration_seconds histogram" in text
+    # Metrics without a value are not reported
+    assert "cbr_cases" not in text
+    samples = _samples(text)
+    assert samples["cbr_queries_total"] == 3
+    assert samples['cbr_step_duration_seconds_bucket{step="retrieve",le="0.1"}'] == 1
+    assert samples['cbr_step_duration_seconds_bucket{step="retrieve",le="+Inf"}'] == 2
+    assert samples['cbr_step_duration_seconds_count{step="retrieve"}'] == 2
+    assert samples['cbr_step_duration_seconds_sum{step="retrieve"}'] == pytest.approx(0.55)
+
+
+def test_weak_function():
+    class Owner:
+        value = 3
+
+    owner = Owner()
+    read = weak_function(owner, lambda obj: obj.value)
+    assert read() == 3
+    del owner
+    assert read() is None
+
+
+def test_exporter(tmp_path):
+    registry = MetricsRegistry()
+    registry.gauge("gui_load_seconds", "Load.").set(1.5)
+    path = tmp_path / "cbr.prom"
+    exporter = MetricsExporter(registry, port=0, path=str(path), interval=60)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{exporter.port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert _samples(response.read().decode())["gui_load_seconds"] == 1.5
+    finally:
+        exporter.close()
+    assert _samples(path.read_text())["gui_load_seconds"] == 1.5
+
+
+def test_cbr_metrics(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copy(CASE_LIBRARY_FILE, case_library_file)
+    before = _samples(REGISTRY.to_prometheus())
+    cbr = CBR(str(case_library_file), seed=0)
+    query = Query(category="cocktail", ingredients=["lime juice"])
+    cbr.run_query(query, "Measured")
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Cached")
+    cbr.evaluate(0.9)
+    after = _samples(REGISTRY.to_prometheus())
+
+    def delta(name):
+        return after[name] - before.get(name, 0)
+
+    assert delta("cbr_queries_total") == 2
+    assert delta('cbr_step_duration_seconds_count{step="retrieve"}') == 2
+    assert delta('cbr_step_duration_seconds_count{step="adapt"}') == 2
+    assert delta('cbr_step_duration_seconds_count{step="learn"}') == 1
+    assert delta("cbr_candidates_count") == 2
+    assert delta('cbr_evaluations_total{evaluation="success"}') == 1
+    assert delta("cbr_learned_cases_total") == 1
+    assert after["cbr_cases"] == 474 - delta("cbr_forgotten_cases_total")
+    assert after["cbr_query_cache_hits_total"] == cbr.query_cache.hits
@@ -0,0 +1,46 @@
+import copy
+
+import numpy as np
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import CaseLibrary, ConstraintsBuilder
+from src.cbr.cbr import CBR
+from src.cbr.neighbours import CaseMatrix, NeighbourIndex
+
+
+@pytest.fixture
+def case_library():
+    return CaseLibrary(CASE_LIBRARY_FILE)
+
+
+@pytest.fixture(scope="module")
+def weights():
+    return CBR(CASE_LIBRARY_FILE, n_neighbours=0).sim_weights
+
+
+def test_local_similarity_matches_case_matrix(case_library, weights):
+    index = NeighbourIndex(case_library.case_store, weights)
+    rows = case_library.case_store.rows(case_library.findall(ConstraintsBuilder()))
+    _, sim = next(CaseMatrix(case_library.case_store, rows).similarity(weights, block_size=8))
+    np.testing.assert_allclose(index._similarity_from(rows[:8].tolist(), rows), sim)
+    for i in range(8):
+        np.testing.assert_allclose(index._similarity_to(int(rows[i]), rows[:8]), sim[:, i])
+
+
+def test_neighbours_are_updated_on_learn(case_library, weights):
+    index = NeighbourIndex(case_library.case_store, weights, k=4)
+    case_library.register_index(index)
+    cases = case_library.findall(ConstraintsBuilder())
+    for case in cases[:10]:
+        case_library.remove_case(case, write=False)
+    for case in cases[:5]:
+        case_library.add_case(copy.deepcopy(case), write=False)
+    rebuilt = NeighbourIndex(case_library.case_store, weights, k=4)
+    rebuilt.build(case_library.findall(ConstraintsBuilder()))
+    assert index.neighbours.keys() == rebuilt.neighbours.keys()
+    for row, similarities in rebuilt.similarities.items():
+        np.testing.assert_allclose(index.similarities[row], similarities)
+        for neighbour in index.neighbours[row].tolist():
+            assert row in index.reverse[neighbour]
+    assert all(case not in index.neighbours_of(cases[10]) for case in cases[:10])
@@ -0,0 +1,34 @@
+import os
+import pstats
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.entity.query import Query
+from src.utils.profiling import MODE_VARIABLE, Profiler, get_profiler
+
+
+@pytest.fixture
+def cbr():
+    return CBR(CASE_LIBRARY_FILE, seed=0)
+
+
+@pytest.mark.parametrize("mode", ["cprofile", "tracemalloc", "sampling"])
+def test_profiler(cbr, tmp_path, mode, monkeypatch):
+    profiler = Profiler(mode, threshold=0, output_dir=str(tmp_path))
+    monkeypatch.setattr(cbr, "run_query", profiler.wrap(cbr.run_query))
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Profiled")
+    assert profiler.requests == profiler.slow_requests == 1
+    (profile,) = os.listdir(tmp_path)
+    if mode == "cprofile":
+        assert pstats.Stats(str(tmp_path / profile)).total_calls > 0
+    assert profiler.hot_functions(limit=5)
+    profiler.close()
+    assert f"{os.getpid()}-report.txt" in os.listdir(tmp_path)
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv(MODE_VARIABLE, raising=False)
+    assert get_profiler() is None
+    assert "run_query" not in vars(CBR(CASE_LIBRARY_FILE, n_neighbours=0))
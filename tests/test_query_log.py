@@ -0,0 +1,50 @@
+import random
+import shutil
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.cbr.load_generator import build_query
+from src.cbr.query_log import read_query_log
+from src.cbr.replay import replay
+
+
+@pytest.fixture
+def case_library_file(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copyfile(CASE_LIBRARY_FILE, case_library_file)
+    return str(case_library_file)
+
+
+def test_replay_is_deterministic(case_library_file, tmp_path):
+    log_file = str(tmp_path / "queries.jsonl")
+    cbr = CBR(case_library_file, seed=1, query_log=log_file)
+    rng = random.Random(0)
+    evaluations = []
+    for i in range(12):
+        cbr.run_query(build_query(cbr.case_library, rng, "ingredients"), f"Replayed {i}")
+        evaluations.append((0.9 if i % 2 else 0.1, cbr.get_state()))
+        if len(evaluations) == 4:
+            cbr.learn_evaluations(evaluations, write=False)
+            evaluations = []
+    cbr.query_log.close()
+
+    events = list(read_query_log(log_file))
+    assert [event["type"] for event in events[:2]] == ["start", "query"]
+    assert sum(event["type"] == "evaluations" for event in events) == 3
+    assert all(evaluation["id"] for event in events[1:] for evaluation in event.get("evaluations", []))
+
+    report = replay(events, CASE_LIBRARY_FILE)
+    assert report["deterministic"] and report["n_queries"] == 12 and report["n_evaluations"] == 12
+    assert not report["mismatched_sessions"] and not report["unmatched_evaluations"]
+
+    # A different result is reported
+    query_event = [event for event in events if event["type"] == "query"][5]
+    name = query_event["retrieved"]
+    query_event["retrieved"] = "Another case"
+    assert [mismatch["fields"] for mismatch in replay(events, CASE_LIBRARY_FILE)["mismatches"]] == [["retrieved"]]
+
+    # Another case with the same name is reported too
+    query_event["retrieved"], query_event["retrieved_key"] = name, "another key"
+    assert [mismatch["fields"] for mismatch in replay(events, CASE_LIBRARY_FILE)["mismatches"]] == [["retrieved_key"]]
@@ -0,0 +1,84 @@
+import copy
+
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.case_library import (
+    CaseLibrary,
+    ConstraintsBuilder,
+    ShardedCaseLibrary,
+    load_case_library,
+)
+from src.cbr.cbr import CBR
+from src.cbr.cooccurrence import CooccurrenceIndex
+from src.cbr.measures import MeasureIndex
+from src.entity.query import Query
+
+
+@pytest.fixture
+def shards_dir(tmp_path):
+    ShardedCaseLibrary.from_case_library(CASE_LIBRARY_FILE, tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def sharded(shards_dir):
+    return ShardedCaseLibrary(shards_dir)
+
+
+def test_type_sets_match_case_library(sharded):
+    case_library = CaseLibrary(CASE_LIBRARY_FILE)
+    assert sharded.value_counter == case_library.value_counter
+    assert sharded.ingredients_onto == case_library.ingredients_onto
+    assert sharded.ingredients == case_library.ingredients
+
+
+def test_no_shard_loaded_on_init(sharded):
+    assert not sharded.shards
+
+
+def test_findall_only_loads_category_shards(sharded):
+    cocktails = sharded.findall(ConstraintsBuilder(include_category="cocktail").filter_alc_type(include="vodka"))
+    assert cocktails and all(cocktail.category == "cocktail" for cocktail in cocktails)
+    assert {category for category, _ in sharded.shards} == {"cocktail"}
+
+
+def test_load_case_library_from_directory(shards_dir):
+    assert isinstance(load_case_library(shards_dir), ShardedCaseLibrary)
+    assert type(load_case_library(CASE_LIBRARY_FILE)) is CaseLibrary
+
+
+def test_add_case_only_writes_its_shard(shards_dir, sharded):
+    case = sharded.findall(ConstraintsBuilder(include_category="shot", include_glass="shot glass"))[0]
+    files = {path.name: path.stat().st_mtime_ns for path in shards_dir.iterdir()}
+    glass_node = sharded._glass_node("shot", "shot glass")
+    n_cases = int(glass_node.attrib["cases"])
+
+    sharded.add_case(copy.deepcopy(case))
+
+    changed = {path.name for path in shards_dir.iterdir() if path.stat().st_mtime_ns != files[path.name]}
+    assert changed <= {ShardedCaseLibrary.MANIFEST_FILE, glass_node.attrib["file"]}
+    assert int(ShardedCaseLibrary(shards_dir)._glass_node("shot", "shot glass").attrib["cases"]) == n_cases + 1
+
+
+def test_cbr_does_not_load_shards(shards_dir):
+    cbr = CBR(str(shards_dir), cache_size=0)
+    assert cbr.case_library.shards == dict()
+    assert cbr.completion.values("ingredients") == sorted(cbr.case_library.ingredients, key=str.lower)
+    cbr.run_query(Query(category="shot"), "Sharded")
+    assert set(cbr.case_library.shards) == {key for key in cbr.case_library.shards if key[0] == "shot"}
+
+
+def test_indexes_grow_with_the_loaded_shards(shards_dir, sharded):
+    index = MeasureIndex()
+    sharded.register_index(index)
+    assert not index.measures
+    cases = sharded.findall(ConstraintsBuilder(include_category="shot"))
+    expected = MeasureIndex()
+    expected.build(cases)
+    assert index.measures == expected.measures
+    cooccurrence = CooccurrenceIndex()
+    sharded.register_index(cooccurrence)
+    expected = CooccurrenceIndex()
+    expected.build(cases)
+    assert cooccurrence.counts == expected.counts
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.cbr.tuning import TuningProblem, WeightTuner, save_weights, weights_to_array
+from src.entity.query import Query
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE)
+
+
+def test_match_counts_give_similarity(cbr):
+    query = Query(
+        "cocktail", "cocktail glass", ["orange juice", "lime juice"], ["mint"], ["vodka"], ["tequila"], ["sweet"]
+    )
+    case_library = cbr.case_library
+    case_store = case_library.case_store
+    encoded = case_library.vocabulary.encode_query(query, case_library.ingredients_onto)
+    rows = case_store.rows(case_library.findall(".//cocktail"))
+    counts, norm = case_store.match_counts(encoded, rows)
+    weights = weights_to_array(cbr.sim_weights)
+    expected = case_store.similarity(encoded, cbr.sim_weights, rows)
+    np.testing.assert_allclose(counts @ weights / (norm @ weights) * np.array(case_store.utility)[rows], expected)
+
+
+def test_weight_tuner_improves_score(cbr, tmp_path):
+    problem = TuningProblem.from_case_library(cbr.case_library)
+    weights = np.stack([weights_to_array(cbr.sim_weights), np.linspace(-1, 1, len(cbr.sim_weights))])
+    np.testing.assert_allclose(problem.score(weights), [problem.score(weights[0])[0], problem.score(weights[1])[0]])
+    with WeightTuner(problem, cbr.sim_weights, n_workers=0) as tuner:
+        tuner.random_search(64)
+        assert tuner.best_score >= tuner.baseline_score
+    weights_file = tmp_path / "sim_weights.json"
+    save_weights(weights_file, tuner.best_weights, score=tuner.best_score)
+    assert CBR(CASE_LIBRARY_FILE, weights_file=weights_file).sim_weights == tuner.best_weights
+    save_weights(weights_file, dict(unknown=1.0))
+    with pytest.raises(ValueError):
+        cbr.load_weights(weights_file)
@@ -0,0 +1,102 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR
+from src.cbr.vocabulary import COUNTERS, CaseStore, Vocabulary, compute_utility
+from src.entity.query import Query
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE)
+
+
+@pytest.fixture
+def query():
+    query = Query()
+    query.set_category("cocktail")
+    query.set_glass("cocktail glass")
+    query.set_alc_types(["vodka", "rum"])
+    query.set_basic_tastes(["sweet"])
+    query.set_ingredients(["orange juice", "lime juice"])
+    query.set_exc_ingredients(["mint", "gin"])
+    query.set_exc_alc_types(["tequila"])
+    return query
+
+
+def test_vocabulary_ids():
+    vocabulary = Vocabulary()
+    assert vocabulary.id("ingredients", "") == 0
+    assert vocabulary.add("ingredients", "vodka") == vocabulary.add("ingredients", "vodka") == 1
+    assert vocabulary.id("alc_types", "vodka") == -1
+    assert vocabulary.value("ingredients", 1) == "vodka"
+
+
+def test_vectorized_similarity_matches_similarity_cocktail(cbr, query):
+    cbr.query = query
+    cocktails = cbr.case_library.findall(".//cocktail")
+    assert cbr._similarity_cocktails(cocktails) == [cbr._similarity_cocktail(cocktail) for cocktail in cocktails]
+
+
+def test_case_store_rows(cbr):
+    case_store = CaseStore(cbr.case_library.vocabulary)
+    cocktails = cbr.case_library.findall(".//cocktail")[:3]
+    assert case_store.rows(cocktails).tolist() == [0, 1, 2]
+    case_store.remove(cocktails[1])
+    assert case_store.row(cocktails[1]) is None and case_store.alive.tolist() == [1, 0, 1]
+    assert case_store.offsets[3] == sum(len(list(cocktail.ingredients.iterchildren())) for cocktail in cocktails)
+
+
+def test_record_feedback_matches_compute_utility(cbr):
+    case_store = CaseStore(cbr.case_library.vocabulary)
+    cocktails = cbr.case_library.findall(".//cocktail")[:3]
+    counters = [[int(cocktail.findtext(name)) for name in COUNTERS] for cocktail in cocktails]
+    rows = case_store.rows(cocktails)
+    updated = case_store.record_feedback(rows[[0, 1]], [rows[[1, 2]], rows[[0]]], np.array([True, False]))
+    UaS, UaF, success_count, failure_count = counters[0]
+    assert updated.tolist() == [0, 1, 2] and case_store.dirty.tolist() == [1, 1, 1]
+    assert case_store.UaS[0] == UaS + 1 and case_store.success_count[0] == success_count + 1
+    assert case_store.UaF[0] == UaF and case_store.failure_count[0] == failure_count + 1
+    assert case_store.utility[0] == compute_utility(UaS + 1, UaF, success_count + 1, failure_count + 1)
+
+
+def test_evaluate_after_the_retrieved_case_is_removed(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copy(CASE_LIBRARY_FILE, case_library_file)
+    cbr = CBR(str(case_library_file), seed=0)
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Removed")
+    case_store = cbr.case_library.case_store
+    n_rows = len(case_store.alive)
+    similar = case_store.find_rows(cbr.sim_recipes)
+    before = [case_store.failure_count[row] for row in similar if row >= 0]
+    cbr.case_library.remove_case(cbr.retrieved_recipe, write=False)
+    assert case_store.find_rows([cbr.retrieved_recipe]).tolist() == [-1]
+    cbr.record_evaluation(0.1)
+    # The removed case is not added back to the store, but its similar cases are updated
+    assert len(case_store.alive) == n_rows and case_store.row(cbr.retrieved_recipe) is None
+    assert [case_store.failure_count[row] for row in similar if row >= 0] == [count + 1 for count in before]
+    cbr.forget_cases(write=False)
+
+
+def test_retrieve_batch_matches_retrieve(tmp_path):
+    case_library_file = tmp_path / "case_library.xml"
+    shutil.copy(CASE_LIBRARY_FILE, case_library_file)
+    cbr = CBR(str(case_library_file), seed=0, cache_size=0)
+    # A learned case is the last row of the case store but not the last case of the case library
+    cbr.run_query(Query(category="cocktail", ingredients=["lime juice"]), "Learned")
+    cbr.evaluate(0.9)
+    queries = [
+        Query(category="cocktail"),
+        Query(category="shot", glass="shot glass"),
+        Query(category="cocktail", ingredients=["lime juice"], exc_ingredients=["gin"]),
+        Query(category="ordinary drink", alc_types=["vodka"], basic_tastes=["sweet"]),
+        Query(category="cocktail", alc_types=["vodka", "rum"], exc_alc_types=["tequila"]),
+        Query(category="cocktail", ingredients=["lime juice"], exc_ingredients=["gin"]),
+    ]
+    candidates = cbr.retrieve_batch(queries)
+    for query, (list_recipes, sim_list) in zip(queries, candidates):
+        cbr.query = query
+        assert (list_recipes, sim_list) == cbr._cached_retrieve()
@@ -0,0 +1,113 @@
+import pytest
+
+from definitions import CASE_LIBRARY_FILE
+from src.cbr.cbr import CBR, RELAXATION_LEVEL
+from src.cbr.worker_pool import BrokenWorkerPool, SharedCaseStore, WorkerPool
+from src.entity.query import Query
+
+
+@pytest.fixture(scope="module")
+def cbr():
+    return CBR(CASE_LIBRARY_FILE, cache_size=0)
+
+
+def _queries():
+    queries = [Query(category="cocktail"), Query(category="shot", glass="shot glass")]
+    queries.append(Query(category="cocktail", ingredients=["lime juice"], exc_ingredients=["gin"]))
+    queries.append(Query(category="ordinary drink", alc_types=["vodka"], basic_tastes=["sweet"]))
+    queries.append(Query(category="cocktail", alc_types=["vodka", "rum"], exc_alc_types=["tequila"]))
+    return queries
+
+
+def test_shared_case_store(cbr):
+    case_store = cbr.case_library.case_store
+    case_store.rows(cbr.case_library.findall(".//cocktail"))
+    store = SharedCaseStore.publish(case_store, cbr.case_library.ingredients_onto, 1)
+    try:
+        attached = SharedCaseStore.attach(store.shm.name)
+        assert attached.version == 1
+        assert attached.ingredients.tolist() == case_store.ingredients.tolist()
+        assert attached.utility.tolist() == case_store.utility.tolist()
+        assert attached.vocabulary.values == case_store.vocabulary.values
+        attached.close()
+    finally:
+        store.close()
+        store.shm.unlink()
+
+
+def test_worker_pool(cbr):
+    queries = _queries()
+    with WorkerPool(cbr.case_library, 2) as pool:
+        candidates = pool.map(queries, cbr.sim_weights)
+        for query, (list_recipes, sim_list) in zip(queries, candidates):
+            cbr.query = query
+            assert (list_recipes, sim_list) == cbr._cached_retrieve()
+
+        cbr.case_library.set_utility(candidates[0][0][0], 0.5)
+        list_recipes, sim_list = pool.map(queries[:1], cbr.sim_weights)[0]
+        assert pool.store.version == 1
+        cbr.query = queries[0]
+        assert (list_recipes, sim_list) == cbr._cached_retrieve()
+
+        cbr.case_library.remove_case(candidates[0][0][0], write=False)
+        list_recipes, sim_list = pool.map(queries[:1], cbr.sim_weights)[0]
+        assert pool.store.version == 2
+        cbr.query = queries[0]
+        assert (list_recipes, sim_list) == cbr._cached_retrieve()
+
+
+def test_worker_pool_query_cache():
+    cbr = CBR(CASE_LIBRARY_FILE, seed=0)
+    queries = _queries()
+    with WorkerPool(cbr.case_library, 2) as pool:
+        observed = RELAXATION_LEVEL.count
+        candidates = pool.map(queries, cbr.sim_weights, cbr.query_cache)
+        assert RELAXATION_LEVEL.count == observed + len(queries)
+        assert cbr.query_cache.hits == 0
+        assert pool.map(queries, cbr.sim_weights, cbr.query_cache) == candidates
+        assert cbr.query_cache.hits == len(queries)
+        assert RELAXATION_LEVEL.count == observed + len(queries)
+    cbr.query = queries[2]
+    assert cbr._cached_retrieve() == candidates[2]
+    assert cbr.query_cache.hits == len(queries) + 1
+
+
+def test_worker_pool_publishes_recorded_evaluations():
+    cbr = CBR(CASE_LIBRARY_FILE, cache_size=0, seed=0)
+
+    def query():
+        return Query(category="cocktail", ingredients=["lime juice"])
+
+    with WorkerPool(cbr.case_library, 1) as pool:
+        pool.map([query()], cbr.sim_weights)
+        for _ in range(3):
+            cbr.run_query(query(), "Failure")
+            cbr.record_evaluation(0.1)
+        list_recipes, sim_list = pool.map([query()], cbr.sim_weights)[0]
+        assert pool.store.version == 1
+        cbr.query = query()
+        assert (list_recipes, sim_list) == cbr._cached_retrieve()
+        assert any(sim_list)
+
+
+def test_worker_pool_raises_when_a_worker_dies(cbr):
+    with WorkerPool(cbr.case_library, 1, timeout=5) as pool:
+        pool._workers[0].kill()
+        pool._workers[0].join()
+        with pytest.raises(BrokenWorkerPool):
+            pool.map(_queries(), cbr.sim_weights)
+        with pytest.raises(BrokenWorkerPool):
+            pool.map(_queries(), cbr.sim_weights)
+
+
+def test_evaluation_of_worker_candidates_without_neighbours():
+    cbr = CBR(CASE_LIBRARY_FILE, cache_size=0, n_neighbours=0, seed=0)
+    query = Query(category="cocktail", ingredients=["lime juice"])
+    with WorkerPool(cbr.case_library, 1) as pool:
+        candidates = pool.map([query], cbr.sim_weights)[0]
+    cbr.run_query(query, "Failure", candidates)
+    cases = [cbr.retrieved_recipe] + cbr.sim_recipes
+    before = [int(case.findtext("failure_count")) for case in cases]
+    cbr.record_evaluation(0.1)
+    cbr.case_library.sync_counters(cases)
+    assert [int(case.findtext("failure_count")) for case in cases] == [count + 1 for count in before]